@@ -0,0 +1,137 @@
+"""Shared OpenAI client - one connection pool per process instead of per request."""
+
+import importlib.util
+import logging
+from typing import Any
+
+import httpx
+from openai import AsyncOpenAI, AsyncAzureOpenAI, DefaultAsyncHttpxClient, RateLimitError
+
+from src.config.loader import get_settings
+from src.utils.rate_limit import ConcurrencyLimiter
+
+logger = logging.getLogger(__name__)
+
+
+# =============================================================================
+# Connection Pooling - Shared OpenAI Client
+# =============================================================================
+
+_clients: dict[str, AsyncOpenAI] = {}
+
+# HTTP/2 lets concurrent calls share one connection; needs the optional h2 package
+# (pip install "kulturarv-mcp-server[http2]"), otherwise httpx speaks HTTP/1.1
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def _create_http_client() -> httpx.AsyncClient:
+    """Create the httpx client behind an OpenAI client, sized for chat traffic.
+    
+    Keeps one idle connection per completion slot for a minute (httpx's default is
+    5 seconds), so a quiet moment between chats doesn't cost a new TLS handshake.
+    Open connections are bounded by the in-flight completion calls plus the chat
+    streams still being read. Uses HTTP/2 when h2 is installed.
+    """
+    settings = get_settings()
+    return DefaultAsyncHttpxClient(
+        http2=_HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_keepalive_connections=settings.openai_max_concurrent,
+            max_connections=settings.openai_max_concurrent + settings.chat_max_concurrent,
+            keepalive_expiry=60.0,
+        ),
+    )
+
+
+def _request_timeout() -> httpx.Timeout:
+    """Per-request timeout; the SDK default (10 minutes) would hold a chat slot far too long."""
+    return httpx.Timeout(get_settings().openai_timeout_seconds, connect=5.0)
+
+
+def get_openai_client(api_key: str) -> AsyncOpenAI:
+    """Get the shared async OpenAI (or Azure OpenAI) client for an API key.
+
+    Agent runners are created per request; sharing the client lets every request
+    reuse the same httpx connection pool and skip TCP/TLS setup on the first call.
+    """
+    client = _clients.get(api_key)
+    if client is None:
+        settings = get_settings()
+        if settings.use_azure_openai:
+            client = AsyncAzureOpenAI(
+                api_key=api_key,
+                api_version=settings.azure_openai_api_version,
+                azure_endpoint=settings.azure_openai_endpoint,
+                max_retries=settings.openai_max_retries,
+                timeout=_request_timeout(),
+                http_client=_create_http_client(),
+            )
+        else:
+            client = AsyncOpenAI(
+                api_key=api_key,
+                max_retries=settings.openai_max_retries,
+                timeout=_request_timeout(),
+                http_client=_create_http_client(),
+            )
+        _clients[api_key] = client
+        logger.debug("Created shared OpenAI client")
+    return client
+
+
+def prompt_cache_options(key: str) -> dict[str, Any]:
+    """Extra create() options that route calls sharing a prompt prefix to one cache.
+    
+    OpenAI only caches prefixes of 1024+ tokens, and only on the server that saw them;
+    a common prompt_cache_key keeps calls with the same system prompt and tools on the
+    same cache. Sent via extra_body so SDKs older than the parameter pass it through.
+    Azure OpenAI does not take the parameter.
+    """
+    if get_settings().use_azure_openai:
+        return {}
+    return {"extra_body": {"prompt_cache_key": key}}
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Whether an error from a completion call means the model is rate limited.
+    
+    The SDK raises RateLimitError for a 429; the message check only runs for errors
+    that reach us wrapped in something else.
+    """
+    if isinstance(error, RateLimitError):
+        return True
+    message = str(error)
+    return (
+        "RateLimitReached" in message
+        or "rate_limit" in message.lower()
+        or "429" in message
+        or "Too Many Requests" in message
+    )
+
+
+# =============================================================================
+# Request Dispatch - Shared Concurrency Limit
+# =============================================================================
+
+_completion_limiter: ConcurrencyLimiter | None = None
+
+
+def get_completion_limiter() -> ConcurrencyLimiter:
+    """Get the limiter shared by every OpenAI completion call in this worker.
+    
+    All chat sessions queue on the same slots, so a burst of sessions (each with
+    routing, tool-loop and synthesis calls) cannot exceed the account's concurrency
+    and trip rate limits for everyone. Retries with backoff happen inside the slot,
+    in the SDK (see openai_max_retries).
+    """
+    global _completion_limiter
+    if _completion_limiter is None:
+        _completion_limiter = ConcurrencyLimiter(get_settings().openai_max_concurrent)
+    return _completion_limiter
+
+
+async def close_openai_clients() -> None:
+    """Close all shared OpenAI clients (call on shutdown)."""
+    for client in _clients.values():
+        await client.close()
+    _clients.clear()
+    logger.debug("Closed shared OpenAI clients")
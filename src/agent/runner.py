@@ -1,16 +1,31 @@
 """Agent runner that uses OpenAI with MCP tools - with SSE streaming support."""
 
 import asyncio
-import json
+import hashlib
 import logging
+import re
+import sys
 import time
-from typing import Any, AsyncGenerator
-
-from openai import OpenAI, AzureOpenAI
-from pydantic import BaseModel, Field
-
+from contextlib import aclosing
+from functools import lru_cache
+from itertools import combinations, islice
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Iterable
+from urllib.parse import unquote, urlsplit
+
+import orjson
+from pydantic import BaseModel, ConfigDict, Field, SkipValidation
+
+from src.agent.openai_client import (
+    get_completion_limiter,
+    get_openai_client,
+    is_rate_limit_error,
+    prompt_cache_options,
+)
+from src.mcp.models import TextContent
 from src.mcp.registry import get_registry
 from src.config.loader import get_settings
+from src.utils.http import SimpleCache, warm_connections
+from src.utils.rate_limit import CircuitBreaker, get_source_limiter
 
 logger = logging.getLogger(__name__)
 
@@ -28,7 +43,9 @@ class ChatRequest(BaseModel):
         default=["wikipedia", "snl", "riksantikvaren"],
         description="Enabled sources: wikipedia, snl, riksantikvaren"
     )
-    conversation_history: list[dict[str, Any]] = Field(
+    # Sent back verbatim by our own frontend and only trimmed (_compact_history) before
+    # going to OpenAI, so skip per-message validation (it copies every message on each turn)
+    conversation_history: SkipValidation[list[dict[str, Any]]] = Field(
         default_factory=list,
         description="Previous messages in the conversation"
     )
@@ -82,9 +99,16 @@ class ChatResponse(BaseModel):
 # SSE Event Models
 # =============================================================================
 
+# Events whose fields are produced in this module (status text, previews, streamed
+# tokens already typed by the OpenAI SDK, the final ChatResponse) are built with
+# model_construct() to skip validation on the per-token hot path. ToolStartEvent
+# carries model-generated arguments and is still validated.
+
 
 class SSEEvent(BaseModel):
     """Base class for SSE events."""
+    model_config = ConfigDict(frozen=True)
+    
     type: str
 
 
@@ -139,8 +163,97 @@ SOURCE_TOOL_MAP = {
     "riksantikvaren": ["riksantikvaren-", "arcgis-"],
 }
 
+# (prefix, source) pairs, longest prefix first so the most specific one wins
+_PREFIX_TO_SOURCE = tuple(sorted(
+    ((prefix, source) for source, prefixes in SOURCE_TOOL_MAP.items() for prefix in prefixes),
+    key=lambda pair: -len(pair[0]),
+))
+_ALL_TOOL_PREFIXES = tuple(prefix for prefix, _ in _PREFIX_TO_SOURCE)
+
+
+@lru_cache(maxsize=256)
+def _source_for_tool(tool_name: str) -> str | None:
+    """Get the source a tool belongs to, or None for tools outside SOURCE_TOOL_MAP.
+    
+    Memoized per tool name, so after warmup this is one dict lookup per tool call.
+    """
+    if tool_name.startswith(_ALL_TOOL_PREFIXES):
+        for prefix, source in _PREFIX_TO_SOURCE:
+            if tool_name.startswith(prefix):
+                return source
+    return None
+
+
+# One bit per source, in SOURCE_TOOL_MAP order (the order providers are reported in)
+_SOURCE_BITS = {source: 1 << i for i, source in enumerate(SOURCE_TOOL_MAP)}
+
+
+def _sources_mask(tool_names: Iterable[str]) -> int:
+    """Bitmask (_SOURCE_BITS) of the sources the given tools belong to."""
+    mask = 0
+    for tool_name in tool_names:
+        source = _source_for_tool(tool_name)
+        if source:
+            mask |= _SOURCE_BITS[source]
+    return mask
+
+
+def _sources_from_mask(mask: int) -> list[str]:
+    """Source names set in a _sources_mask bitmask, in SOURCE_TOOL_MAP order."""
+    return [source for source, bit in _SOURCE_BITS.items() if mask & bit]
+
+
+@lru_cache(maxsize=16)
+def _prefixes_for_sources(sources: tuple[str, ...]) -> tuple[str, ...]:
+    """Flatten SOURCE_TOOL_MAP into one prefix tuple for a sorted source selection.
+    
+    There are only 2^len(SOURCE_TOOL_MAP) selections, so the cache covers every
+    input after warmup. The tuple is used with str.startswith(), which checks all
+    prefixes in a single C-level call.
+    """
+    return tuple(prefix for source in sources for prefix in SOURCE_TOOL_MAP.get(source, ()))
+
+
+def warm_tool_schemas() -> None:
+    """Pre-build the OpenAI tool lists for every source selection.
+    
+    Called at startup after providers are loaded, so no chat request pays for
+    converting registry tools into OpenAI schemas.
+    """
+    registry = get_registry()
+    sources = sorted(SOURCE_TOOL_MAP)
+    for size in range(1, len(sources) + 1):
+        for selection in combinations(sources, size):
+            registry.openai_tools(_prefixes_for_sources(selection))
+
+
+# API hosts behind each source's tools; a chat connects to its sources while it routes
+SOURCE_ORIGINS = {
+    "wikipedia": ("https://no.wikipedia.org",),
+    "snl": ("https://snl.no",),
+    "riksantikvaren": ("https://api.ra.no", "https://kart.ra.no"),
+}
+
+_warmup_tasks: set[asyncio.Task[None]] = set()
+
+
+def warm_source_connections(sources: list[str]) -> None:
+    """Start opening pooled connections to the sources' API hosts, in the background.
+    
+    Overlaps the TCP/TLS handshakes with the routing call, so the first tool call
+    finds a connection ready. All sources are warmed if none are known, matching
+    the tools offered in that case.
+    """
+    known = [source for source in sources if source in SOURCE_ORIGINS] or SOURCE_ORIGINS
+    task = asyncio.create_task(warm_connections(
+        origin for source in known for origin in SOURCE_ORIGINS[source]
+    ))
+    _warmup_tasks.add(task)
+    task.add_done_callback(_warmup_tasks.discard)
+
+
 # System prompt for the agent - instructs to use Markdown (sources/related questions handled separately)
-SYSTEM_PROMPT = """
+SYSTEM_PROMPT = sys.intern("""
 You are a knowledgeable tour guide. You help users discover and learn about historical sites, monuments, buildings, and cultural landmarks.
 
 ## Available Data Sources
@@ -215,7 +328,439 @@ Format all responses as clean markdown following these rules:
 1. Being creative and entertaining for the user
 2. Basing your answers on the sources you have access to
 3. Being honest about the validity and reliability of your sources
-"""
+""".strip())
+
+# Shared system message. Every request starts with this exact object so the prompt
+# prefix stays byte-identical (OpenAI prompt caching). Never mutate it.
+_SYSTEM_MSG: dict[str, str] = {"role": "system", "content": SYSTEM_PROMPT}
+
+
+# =============================================================================
+# Conversation History
+# =============================================================================
+
+# Most recent history messages sent as-is; older ones are cut to role + short content
+HISTORY_KEEP_LAST = 6
+HISTORY_OLD_MESSAGE_CHARS = 500
+
+
+def _compact_history(history: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Shrink conversation history before it is re-sent on every turn.
+    
+    Tool results from earlier turns are dropped (they are the bulk of the tokens and
+    the answers built from them are kept), along with the tool_calls that requested
+    them, since the API rejects tool calls without their results. Messages older
+    than the last HISTORY_KEEP_LAST are reduced to role and truncated text.
+    """
+    kept = [
+        message for message in history
+        if message.get("role") != "tool" and (message.get("content") or not message.get("tool_calls"))
+    ]
+    cutoff = len(kept) - HISTORY_KEEP_LAST
+    compacted = []
+    for i, message in enumerate(kept):
+        if i < cutoff:
+            content = message.get("content")
+            if isinstance(content, str):
+                content = content[:HISTORY_OLD_MESSAGE_CHARS]
+            message = {"role": message["role"], "content": content}
+        elif "tool_calls" in message:
+            message = {key: value for key, value in message.items() if key != "tool_calls"}
+        compacted.append(message)
+    return compacted
+
+
+# =============================================================================
+# Streaming Helpers
+# =============================================================================
+
+
+# Token coalescing: one SSE frame per batch of deltas instead of one per delta
+TOKEN_BATCH_SIZE = 8
+TOKEN_BATCH_DELAY = 0.02  # seconds
+# Deltas read ahead of the SSE writer before the producer waits (backpressure)
+TOKEN_QUEUE_SIZE = 64
+# Characters of tool output shown in tool_end events
+TOOL_PREVIEW_CHARS = 150
+
+
+async def _pump_deltas(stream: AsyncIterator[Any], queue: asyncio.Queue) -> None:
+    """Read completion chunks into the queue; ends with None, or the raised error."""
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                await queue.put(chunk.choices[0].delta.content)
+    except Exception as e:
+        await queue.put(e)
+        return
+    await queue.put(None)
+
+
+async def _coalesce_tokens(
+    stream: AsyncIterator[Any],
+    max_tokens: int = TOKEN_BATCH_SIZE,
+    max_delay: float = TOKEN_BATCH_DELAY,
+) -> AsyncIterator[str]:
+    """Coalesce streamed completion deltas into larger text batches.
+    
+    The stream is read by a separate producer task into a bounded queue, so
+    receiving the next chunk from OpenAI overlaps with encoding and sending the
+    previous batch. A batch is emitted once max_tokens deltas are buffered, a
+    delta ends a paragraph, or max_delay seconds have passed since the first
+    buffered delta, so a pause in model output never holds back text longer than
+    max_delay and finished paragraphs render right away.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=TOKEN_QUEUE_SIZE)
+    producer = asyncio.create_task(_pump_deltas(stream, queue))
+    buffer: list[str] = []
+    deadline = 0.0
+    try:
+        while True:
+            timeout = max(0.0, deadline - loop.time()) if buffer else None
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                yield "".join(buffer)
+                buffer.clear()
+                continue
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if not buffer:
+                deadline = loop.time() + max_delay
+            buffer.append(item)
+            if len(buffer) >= max_tokens or "\n\n" in item:
+                yield "".join(buffer)
+                buffer.clear()
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        producer.cancel()
+
+
+# =============================================================================
+# Completion Cache
+# =============================================================================
+
+# Tool routing is sampled at temperature 0, so the same question with the same
+# tools (e.g. a popular site asked about with no history) gets the same decision
+ROUTER_TEMPERATURE = 0.0
+
+# Routing output is tool calls, not prose; leave room for several parallel calls
+# (or one batch call) but don't reserve a full answer's worth of tokens
+ROUTER_MAX_TOKENS = 512
+
+# Non-streaming completions (routing and the tool loop), keyed on everything sent
+completion_cache = SimpleCache(default_ttl=600, max_entries=512)
+
+
+# Case and spacing in what the user typed don't change which tools are needed
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _normalize_user_text(text: str) -> str:
+    """Collapse whitespace and case so trivially different questions share a key."""
+    return _WHITESPACE_RE.sub(" ", text.strip()).casefold()
+
+
+def _completion_cache_key(kwargs: dict[str, Any]) -> str:
+    """Hash a completion request; tools are identified by name (schemas are static)
+    and user messages by their normalized text."""
+    tools = kwargs.get("tools")
+    messages = [
+        {**m, "content": _normalize_user_text(m["content"])}
+        if m.get("role") == "user" and isinstance(m.get("content"), str) else m
+        for m in kwargs.get("messages", ())
+    ]
+    key = {
+        **kwargs,
+        "messages": messages,
+        "tools": sorted(tool["function"]["name"] for tool in tools) if tools else None,
+    }
+    return hashlib.sha256(orjson.dumps(key, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+# Finished answers, so a repeat of a popular question (same sources, same conversation
+# so far) skips routing, tools and synthesis; TTL from chat_answer_cache_ttl
+answer_cache = SimpleCache(default_ttl=600, max_entries=256)
+
+
+def _answer_cache_key(request: ChatRequest) -> str:
+    """Build the answer cache key from the normalized question, sources and history."""
+    key = {
+        "message": _normalize_user_text(request.message),
+        "sources": sorted(set(request.sources)),
+        "history": request.conversation_history,
+    }
+    return hashlib.sha256(orjson.dumps(key, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+# =============================================================================
+# Tool Results
+# =============================================================================
+
+
+# Provider tools are read-only lookups, so identical calls (within a conversation
+# or across users asking about the same site) can reuse the formatted result
+CACHEABLE_TOOL_PREFIXES = ("wikipedia-", "snl-", "riksantikvaren-", "arcgis-")
+tool_result_cache = SimpleCache(default_ttl=900, max_entries=1024)
+
+# Search tool started per source on the raw question while the router decides
+# (chat_speculative_search); a routed call with the same arguments joins it
+SPECULATIVE_SEARCH_TOOLS = {"wikipedia": "wikipedia-search", "snl": "snl-search"}
+
+# Cacheable tool calls currently running, by cache key; identical calls join them
+_inflight_tool_calls: dict[str, asyncio.Task[str]] = {}
+
+# Runs one tool call and returns its text (each runner formats results its own way)
+ToolRunner = Callable[[str, dict[str, Any]], Awaitable[str]]
+
+
+async def _execute_cached_tool(
+    tool_name: str,
+    arguments: dict[str, Any],
+    run: ToolRunner,
+    canonical_arguments: bytes | None = None,
+) -> str:
+    """Execute a tool with run(), sharing results across chats and both runners.
+    
+    Results of read-only provider tools are cached by name and canonical arguments
+    (sorted-key orjson; pass canonical_arguments if the caller already has them),
+    and a call identical to one already running (in any chat) waits for that call
+    instead of starting its own.
+    """
+    if not tool_name.startswith(CACHEABLE_TOOL_PREFIXES):
+        return await run(tool_name, arguments)
+    
+    if canonical_arguments is None:
+        canonical_arguments = orjson.dumps(arguments, option=orjson.OPT_SORT_KEYS)
+    cache_key = f"{tool_name}:{canonical_arguments.decode()}"
+    cached = tool_result_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    task = _inflight_tool_calls.get(cache_key)
+    if task is None:
+        task = asyncio.create_task(_run_and_cache(run, tool_name, arguments, cache_key))
+        _inflight_tool_calls[cache_key] = task
+        task.add_done_callback(lambda _: _inflight_tool_calls.pop(cache_key, None))
+    # Shielded so one waiter disconnecting doesn't cancel the call for the others
+    return await asyncio.shield(task)
+
+
+async def _run_and_cache(run: ToolRunner, tool_name: str, arguments: dict[str, Any], cache_key: str) -> str:
+    """Run a tool call and cache its text unless it failed."""
+    text = await run(tool_name, arguments)
+    if not _is_error_result(text):
+        tool_result_cache.set(cache_key, text)
+    return text
+
+
+def _is_error_result(text: str) -> bool:
+    """Whether a tool's text is a failure rather than a (possibly empty) result.
+    
+    Handlers report failures, including upstream errors, as "Error..." text; the
+    runners reply {"error": ...} (v1) or "Tool not found: ..." (v2) themselves.
+    """
+    return text.startswith(("Error", '{"error"', "Tool not found"))
+
+def _format_tool_result(result: Any) -> str:
+    """Convert a tool handler's return value to the text sent to the model.
+    
+    Structured results are encoded as compact JSON: indentation is only billable
+    prompt tokens to the model.
+    """
+    if isinstance(result, list):
+        # Handlers almost always return plain TextContent lists: join without probing
+        if all(type(item) is TextContent for item in result):
+            return "\n".join([item.text for item in result])
+        return "\n".join([_format_tool_item(item) for item in result])
+    if isinstance(result, dict):
+        return orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS).decode()
+    return _format_tool_item(result)
+
+
+def _format_tool_item(item: Any) -> str:
+    """Convert a single content item or other value to text."""
+    if isinstance(item, TextContent):
+        return item.text
+    if isinstance(item, BaseModel):
+        return item.model_dump_json()
+    return str(item)
+
+
+# =============================================================================
+# Batch Tool
+# =============================================================================
+
+# Synthetic tool (opt-in, chat_batch_tool_enabled) that lets the router request many
+# lookups in one call, so the routing turn emits one tool_calls entry instead of many
+BATCH_TOOL_NAME = "batch"
+_BATCH_TOOL: dict[str, Any] = {
+    "type": "function",
+    "function": {
+        "name": BATCH_TOOL_NAME,
+        "description": (
+            "Run several of the other tools in one call. Results are returned as a JSON "
+            "array in the same order as the invocations."
+        ),
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "invocations": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "tool_name": {"type": "string"},
+                            "arguments": {"type": "object"},
+                        },
+                        "required": ["tool_name", "arguments"],
+                    },
+                },
+            },
+            "required": ["invocations"],
+        },
+    },
+}
+
+# Registry tool list -> the same list plus _BATCH_TOOL, keyed by prefixes. The registry
+# replaces its lists when tools are registered, so an entry is reused only while its
+# base list is still the one the registry hands out.
+_tools_with_batch: dict[tuple[str, ...], tuple[list[dict[str, Any]], list[dict[str, Any]]]] = {}
+
+
+def _with_batch_tool(prefixes: tuple[str, ...], tools: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Get the tool list with the batch tool appended, built once per registry list."""
+    cached = _tools_with_batch.get(prefixes)
+    if cached is None or cached[0] is not tools:
+        cached = _tools_with_batch[prefixes] = (tools, [*tools, _BATCH_TOOL])
+    return cached[1]
+
+
+def _expand_tool_call(
+    name: str, raw_arguments: str, enabled_prefixes: tuple[str, ...]
+) -> list[tuple[str, dict[str, Any], str | None]]:
+    """Parse a tool call into (tool name, arguments, error) triples, one per invocation for a batch call.
+    
+    An invocation that can't be run gets an error text (the tool's reply) instead:
+    arguments that aren't a JSON object, or, in a batch, a tool outside the
+    request's enabled sources.
+    """
+    try:
+        arguments = orjson.loads(raw_arguments)
+    except orjson.JSONDecodeError:
+        arguments = {}
+    if name != BATCH_TOOL_NAME:
+        if not isinstance(arguments, dict):
+            return [(name, {}, _invalid_call_error(f"Arguments for '{name}' must be a JSON object"))]
+        return [(name, arguments, None)]
+    
+    invocations = arguments.get("invocations") if isinstance(arguments, dict) else None
+    expanded: list[tuple[str, dict[str, Any], str | None]] = []
+    for invocation in invocations if isinstance(invocations, list) else ():
+        tool_name = invocation.get("tool_name") if isinstance(invocation, dict) else None
+        if not isinstance(tool_name, str):
+            expanded.append(("", {}, _invalid_call_error("Each invocation needs a tool_name")))
+            continue
+        tool_arguments = invocation.get("arguments") or {}
+        if not tool_name.startswith(enabled_prefixes):
+            expanded.append((tool_name, {}, _invalid_call_error(f"Tool '{tool_name}' is not enabled")))
+        elif not isinstance(tool_arguments, dict):
+            expanded.append((tool_name, {}, _invalid_call_error(f"Arguments for '{tool_name}' must be a JSON object")))
+        else:
+            expanded.append((tool_name, tool_arguments, None))
+    return expanded
+
+
+def _invalid_call_error(message: str) -> str:
+    """Tool reply for an invocation that was rejected instead of run."""
+    return orjson.dumps({"error": message}).decode()
+
+
+def _tool_message_content(name: str, results: list[str]) -> str:
+    """Content of the tool message answering one call: its result, or a JSON array for a batch."""
+    if name == BATCH_TOOL_NAME:
+        return orjson.dumps(results).decode()
+    return results[0]
+
+
+# =============================================================================
+# Response Post-processing
+# =============================================================================
+
+
+# Patterns are compiled once at import; these helpers run on every final response.
+
+# Above this many characters of tool output, the streamed response is post-processed
+# in a worker thread so the relevance heuristics don't stall other sessions' events;
+# below it the thread hop costs more than the work itself
+POSTPROCESS_THREAD_CHARS = 32_000
+
+# Source extraction from tool results
+# The last character can't be trailing punctuation, so matches need no rstrip
+_URL_RE = re.compile(r'https?://[^\s<>"{}|\\^`\[\])]+[^\s<>"{}|\\^`\[\].,;:)]')
+_KULTURMINNE_ID_RE = re.compile(r'[?&]id=([a-f0-9-]+)')
+_SNL_SLUG_RE = re.compile(r'snl\.no/([^?#]+)')
+_WIKI_SLUG_RE = re.compile(r'wikipedia\.org/wiki/([^?#]+)')
+_CURID_RE = re.compile(r'curid=(\d+)')
+
+
+def _url_site(url: str) -> str:
+    """Last two labels of a URL's host: "lille.snl.no" -> "snl.no"."""
+    host = urlsplit(url).hostname or ""
+    return ".".join(host.rsplit(".", 2)[-2:])
+
+# Source relevance heuristics
+_BOLD_RE = re.compile(r'\*\*([^*]+)\*\*')
+_TITLE_WORD_RE = re.compile(r'\b[a-zA-ZæøåÆØÅ]{3,}\b')
+_TITLE_STOPWORDS = frozenset({'for', 'ved', 'den', 'det', 'i', 'på', 'av'})
+_YEAR_RE = re.compile(r'\b(1[0-9]{3}|20[0-2][0-9])\b')
+_TOKEN_RE = re.compile(r'[a-z0-9æøå]+')
+_KATEGORI_RE = re.compile(r'Kategori:\s*([^\n]+)')
+_VERNESTATUS_RE = re.compile(r'Vernestatus:\s*([^\n]+)')
+_SIGNIFICANT_WORD_RE = re.compile(r'\b[a-zA-ZæøåÆØÅ]{7,}\b')
+_COMMON_WORDS = frozenset({
+    'kulturminner', 'kulturminne', 'riksantikvaren', 'norway', 'norwegian',
+    'wikipedia', 'artikkel', 'source', 'kilder', 'beskrivelse',
+    'lokalitet', 'kommune', 'registrert', 'informasjon', 'historic',
+    'heritage', 'building', 'structure', 'registered', 'official',
+    # Location names that match too broadly
+    'oslo', 'bergen', 'trondheim', 'stavanger', 'tromsø', 'kristiansand'
+})
+
+# Related questions lists
+_RELATED_LIST_RES = tuple(
+    re.compile(pattern, re.IGNORECASE)
+    for pattern in (
+        r'\*\*Relaterte spørsmål:\*\*\s*\n((?:[-*]\s*.+\n?)+)',
+        r'\*\*Related questions:\*\*\s*\n((?:[-*]\s*.+\n?)+)',
+        r'## Relaterte spørsmål\s*\n((?:[-*]\s*.+\n?)+)',
+    )
+)
+_LIST_ITEM_RE = re.compile(r'[-*]\s*(.+?)(?:\?|\n|$)')
+
+# Trailing sections cut from their heading to the end of the text, in one pass:
+# "## Kilder" / "## Sources" / "## Referanser", "## Relaterte spørsmål", and a
+# "**Relaterte spørsmål:**" block introduced by a horizontal rule
+_TRAILING_SECTIONS_RE = re.compile(
+    r'\n+(?:'
+    r'##\s*(?:Kilder|Sources|Referanser|Relaterte spørsmål|Related questions)\s*\n'
+    r'|---\s*\n+\*\*(?:Relaterte spørsmål|Related questions)[:\*]*\*\*\s*\n'
+    r')[\s\S]*$',
+    re.IGNORECASE,
+)
+
+# Standalone "**Relaterte spørsmål:**" list (text may follow it)
+_RELATED_LIST_BLOCK_RE = re.compile(
+    r'\n+\*\*(?:Relaterte spørsmål|Related questions)[:\*]*\*\*\s*\n(?:[-*]\s*.+\n?)+',
+    re.IGNORECASE,
+)
+
+# Trailing horizontal rule
+_TRAILING_RULE_RE = re.compile(r'\n+---\s*$')
 
 
 # =============================================================================
@@ -227,19 +772,14 @@ class AgentRunner:
     """Runs the chat agent with tool calling and streaming support."""
     
     # Class-level circuit breaker for rate-limited router
-    _router_rate_limited_until = None
+    _router_breaker = CircuitBreaker(cooldown_base=30.0, cooldown_max=600.0)
     
     def __init__(self, openai_api_key: str):
         """Initialize with OpenAI API key (works with both OpenAI and Azure OpenAI)."""
         settings = get_settings()
 
         if settings.use_azure_openai:
-            logger.info(f"Using Azure OpenAI: {settings.azure_openai_endpoint}")
-            self.client = AzureOpenAI(
-                api_key=openai_api_key,
-                api_version=settings.azure_openai_api_version,
-                azure_endpoint=settings.azure_openai_endpoint,
-            )
+            logger.info("Using Azure OpenAI: %s", settings.azure_openai_endpoint)
             self.model = settings.azure_openai_deployment  # gpt-4o for synthesis
 
             # Use separate router model if configured, otherwise derive from main deployment
@@ -252,69 +792,126 @@ class AgentRunner:
                 else:
                     self.router_model = settings.azure_openai_deployment
 
-            logger.info(f"Router model: {self.router_model}, Synthesis model: {self.model}")
+            logger.info("Router model: %s, Synthesis model: %s", self.router_model, self.model)
         else:
             logger.info("Using OpenAI direct API")
-            self.client = OpenAI(api_key=openai_api_key)
             self.router_model = "gpt-4o-mini"  # Fast router
             self.model = "gpt-4o"  # Quality synthesis
+        
+        # One model for every call when two-model routing is switched off (A/B testing)
+        if not settings.chat_router_enabled:
+            self.router_model = self.model
 
+        self.client = get_openai_client(openai_api_key)
         self.registry = get_registry()
-        self.max_tool_iterations = 2  # Limit tool calling rounds to prevent excessive API calls
+        self.max_tool_iterations = settings.chat_max_tool_rounds  # Router -> tools rounds before synthesis
+        self.tool_round_timeout = settings.chat_tool_round_timeout  # Seconds to wait for a round's tools
+        self.batch_tool_enabled = settings.chat_batch_tool_enabled  # Offer the synthetic batch tool
+        self.speculative_search = settings.chat_speculative_search  # Search while the router decides
+        self.warm_connections = settings.chat_warm_connections  # Connect to tool APIs while the router decides
+        self.answer_cache_ttl = settings.chat_answer_cache_ttl  # Seconds to replay a finished answer (0: off)
     
     def _get_enabled_tools(self, sources: list[str]) -> list[dict[str, Any]]:
-        """Get OpenAI tool definitions for enabled sources."""
-        tools = []
-        enabled_prefixes = []
+        """Get OpenAI tool definitions for enabled sources (cached in the registry)."""
+        enabled_prefixes = _prefixes_for_sources(tuple(sorted(set(sources))))
+        tools = self.registry.openai_tools(enabled_prefixes)
+        if tools and self.batch_tool_enabled:
+            return _with_batch_tool(enabled_prefixes, tools)
+        return tools
+    
+    async def _create_completion(self, **kwargs: Any) -> Any:
+        """Create a chat completion once a shared OpenAI request slot is free.
         
-        for source in sources:
-            if source in SOURCE_TOOL_MAP:
-                enabled_prefixes.extend(SOURCE_TOOL_MAP[source])
+        For streaming calls the slot covers opening the stream, not reading it.
+        Non-streaming calls are answered from completion_cache on an exact match;
+        callers must treat the returned response as read-only.
+        """
+        cache_key = None
+        if not kwargs.get("stream"):
+            cache_key = _completion_cache_key(kwargs)
+            cached = completion_cache.get(cache_key)
+            if cached is not None:
+                return cached
         
-        for mcp_tool in self.registry.list_tools():
-            if any(mcp_tool.name.startswith(prefix) for prefix in enabled_prefixes):
-                tools.append({
-                    "type": "function",
-                    "function": {
-                        "name": mcp_tool.name,
-                        "description": mcp_tool.description,
-                        "parameters": mcp_tool.inputSchema,
-                    }
-                })
+        async with get_completion_limiter():
+            response = await self.client.chat.completions.create(**kwargs, **prompt_cache_options("chat"))
         
-        return tools
+        if cache_key:
+            completion_cache.set(cache_key, response)
+        return response
+    
+    async def _route(self, messages: list[dict[str, Any]], tools: list[dict[str, Any]]) -> tuple[Any, bool]:
+        """Ask the router model for tool calls (non-streaming).
+        
+        Falls back to the main model when the router is rate limited, and keeps
+        using it until the circuit breaker's (growing) cooldown ends. Returns the
+        response and whether it came from that rate-limit fallback.
+        """
+        use_router_model = self.router_model
+        if AgentRunner._router_breaker.is_open() and self.router_model != self.model:
+            logger.info("Skipping %s (circuit breaker active), using %s", self.router_model, self.model)
+            use_router_model = self.model
+        
+        logger.info("Tool routing with %s", use_router_model)
+        options: dict[str, Any] = {
+            "messages": messages,
+            "tools": tools if tools else None,
+            "tool_choice": "auto" if tools else None,
+            "max_tokens": ROUTER_MAX_TOKENS,
+            "temperature": ROUTER_TEMPERATURE,
+            "parallel_tool_calls": True,  # Allow multiple tool calls in one request
+        }
+        try:
+            response = await self._create_completion(model=use_router_model, **options)
+        except Exception as e:
+            if not is_rate_limit_error(e):
+                raise
+            logger.warning("Rate limit hit for %s, falling back to %s", use_router_model, self.model)
+            AgentRunner._router_breaker.trip()
+            return await self._create_completion(model=self.model, **options), True
+        
+        # If router worked, reset circuit breaker
+        if use_router_model == self.router_model and AgentRunner._router_breaker.reset():
+            logger.info("%s working again, resetting circuit breaker", self.router_model)
+        return response, False
+    
+    async def _execute_tool(
+        self, tool_name: str, arguments: dict[str, Any], canonical_arguments: bytes | None = None
+    ) -> str:
+        """Execute a tool and return the result as a string (cached, see _execute_cached_tool)."""
+        return await _execute_cached_tool(tool_name, arguments, self._run_tool, canonical_arguments)
+    
+    def _start_speculative_searches(self, sources: list[str], query: str) -> list[asyncio.Task[str]]:
+        """Start each enabled source's search on the raw question, if configured.
+        
+        Runs alongside the routing call. A routed call with identical arguments joins
+        the in-flight search (see _execute_tool) instead of starting it only then.
+        """
+        if not self.speculative_search:
+            return []
+        return [
+            asyncio.create_task(self._execute_tool(tool_name, {"query": query}))
+            for source, tool_name in SPECULATIVE_SEARCH_TOOLS.items()
+            if source in sources and self.registry.get(tool_name)
+        ]
     
-    async def _execute_tool(self, tool_name: str, arguments: dict[str, Any]) -> str:
-        """Execute a tool and return the result as a string."""
+    async def _run_tool(self, tool_name: str, arguments: dict[str, Any]) -> str:
+        """Run a tool handler, waiting for a slot in its provider's limiter, and format the result."""
         try:
             tool = self.registry.get(tool_name)
             if not tool:
-                return json.dumps({"error": f"Tool '{tool_name}' not found"})
+                return orjson.dumps({"error": f"Tool '{tool_name}' not found"}).decode()
             
-            result = await tool.handler(arguments)
-            
-            if isinstance(result, list):
-                texts = []
-                for item in result:
-                    if hasattr(item, 'text'):
-                        texts.append(item.text)
-                    elif hasattr(item, 'model_dump'):
-                        texts.append(json.dumps(item.model_dump(), ensure_ascii=False))
-                    else:
-                        texts.append(str(item))
-                return "\n".join(texts)
-            elif hasattr(result, 'text'):
-                return result.text
-            elif hasattr(result, 'model_dump'):
-                return json.dumps(result.model_dump(), ensure_ascii=False, indent=2)
-            elif isinstance(result, dict):
-                return json.dumps(result, ensure_ascii=False, indent=2)
+            source = _source_for_tool(tool_name)
+            if source:
+                async with get_source_limiter(source):
+                    result = await tool.run(arguments)
             else:
-                return str(result)
-                
+                result = await tool.run(arguments)
+            return _format_tool_result(result)
         except Exception as e:
-            logger.error(f"Tool execution error: {tool_name}", exc_info=True)
-            return json.dumps({"error": str(e)})
+            logger.error("Tool execution error: %s", tool_name, exc_info=True)
+            return orjson.dumps({"error": str(e)}).decode()
     
     def _extract_sources_from_tool_results(
         self, 
@@ -326,40 +923,38 @@ class AgentRunner:
         Only includes sources whose content appears to be referenced in the AI's response.
         This prevents listing sources that were consulted but not used.
         """
-        import re
-        
-        # Normalize response text for matching
+        # Normalize the response once; it is compared against every tool result
         response_lower = response_text.lower()
+        response_words = frozenset(_SIGNIFICANT_WORD_RE.findall(response_lower))
+        response_tokens = frozenset(_TOKEN_RE.findall(response_lower))
         
         sources = []
         seen_urls = set()
         
         for tool_name, result_text, arguments in tool_results:
             # Determine provider
-            provider = "riksantikvaren"
-            if tool_name.startswith("wikipedia-"):
-                provider = "wikipedia"
-            elif tool_name.startswith("snl-"):
-                provider = "snl"
+            tool_provider = _source_for_tool(tool_name) or "riksantikvaren"
             
             # Check if this tool's content was actually used in the response
             # We look for key terms from the tool result appearing in the response
-            if not self._is_source_used_in_response(result_text, response_text):
+            if not self._is_source_used_in_response(
+                result_text, response_lower, response_words, response_tokens
+            ):
                 continue  # Skip sources not used in the response
             
             # Look for URLs in the result (including kulturminnesok.no links)
-            url_pattern = r'https?://[^\s<>"{}|\\^`\[\])]+[^\s<>"{}|\\^`\[\].,)]'
-            urls = re.findall(url_pattern, result_text)
-            
-            for url in urls[:3]:  # Limit to 3 URLs per tool (reduced from 5)
+            # Only the first 3 URLs per tool are considered (reduced from 5), so scan
+            # lazily instead of collecting every URL in a multi-KB result
+            for url_match in islice(_URL_RE.finditer(result_text), 3):
                 # Clean up URL (remove trailing punctuation)
-                url = url.rstrip('.,;:)')
+                url = url_match.group(0)
                 
                 if url not in seen_urls:
                     seen_urls.add(url)
                     
-                    # Determine title based on URL and provider
-                    if "kulturminnesok.no" in url:
+                    # Determine title and provider from the URL's site (host, not substring)
+                    site = _url_site(url)
+                    if site == "kulturminnesok.no":
                         # Try to extract the kulturminne name from the result text
                         name_match = re.search(
                             r'\*\*([^*]+)\*\*[^*]*?' + re.escape(url),
@@ -369,17 +964,16 @@ class AgentRunner:
                         if name_match:
                             title = f"{name_match.group(1).strip()} – Kulturminnesøk"
                         else:
-                            id_match = re.search(r'[?&]id=([a-f0-9-]+)', url)
+                            id_match = _KULTURMINNE_ID_RE.search(url)
                             if id_match:
                                 title = f"Kulturminne – Kulturminnesøk"
                             else:
                                 title = "Kulturminnesøk"
                         provider = "riksantikvaren"
-                    elif "snl.no" in url:
+                    elif site == "snl.no":
                         # Extract article name from URL path
                         # URLs like: https://snl.no/Djengis_Khan or https://lille.snl.no/Djengis_Khan
-                        from urllib.parse import unquote
-                        url_match = re.search(r'snl\.no/([^?#]+)', url)
+                        url_match = _SNL_SLUG_RE.search(url)
                         if url_match:
                             article_slug = url_match.group(1)
                             # Convert URL encoding and underscores to readable title
@@ -388,18 +982,17 @@ class AgentRunner:
                         else:
                             title = arguments.get("query", "Artikkel") + " – Store norske leksikon"
                         provider = "snl"
-                    elif "wikipedia.org" in url:
+                    elif site == "wikipedia.org":
                         # Extract article name from URL path
                         # URLs like: https://en.wikipedia.org/wiki/Genghis_Khan
-                        from urllib.parse import unquote
-                        url_match = re.search(r'wikipedia\.org/wiki/([^?#]+)', url)
+                        url_match = _WIKI_SLUG_RE.search(url)
                         if url_match:
                             article_slug = url_match.group(1)
                             article_name = unquote(article_slug).replace('_', ' ')
                             title = f"{article_name} – Wikipedia"
                         else:
                             # Handle curid URLs like https://en.wikipedia.org/?curid=12345
-                            curid_match = re.search(r'curid=(\d+)', url)
+                            curid_match = _CURID_RE.search(url)
                             if curid_match:
                                 title = f"Wikipedia artikkel #{curid_match.group(1)}"
                             else:
@@ -407,6 +1000,7 @@ class AgentRunner:
                         provider = "wikipedia"
                     else:
                         title = arguments.get("query", arguments.get("identifier", "Kilde"))
+                        provider = tool_provider
                     
                     sources.append(SourceReference(
                         title=title,
@@ -417,21 +1011,30 @@ class AgentRunner:
         
         return sources[:10]  # Limit total sources
     
-    def _is_source_used_in_response(self, tool_result: str, response_text: str) -> bool:
+    def _is_source_used_in_response(
+        self,
+        tool_result: str,
+        response_lower: str,
+        response_words: frozenset[str],
+        response_tokens: frozenset[str],
+    ) -> bool:
         """Check if content from a tool result appears to be used in the response.
 
         Uses multiple heuristics to determine relevance:
         1. PRIORITY: Check if the source title/name is mentioned in the response
         2. Check if specific unique terms from the tool result appear in the response
         3. Verify significant word overlap (but NOT generic location words)
+        
+        The response side is precomputed once by the caller: response_lower is the
+        lowercased response text, response_words its significant (7+ letter) words
+        and response_tokens all of its alphanumeric tokens (for O(1) year lookups).
+        Title words are still matched as substrings so that Norwegian compounds
+        ("domkirke" for "kirke") count.
         """
-        import re
-
-        response_lower = response_text.lower()
         result_lower = tool_result.lower()
 
         # Extract the primary title/name from tool result (first bold term, usually the source title)
-        bold_terms = re.findall(r'\*\*([^*]+)\*\*', tool_result)
+        bold_terms = _BOLD_RE.findall(tool_result)
 
         # CRITICAL: Check if the PRIMARY source title is mentioned in response
         # This is the most reliable indicator
@@ -440,7 +1043,7 @@ class AgentRunner:
             # For Riksantikvaren sources, the first bold term is the lokalitet name
             if len(primary_title) >= 3:
                 # Check for substantial title match (at least 60% of title words present)
-                title_words = [w for w in re.findall(r'\b[a-zA-ZæøåÆØÅ]{3,}\b', primary_title) if w not in {'for', 'ved', 'den', 'det', 'i', 'på', 'av'}]
+                title_words = [w for w in _TITLE_WORD_RE.findall(primary_title) if w not in _TITLE_STOPWORDS]
                 if title_words:
                     # Count how many title words appear in response
                     matches = sum(1 for word in title_words if word in response_lower)
@@ -455,14 +1058,14 @@ class AgentRunner:
                         return True
 
         # Extract years/dates that might be specific facts
-        numbers = re.findall(r'\b(1[0-9]{3}|20[0-2][0-9])\b', tool_result)  # Years
-        matching_years = [num for num in numbers if num in response_text]
+        numbers = _YEAR_RE.findall(tool_result)  # Years
+        matching_years = [num for num in numbers if num in response_tokens]
         # Years alone are not sufficient (too common), but combined with other signals
 
         # Check for unique descriptive terms (kategori, vernestatus, etc.)
         # But EXCLUDE generic location terms like kommune names
-        kategori_match = re.search(r'Kategori:\s*([^\n]+)', tool_result)
-        vernestatus_match = re.search(r'Vernestatus:\s*([^\n]+)', tool_result)
+        kategori_match = _KATEGORI_RE.search(tool_result)
+        vernestatus_match = _VERNESTATUS_RE.search(tool_result)
 
         unique_descriptors = []
         if kategori_match:
@@ -479,20 +1082,11 @@ class AgentRunner:
         descriptor_matches = sum(1 for desc in unique_descriptors if desc in response_lower)
 
         # Extract significant words (6+ chars) from result
-        result_words = set(re.findall(r'\b[a-zA-ZæøåÆØÅ]{7,}\b', result_lower))
-        response_words = set(re.findall(r'\b[a-zA-ZæøåÆØÅ]{7,}\b', response_lower))
+        result_words = set(_SIGNIFICANT_WORD_RE.findall(result_lower))
 
         overlap = result_words & response_words
         # Filter out common/generic words that don't indicate topical relevance
-        common_words = {
-            'kulturminner', 'kulturminne', 'riksantikvaren', 'norway', 'norwegian',
-            'wikipedia', 'artikkel', 'source', 'kilder', 'beskrivelse',
-            'lokalitet', 'kommune', 'registrert', 'informasjon', 'historic',
-            'heritage', 'building', 'structure', 'registered', 'official',
-            # Location names that match too broadly
-            'oslo', 'bergen', 'trondheim', 'stavanger', 'tromsø', 'kristiansand'
-        }
-        meaningful_overlap = overlap - common_words
+        meaningful_overlap = overlap - _COMMON_WORDS
 
         # Require HIGHER threshold for word overlap (3+ words, not 2)
         # Combined with descriptor matches or year matches
@@ -508,17 +1102,10 @@ class AgentRunner:
         queries = []
         
         # Look for the related questions section
-        import re
-        patterns = [
-            r'\*\*Relaterte spørsmål:\*\*\s*\n((?:[-*]\s*.+\n?)+)',
-            r'\*\*Related questions:\*\*\s*\n((?:[-*]\s*.+\n?)+)',
-            r'## Relaterte spørsmål\s*\n((?:[-*]\s*.+\n?)+)',
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, response_text, re.IGNORECASE)
+        for pattern in _RELATED_LIST_RES:
+            match = pattern.search(response_text)
             if match:
-                items = re.findall(r'[-*]\s*(.+?)(?:\?|\n|$)', match.group(1))
+                items = _LIST_ITEM_RE.findall(match.group(1))
                 queries = [q.strip() + ("?" if not q.strip().endswith("?") else "") for q in items if q.strip()]
                 break
         
@@ -530,109 +1117,60 @@ class AgentRunner:
         These are extracted into structured fields, so we don't want them duplicated
         in the main response text.
         """
-        import re
-        
-        cleaned = response_text
-        
-        # Remove "## Kilder" / "## Sources" / "## Kilder" section and everything after it
-        # This catches everything from the sources heading to the end
-        kilder_patterns = [
-            r'\n+##\s*Kilder\s*\n[\s\S]*$',
-            r'\n+##\s*Kilder\s*\n[\s\S]*$',  # Common typo
-            r'\n+##\s*Sources\s*\n[\s\S]*$',
-            r'\n+##\s*Referanser\s*\n[\s\S]*$',
-        ]
-        for pattern in kilder_patterns:
-            cleaned = re.sub(pattern, '', cleaned, flags=re.IGNORECASE)
-        
-        # Remove "**Relaterte spørsmål:**" section (standalone or after ---)
-        related_patterns = [
-            r'\n+---\s*\n+\*\*Relaterte spørsmål[:\*]*\*\*\s*\n[\s\S]*$',
-            r'\n+---\s*\n+\*\*Related questions[:\*]*\*\*\s*\n[\s\S]*$',
-            r'\n+\*\*Relaterte spørsmål[:\*]*\*\*\s*\n(?:[-*]\s*.+\n?)+',
-            r'\n+\*\*Related questions[:\*]*\*\*\s*\n(?:[-*]\s*.+\n?)+',
-            r'\n+##\s*Relaterte spørsmål\s*\n[\s\S]*$',
-            r'\n+##\s*Related questions\s*\n[\s\S]*$',
-        ]
-        for pattern in related_patterns:
-            cleaned = re.sub(pattern, '', cleaned, flags=re.IGNORECASE)
-        
-        # Remove trailing horizontal rules and whitespace
-        cleaned = re.sub(r'\n+---\s*$', '', cleaned)
-        cleaned = cleaned.rstrip()
-        
-        return cleaned
+        cleaned = _TRAILING_SECTIONS_RE.sub('', response_text, count=1)
+        cleaned = _RELATED_LIST_BLOCK_RE.sub('', cleaned)
+        cleaned = _TRAILING_RULE_RE.sub('', cleaned)
+        return cleaned.rstrip()
     
     async def chat_stream(self, request: ChatRequest) -> AsyncGenerator[SSEEvent, None]:
         """Process a chat request with streaming events."""
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
         tools_used: list[str] = []
-        sources_consulted: set[str] = set()
+        sources_consulted = 0  # _SOURCE_BITS mask
         tool_results: list[tuple[str, str, dict[str, Any]]] = []
         full_response_text = ""
         
-        yield StatusEvent(message="Analyserer spørsmål...")
+        # A repeated question is answered from the cache in one token
+        answer_key = _answer_cache_key(request) if self.answer_cache_ttl else None
+        cached = answer_cache.get(answer_key) if answer_key else None
+        if cached is not None:
+            processing_time_ms = (time.perf_counter_ns() - start_ns) // 1_000_000
+            yield TokenEvent.model_construct(content=cached.response.text)
+            yield DoneEvent.model_construct(response=cached.model_copy(update={
+                "metadata": cached.metadata.model_copy(update={"processing_time_ms": processing_time_ms}),
+            }))
+            return
+        
+        yield StatusEvent.model_construct(message="Analyserer spørsmål...")
         
         # Build messages
-        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-        for msg in request.conversation_history:
-            messages.append(msg)
-        messages.append({"role": "user", "content": request.message})
+        messages = [
+            _SYSTEM_MSG,
+            *_compact_history(request.conversation_history),
+            {"role": "user", "content": request.message},
+        ]
         
         # Get enabled tools
+        enabled_prefixes = _prefixes_for_sources(tuple(sorted(set(request.sources))))
         tools = self._get_enabled_tools(request.sources)
+        speculative = self._start_speculative_searches(request.sources, request.message) if tools else []
+        if tools and self.warm_connections:
+            warm_source_connections(request.sources)
         
         try:
-            # Check circuit breaker - if router was recently rate-limited, skip it
-            use_router_model = self.router_model
-            if (AgentRunner._router_rate_limited_until and 
-                time.time() < AgentRunner._router_rate_limited_until and
-                self.router_model != self.model):
-                logger.info(f"Skipping {self.router_model} (circuit breaker active), using {self.model}")
-                use_router_model = self.model
-            
             # First call to check for tool use (non-streaming) - use router model for efficiency
-            logger.info(f"Tool routing with {use_router_model}")
-            
-            # Try router model first, fall back to responder if rate limited
             try:
-                response = self.client.chat.completions.create(
-                    model=use_router_model,
-                    messages=messages,
-                    tools=tools if tools else None,
-                    tool_choice="auto" if tools else None,
-                    max_tokens=2048,
-                    temperature=0.7,
-                    parallel_tool_calls=True,  # Allow multiple tool calls in one request
-                )
-                # If router worked, reset circuit breaker
-                if use_router_model == self.router_model and AgentRunner._router_rate_limited_until:
-                    logger.info(f"{self.router_model} working again, resetting circuit breaker")
-                    AgentRunner._router_rate_limited_until = None
-            except Exception as e:
-                error_str = str(e)
-                # Check if it's a rate limit error
-                if ("RateLimitReached" in error_str or 
-                    "rate_limit" in error_str.lower() or 
-                    "429" in error_str or
-                    "Too Many Requests" in error_str):
-                    logger.warning(f"Rate limit hit for {use_router_model}, falling back to {self.model}")
-                    # Set circuit breaker for 5 minutes
-                    AgentRunner._router_rate_limited_until = time.time() + 300
-                    # Fall back to using responder model for routing
-                    response = self.client.chat.completions.create(
-                        model=self.model,
-                        messages=messages,
-                        tools=tools if tools else None,
-                        tool_choice="auto" if tools else None,
-                        max_tokens=2048,
-                        temperature=0.7,
-                        parallel_tool_calls=True,
-                    )
-                else:
-                    raise
+                response, fell_back = await self._route(messages, tools)
+            finally:
+                # Routed calls matching a speculative search join its shielded in-flight
+                # call; searches the router didn't ask for finish into the cache
+                for task in speculative:
+                    task.cancel()
             
             message = response.choices[0].message
+            if fell_back:
+                # Answered under a rate limit; a later ask may route normally
+                answer_key = None
             
             # Handle tool calls - limit iterations to prevent excessive API calls
             iteration_count = 0
@@ -655,113 +1193,112 @@ class AgentRunner:
                 })
                 
                 # Prepare all tool calls for parallel execution
-                tool_call_info = []
+                # (tool_call_id, call key, None) per invocation, or (tool_call_id, None, error) for a
+                # rejected one; the model sometimes repeats an identical call in one round,
+                # so each unique call runs once
+                tool_call_info: list[tuple[str, tuple[str, bytes] | None, str | None]] = []
+                unique_calls: dict[tuple[str, bytes], dict[str, Any]] = {}
                 for tool_call in message.tool_calls:
-                    tool_name = tool_call.function.name
-                    tools_used.append(tool_name)
-                    
-                    # Track sources
-                    for source, prefixes in SOURCE_TOOL_MAP.items():
-                        if any(tool_name.startswith(p) for p in prefixes):
-                            sources_consulted.add(source)
-                    
-                    try:
-                        arguments = json.loads(tool_call.function.arguments)
-                    except json.JSONDecodeError:
-                        arguments = {}
-                    
-                    tool_call_info.append((tool_call.id, tool_name, arguments))
+                    for tool_name, arguments, error in _expand_tool_call(
+                        tool_call.function.name, tool_call.function.arguments, enabled_prefixes
+                    ):
+                        if error is not None:
+                            logger.warning("Rejected call to %r: %s", tool_name, error)
+                            tool_call_info.append((tool_call.id, None, error))
+                            answer_key = None
+                            continue
+                        tools_used.append(tool_name)
+                        key = (tool_name, orjson.dumps(arguments, option=orjson.OPT_SORT_KEYS))
+                        unique_calls.setdefault(key, arguments)
+                        tool_call_info.append((tool_call.id, key, None))
+                
+                # Track sources (tools outside SOURCE_TOOL_MAP have none)
+                sources_consulted |= _sources_mask(tool_name for tool_name, _ in unique_calls)
                 
                 # Emit all tool start events
-                for _, tool_name, arguments in tool_call_info:
+                for (tool_name, _), arguments in unique_calls.items():
                     yield ToolStartEvent(tool=tool_name, arguments=arguments)
                 
-                # Execute all tools in PARALLEL using asyncio.gather
-                if len(tool_call_info) > 1:
-                    logger.info(f"Executing {len(tool_call_info)} tools in parallel")
+                # Execute all tools in PARALLEL and report each one as soon as it finishes
+                if len(unique_calls) > 1:
+                    logger.info("Executing %s tools in parallel", len(unique_calls))
                 
-                async def execute_with_context(tool_name: str, arguments: dict) -> tuple[str, str, dict]:
-                    result = await self._execute_tool(tool_name, arguments)
-                    return (tool_name, result, arguments)
+                tasks = {
+                    key: asyncio.create_task(self._execute_tool(key[0], arguments, key[1]))
+                    for key, arguments in unique_calls.items()
+                }
+                task_keys = {task: key for key, task in tasks.items()}
+                results: dict[tuple[str, bytes], str] = {}
+                timed_out: set[tuple[str, bytes]] = set()
+                try:
+                    # A slow provider (e.g. a large ArcGIS query) can't hold the answer
+                    # back past the deadline; the model is told which tools timed out
+                    loop = asyncio.get_running_loop()
+                    deadline = loop.time() + self.tool_round_timeout
+                    pending = set(tasks.values())
+                    while pending:
+                        remaining = deadline - loop.time()
+                        if remaining <= 0:
+                            break
+                        done, pending = await asyncio.wait(
+                            pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+                        )
+                        for task in done:
+                            result = results[task_keys[task]] = task.result()
+                            preview = result[:TOOL_PREVIEW_CHARS] + "..." if len(result) > TOOL_PREVIEW_CHARS else result
+                            yield ToolEndEvent.model_construct(tool=task_keys[task][0], success=True, preview=preview)
+                    for task in pending:
+                        timed_out.add(task_keys[task])
+                        tool_name = task_keys[task][0]
+                        logger.warning("Tool %s timed out after %ss", tool_name, self.tool_round_timeout)
+                        results[task_keys[task]] = orjson.dumps({
+                            "status": "timeout",
+                            "error": f"{tool_name} did not respond within {self.tool_round_timeout:g} seconds",
+                        }).decode()
+                        yield ToolEndEvent.model_construct(tool=tool_name, success=False, preview="Tidsavbrudd")
+                finally:
+                    # Shared cacheable calls keep running (shielded) and fill the cache
+                    for task in tasks.values():
+                        task.cancel()
                 
-                parallel_results = await asyncio.gather(*[
-                    execute_with_context(tool_name, arguments)
-                    for _, tool_name, arguments in tool_call_info
-                ])
+                for key, arguments in unique_calls.items():
+                    if key not in timed_out:
+                        tool_results.append((key[0], results[key], arguments))
+                if timed_out or any(_is_error_result(result) for result in results.values()):
+                    # A later ask may get the full results; don't replay this answer
+                    answer_key = None
                 
-                # Process results and emit end events
-                for i, (tool_call_id, tool_name, arguments) in enumerate(tool_call_info):
-                    _, result, _ = parallel_results[i]
-                    tool_results.append((tool_name, result, arguments))
-                    
-                    # Emit tool end event
-                    preview = result[:150] + "..." if len(result) > 150 else result
-                    yield ToolEndEvent(tool=tool_name, success=True, preview=preview)
-                    
+                # Every tool_call_id needs its own reply (a batch call gets its results as
+                # one array); they keep call order so the follow-up prompt doesn't depend on timing
+                call_results: dict[str, list[str]] = {tc.id: [] for tc in message.tool_calls}
+                for tool_call_id, key, error in tool_call_info:
+                    call_results[tool_call_id].append(results[key] if key else error)
+                for tool_call in message.tool_calls:
                     messages.append({
                         "role": "tool",
-                        "tool_call_id": tool_call_id,
-                        "content": result,
+                        "tool_call_id": tool_call.id,
+                        "content": _tool_message_content(tool_call.function.name, call_results[tool_call.id]),
                     })
                 
-                # Get next response (non-streaming for tool loop) - continue using same model
-                # Check circuit breaker again
-                use_router_model = self.router_model
-                if (AgentRunner._router_rate_limited_until and 
-                    time.time() < AgentRunner._router_rate_limited_until and
-                    self.router_model != self.model):
-                    use_router_model = self.model
+                # Out of tool rounds: synthesize now rather than asking the router again
+                # only to drop any further tool calls it makes
+                if iteration_count >= self.max_tool_iterations:
+                    logger.info("Tool round limit (%s) reached, synthesizing", self.max_tool_iterations)
+                    break
                 
-                try:
-                    response = self.client.chat.completions.create(
-                        model=use_router_model,
-                        messages=messages,
-                        tools=tools if tools else None,
-                        tool_choice="auto" if tools else None,
-                        max_tokens=2048,
-                        temperature=0.7,
-                        parallel_tool_calls=True,
-                    )
-                    # If router worked, reset circuit breaker
-                    if use_router_model == self.router_model and AgentRunner._router_rate_limited_until:
-                        logger.info(f"{self.router_model} working again, resetting circuit breaker")
-                        AgentRunner._router_rate_limited_until = None
-                except Exception as e:
-                    error_str = str(e)
-                    # Check if it's a rate limit error
-                    if ("RateLimitReached" in error_str or 
-                        "rate_limit" in error_str.lower() or 
-                        "429" in error_str or
-                        "Too Many Requests" in error_str):
-                        logger.warning(f"Rate limit hit for {use_router_model}, falling back to {self.model}")
-                        # Set circuit breaker for 5 minutes
-                        AgentRunner._router_rate_limited_until = time.time() + 300
-                        # Fall back to using responder model
-                        response = self.client.chat.completions.create(
-                            model=self.model,
-                            messages=messages,
-                            tools=tools if tools else None,
-                            tool_choice="auto" if tools else None,
-                            max_tokens=2048,
-                            temperature=0.7,
-                            parallel_tool_calls=True,
-                        )
-                    else:
-                        raise
+                # Get next response (non-streaming for tool loop)
+                response, fell_back = await self._route(messages, tools)
+                if fell_back:
+                    answer_key = None
                 
                 message = response.choices[0].message
-                
-                if iteration_count >= self.max_tool_iterations and message.tool_calls:
-                    logger.warning(f"Reached max tool iterations ({self.max_tool_iterations}), stopping tool loop")
-                    # Clear tool calls to proceed to response generation
-                    message.tool_calls = None
             
             # Now stream the final response
-            yield StatusEvent(message="Genererer svar...")
+            yield StatusEvent.model_construct(message="Genererer svar...")
 
             # Make a streaming call for the final response - use quality model (gpt-4o)
-            logger.info(f"Synthesizing response with {self.model}")
-            stream = self.client.chat.completions.create(
+            logger.info("Synthesizing response with %s", self.model)
+            stream = await self._create_completion(
                 model=self.model,
                 messages=messages,
                 max_tokens=2048,
@@ -769,17 +1306,21 @@ class AgentRunner:
                 stream=True,
             )
             
-            for chunk in stream:
-                if chunk.choices and chunk.choices[0].delta.content:
-                    token = chunk.choices[0].delta.content
-                    full_response_text += token
-                    yield TokenEvent(content=token)
+            # Close the batcher (stopping its reader task) and then the HTTP stream
+            # as soon as we leave, e.g. when the client disconnects mid-answer, so
+            # the pooled connection is released instead of draining in the background
+            response_parts: list[str] = []
+            async with stream, aclosing(_coalesce_tokens(stream)) as batches:
+                async for text in batches:
+                    response_parts.append(text)
+                    yield TokenEvent.model_construct(content=text)
+            full_response_text = "".join(response_parts)
             
             # If no streaming response, use the previous response
             if not full_response_text and message.content:
                 full_response_text = message.content
                 # Emit all tokens at once
-                yield TokenEvent(content=full_response_text)
+                yield TokenEvent.model_construct(content=full_response_text)
             
         except Exception as e:
             logger.error("Error in chat_stream", exc_info=True)
@@ -787,8 +1328,26 @@ class AgentRunner:
             return
         
         # Build final structured response
-        processing_time_ms = int((time.time() - start_time) * 1000)
+        processing_time_ms = (time.perf_counter_ns() - start_ns) // 1_000_000
+        build_args = (full_response_text, tool_results, tools_used, sources_consulted, processing_time_ms)
+        if sum(len(result) for _, result, _ in tool_results) > POSTPROCESS_THREAD_CHARS:
+            final_response = await asyncio.to_thread(self._build_response, *build_args)
+        else:
+            final_response = self._build_response(*build_args)
         
+        if answer_key and full_response_text:
+            answer_cache.set(answer_key, final_response, self.answer_cache_ttl)
+        yield DoneEvent.model_construct(response=final_response)
+    
+    def _build_response(
+        self,
+        full_response_text: str,
+        tool_results: list[tuple[str, str, dict[str, Any]]],
+        tools_used: list[str],
+        sources_consulted: int,
+        processing_time_ms: int,
+    ) -> ChatResponse:
+        """Build the structured response from the model's answer and the tool results."""
         # Extract sources from tool results (only those actually used in response)
         extracted_sources = self._extract_sources_from_tool_results(tool_results, full_response_text)
         
@@ -799,23 +1358,23 @@ class AgentRunner:
         # (these are now in structured fields, so we don't want duplicates)
         cleaned_response_text = self._clean_response_text(full_response_text)
         
-        final_response = ChatResponse(
-            response=ResponseContent(
+        # Every field below is built in this module from typed values, so skip
+        # re-validating the whole response tree (see the SSE event note above)
+        return ChatResponse.model_construct(
+            response=ResponseContent.model_construct(
                 text=cleaned_response_text,
                 summary=None,  # Could add a summarization step here
             ),
             sources=extracted_sources,
             locations=[],  # Could extract from riksantikvaren results
             related_queries=related_queries,
-            metadata=ChatResponseMetadata(
+            metadata=ChatResponseMetadata.model_construct(
                 tools_used=tools_used,
-                providers_consulted=list(sources_consulted),
+                providers_consulted=_sources_from_mask(sources_consulted),
                 processing_time_ms=processing_time_ms,
                 model=self.model,
             ),
         )
-        
-        yield DoneEvent(response=final_response)
     
     async def chat(self, request: ChatRequest) -> ChatResponse:
         """Process a chat request and return structured response (non-streaming)."""
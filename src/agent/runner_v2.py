@@ -13,17 +13,41 @@ Performance target: 50% faster than v1
 from __future__ import annotations
 
 import asyncio
-import json
 import logging
+import re
 import time
-from typing import Any, AsyncGenerator
-
-from openai import OpenAI, AzureOpenAI
+from collections import deque
+from contextlib import aclosing, nullcontext
+from functools import lru_cache
+from itertools import islice
+from typing import Any, AsyncGenerator, AsyncIterator, Iterator
+from urllib.parse import unquote
+
+import orjson
 from pydantic import BaseModel
 
+from src.agent.openai_client import (
+    get_completion_limiter,
+    get_openai_client,
+    is_rate_limit_error,
+    prompt_cache_options,
+)
+from src.agent.runner import (
+    SOURCE_TOOL_MAP,
+    _SNL_SLUG_RE,
+    _URL_RE,
+    _WIKI_SLUG_RE,
+    _coalesce_tokens,
+    _execute_cached_tool,
+    _source_for_tool,
+    _url_site,
+    warm_source_connections,
+)
+from src.agent.runner import _prefixes_for_sources as _source_prefixes
 from src.config.loader import get_settings
 from src.mcp.models import TextContent
 from src.mcp.registry import get_registry
+from src.utils.rate_limit import CircuitBreaker, get_source_limiter
 
 logger = logging.getLogger(__name__)
 
@@ -31,10 +55,39 @@ logger = logging.getLogger(__name__)
 # Source to Tool Mapping
 # =============================================================================
 
-SOURCE_TOOL_MAP = {
-    "wikipedia": ["wikipedia-"],
-    "snl": ["snl-"],
-    "riksantikvaren": ["riksantikvaren-", "arcgis-"],
+# SOURCE_TOOL_MAP and the memoized tool -> source lookup are shared with the v1 runner
+
+_ALL_SOURCES = tuple(sorted(SOURCE_TOOL_MAP))
+
+
+def _prefixes_for_sources(sources: tuple[str, ...]) -> tuple[str, ...]:
+    """Tool prefixes for a sorted source selection; all sources if none are known.
+    
+    Falls back to the same prefix tuple as selecting every source, so both share
+    one cached tool list in the registry.
+    """
+    return _source_prefixes(sources) or _source_prefixes(_ALL_SOURCES)
+
+
+# Source extraction patterns (_URL_RE, the slug patterns, _url_site) are shared with the v1 runner
+
+
+def _slug_title(slug_re: re.Pattern[str], url: str, site_name: str) -> str:
+    """Build "<article> – <site>" from an article URL, or just the site name."""
+    match = slug_re.search(url)
+    if not match:
+        return site_name
+    return f"{unquote(match.group(1)).replace('_', ' ')} – {site_name}"
+
+
+# Sources listed in a response; extraction stops once this many are found
+MAX_SOURCES = 10
+
+# Known source sites -> (provider, title builder); other URLs keep the tool's provider
+_SITE_SOURCES = {
+    "kulturminnesok.no": ("riksantikvaren", lambda url: "Kulturminnesøk"),
+    "snl.no": ("snl", lambda url: _slug_title(_SNL_SLUG_RE, url, "Store norske leksikon")),
+    "wikipedia.org": ("wikipedia", lambda url: _slug_title(_WIKI_SLUG_RE, url, "Wikipedia")),
 }
 
 # =============================================================================
@@ -223,6 +276,334 @@ Your formatting must be clean, readable, and consistent.
 Now write the response.
 """
 
+# Shared system messages: every request starts with the same objects, so the prompt
+# prefix stays byte-identical across requests (OpenAI prompt caching). Never mutate.
+_ROUTER_SYSTEM_MSG = {"role": "system", "content": ROUTER_PROMPT}
+_RESPONDER_SYSTEM_MSG = {"role": "system", "content": RESPONDER_PROMPT}
+
+# =============================================================================
+# Tool Results
+# =============================================================================
+
+# Provider tool results are cached, and identical calls coalesced, by the v1 runner's
+# _execute_cached_tool; only the formatting (_call_tool) is specific to this runner
+
+# Responder context budget (tokens). Each tool contributes at most
+# MAX_TOOL_CONTEXT_TOKENS; tools take turns adding paragraphs up to MAX_CONTEXT_TOKENS.
+MAX_CONTEXT_TOKENS = 1500
+MAX_TOOL_CONTEXT_TOKENS = 500
+# Without tiktoken, tokens are estimated from length (Norwegian prose is ~3-4 chars/token)
+CHARS_PER_TOKEN = 4
+# A cut result is trimmed back to a sentence end this close to the cut, if there is one
+SENTENCE_TRIM_CHARS = 120
+_PARAGRAPH_SPLIT_RE = re.compile(r'\n\s*\n')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1)
+def _get_encoding() -> Any:
+    """The gpt-4o tokenizer, or None without the optional tiktoken package."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:  # Not installed, or the encoding file can't be fetched
+        logger.info("tiktoken unavailable, estimating context tokens from length")
+        return None
+
+
+async def _load_encoding() -> None:
+    """Load the tokenizer in a worker thread; the first load may download its BPE file."""
+    if not _get_encoding.cache_info().currsize:
+        await asyncio.to_thread(_get_encoding)
+
+
+def _count_tokens(text: str) -> int:
+    """Tokens in text: exact with tiktoken, otherwise estimated."""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to max_tokens, ending at a nearby sentence end when there is one."""
+    encoding = _get_encoding()
+    if encoding is not None:
+        cut = encoding.decode(encoding.encode(text)[:max_tokens])
+    else:
+        cut = text[:max_tokens * CHARS_PER_TOKEN]
+    if len(cut) >= len(text):
+        return text
+    sentence_end = cut.rfind(". ", len(cut) - SENTENCE_TRIM_CHARS)
+    return cut[:sentence_end + 1] if sentence_end > 0 else cut
+
+
+def _iter_paragraphs(text: str) -> Iterator[str]:
+    """Split text on blank lines lazily, so a long result is only read as far as needed."""
+    start = 0
+    for separator in _PARAGRAPH_SPLIT_RE.finditer(text):
+        yield text[start:separator.start()]
+        start = separator.end()
+    yield text[start:]
+
+
+def _compress_context(tool_results: list[tuple[str, str, dict]]) -> str:
+    """Build the responder's search-result context from tool results.
+    
+    URLs are dropped (the answer must not contain links, and sources are extracted
+    from the raw results), a paragraph already taken from another tool is skipped,
+    and tools take turns so one large result can't crowd out the rest. Each result
+    is only scanned up to its per-tool budget.
+    """
+    seen: set[str] = set()
+    queues: list[tuple[str, deque[tuple[str, int]]]] = []
+    for name, result, _ in tool_results:
+        paragraphs: deque[tuple[str, int]] = deque()
+        tool_budget = MAX_TOOL_CONTEXT_TOKENS
+        for paragraph in _iter_paragraphs(result):
+            paragraph = _URL_RE.sub("", paragraph)
+            key = _WHITESPACE_RE.sub(" ", paragraph).strip()
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            paragraph = paragraph.strip()
+            tokens = _count_tokens(paragraph)
+            if tokens > tool_budget:
+                paragraph = _truncate_tokens(paragraph, tool_budget)
+                paragraphs.append((paragraph, _count_tokens(paragraph)))
+                break
+            paragraphs.append((paragraph, tokens))
+            tool_budget -= tokens
+        queues.append((name, paragraphs))
+    
+    chosen: list[list[str]] = [[] for _ in queues]
+    budget = MAX_CONTEXT_TOKENS
+    while any(paragraphs for _, paragraphs in queues):
+        for (_, paragraphs), taken in zip(queues, chosen):
+            if not paragraphs:
+                continue
+            paragraph, tokens = paragraphs[0]
+            if tokens > budget:
+                paragraphs.clear()  # Keep each tool's text in order: stop at the first misfit
+                continue
+            paragraphs.popleft()
+            taken.append(paragraph)
+            budget -= tokens
+    
+    return "\n\n---\n\n".join(
+        f"## {name}\n" + "\n\n".join(taken) for (name, _), taken in zip(queues, chosen) if taken
+    )
+
+# =============================================================================
+# Router Streaming
+# =============================================================================
+
+def _parse_arguments(text: str) -> dict | None:
+    """Parse streamed tool arguments; None until they form a complete JSON object."""
+    try:
+        value = orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+async def _stream_tool_calls(stream: Any) -> AsyncIterator[tuple[str, dict]]:
+    """Yield (name, arguments) for each tool call in a streamed router completion.
+    
+    A call is yielded as soon as its arguments close into a JSON object, so its tool
+    can start while the router is still writing the next call. Arguments that never
+    parse are yielded as {} once the next call starts or the stream ends.
+    """
+    index = None
+    name = ""
+    arguments = ""
+    pending = False
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        for delta in chunk.choices[0].delta.tool_calls or ():
+            if delta.index != index:
+                if pending and name:
+                    yield name, _parse_arguments(arguments) or {}
+                index, name, arguments, pending = delta.index, "", "", True
+            if delta.function:
+                name += delta.function.name or ""
+                arguments += delta.function.arguments or ""
+            if pending and name and arguments.rstrip().endswith("}"):
+                parsed = _parse_arguments(arguments)
+                if parsed is not None:
+                    pending = False
+                    yield name, parsed
+    if pending and name:
+        yield name, _parse_arguments(arguments) or {}
+
+
+# =============================================================================
+# Router Batching
+# =============================================================================
+
+# Router calls for questions that arrive within ROUTER_BATCH_WINDOW of each other
+# (same client, model and tools) go out as one completion listing the questions by
+# number, so the system prompt and tool definitions are sent once per burst. Opt-in
+# (chat_router_batching): a batched call can't stream, and every question waits for
+# the window even when no other question comes.
+ROUTER_BATCH_SIZE = 8
+ROUTER_BATCH_WINDOW = 0.02  # seconds
+ROUTER_BATCH_MAX_TOKENS = 4000  # a question that doesn't fit starts the next batch
+ROUTER_MAX_TOKENS = 150  # per question
+
+_ROUTER_BATCH_MSG = {
+    "role": "system",
+    "content": (
+        "The user message lists several independent questions, numbered [1], [2], and so on. "
+        "Select tools for each question on its own, and add \"request_index\" (the question's "
+        "number) to the arguments of every tool call."
+    ),
+}
+
+
+class _RouterBatch:
+    """Questions waiting to share one router call."""
+    
+    def __init__(self, runner: AgentRunnerV2, model: str, tools: list[dict]):
+        self.runner = runner
+        self.model = model
+        self.tools = tools
+        self.questions: list[str] = []
+        self.futures: list[asyncio.Future[list[tuple[str, dict]] | None]] = []
+        self.tokens = 0
+
+
+class RouterBatcher:
+    """Coalesces router calls from concurrent sessions into one completion per burst."""
+    
+    def __init__(
+        self,
+        max_size: int = ROUTER_BATCH_SIZE,
+        window: float = ROUTER_BATCH_WINDOW,
+        max_tokens: int = ROUTER_BATCH_MAX_TOKENS,
+    ):
+        self.max_size = max_size
+        self.window = window
+        self.max_tokens = max_tokens
+        self._open: dict[tuple[int, str, int], _RouterBatch] = {}
+        self._tasks: set[asyncio.Task] = set()
+    
+    async def route(
+        self, runner: AgentRunnerV2, model: str, question: str, tools: list[dict]
+    ) -> list[tuple[str, dict]] | None:
+        """Get the (name, arguments) tool calls the router picks for a question.
+        
+        Returns None when the question should be routed on its own: it is too long,
+        no other question arrived in the window, or the batched call failed or
+        returned calls that can't be matched to questions.
+        """
+        tokens = _count_tokens(question)
+        if tokens > self.max_tokens:
+            return None
+        
+        # Tool lists are cached in the registry, so equal selections are the same object
+        key = (id(runner.client), model, id(tools))
+        batch = self._open.get(key)
+        if batch is not None and batch.tokens + tokens > self.max_tokens:
+            self._flush(key)
+            batch = None
+        if batch is None:
+            batch = self._open[key] = _RouterBatch(runner, model, tools)
+            self._spawn(self._flush_after(key, batch))
+        
+        future = asyncio.get_running_loop().create_future()
+        batch.questions.append(question)
+        batch.futures.append(future)
+        batch.tokens += tokens
+        if len(batch.questions) >= self.max_size:
+            self._flush(key)
+        return await future
+    
+    def _spawn(self, coro: Any) -> None:
+        """Run a coroutine in a task that is kept alive until it finishes."""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _flush_after(self, key: tuple[int, str, int], batch: _RouterBatch) -> None:
+        """Send a batch once its window closes, unless it filled up first."""
+        await asyncio.sleep(self.window)
+        if self._open.get(key) is batch:
+            self._flush(key)
+    
+    def _flush(self, key: tuple[int, str, int]) -> None:
+        """Close a batch to new questions and send it."""
+        batch = self._open.pop(key, None)
+        if batch is not None:
+            self._spawn(self._run(batch))
+    
+    async def _run(self, batch: _RouterBatch) -> None:
+        """Route a closed batch and hand each question its tool calls."""
+        results = None
+        if len(batch.questions) > 1:
+            try:
+                results = await self._route_batch(batch)
+            except Exception:
+                logger.warning(
+                    "Batched routing of %s questions failed, routing them one by one",
+                    len(batch.questions),
+                    exc_info=True,
+                )
+        for i, future in enumerate(batch.futures):
+            if not future.done():
+                future.set_result(None if results is None else results[i])
+    
+    async def _route_batch(self, batch: _RouterBatch) -> list[list[tuple[str, dict]]] | None:
+        """Make one router call for all questions in a batch; None if the calls can't be split."""
+        numbered = "\n".join(f"[{i}] {question}" for i, question in enumerate(batch.questions, 1))
+        response = await batch.runner._create_completion(
+            model=batch.model,
+            messages=[_ROUTER_SYSTEM_MSG, _ROUTER_BATCH_MSG, {"role": "user", "content": numbered}],
+            tools=batch.tools,
+            tool_choice="auto",
+            max_tokens=ROUTER_MAX_TOKENS * len(batch.questions),
+            parallel_tool_calls=True,
+        )
+        
+        results: list[list[tuple[str, dict]]] = [[] for _ in batch.questions]
+        for tool_call in response.choices[0].message.tool_calls or ():
+            arguments = _parse_arguments(tool_call.function.arguments) or {}
+            index = arguments.pop("request_index", None)
+            if not isinstance(index, int) or not 1 <= index <= len(results):
+                logger.warning("Batched router call %s has no valid request_index", tool_call.function.name)
+                return None
+            results[index - 1].append((tool_call.function.name, arguments))
+        return results
+
+
+router_batcher = RouterBatcher()
+
+
+# =============================================================================
+# Empty Results
+# =============================================================================
+
+# Provider tools report an empty search as "No ... found ..."
+_NO_RESULTS_RE = re.compile(r'No [^\n]* found[^\n]*')
+
+NO_RESULTS_RESPONSE = "Jeg fant dessverre ingen relevante kilder for spørsmålet ditt."
+
+
+def _has_results(result: str) -> bool:
+    """Whether a tool result has anything to answer from (not empty, an error or "No ... found")."""
+    result = result.strip()
+    if not result or result.startswith(("Error", "Tool not found")):
+        return False
+    return not _NO_RESULTS_RE.fullmatch(result)
+
+
+async def _batched_tool_calls(calls: list[tuple[str, dict]]) -> AsyncIterator[tuple[str, dict]]:
+    """Yield tool calls from a batched router answer like a streamed one."""
+    for call in calls:
+        yield call
+
+
 # =============================================================================
 # Agent Runner V2
 # =============================================================================
@@ -235,79 +616,76 @@ class AgentRunnerV2:
     """
     
     # Class-level circuit breaker for rate-limited router
-    _router_rate_limited_until = None
+    _router_breaker = CircuitBreaker(cooldown_base=30.0, cooldown_max=600.0)
     
     def __init__(self, api_key: str):
         """Initialize with OpenAI API key (works with both OpenAI and Azure OpenAI)."""
         settings = get_settings()
         
         if settings.use_azure_openai:
-            logger.info(f"Using Azure OpenAI: {settings.azure_openai_endpoint}")
-            self.client = AzureOpenAI(
-                api_key=api_key,
-                api_version=settings.azure_openai_api_version,
-                azure_endpoint=settings.azure_openai_endpoint,
-            )
+            logger.info("Using Azure OpenAI: %s", settings.azure_openai_endpoint)
             main_deployment = settings.azure_openai_deployment
             
             # Check if explicit router deployment is set
             if settings.azure_openai_deployment_router:
                 self.router_model = settings.azure_openai_deployment_router
-                logger.info(f"Router deployment: {self.router_model} (from AZURE_OPENAI_DEPLOYMENT_ROUTER)")
+                logger.info("Router deployment: %s (from AZURE_OPENAI_DEPLOYMENT_ROUTER)", self.router_model)
             elif "gpt-4o" in main_deployment and "mini" not in main_deployment:
                 # Try to derive mini deployment name (e.g., "gpt-4o" -> "gpt-4o-mini")
                 self.router_model = main_deployment.replace("gpt-4o", "gpt-4o-mini")
-                logger.info(f"Router deployment: {self.router_model} (derived from {main_deployment})")
+                logger.info("Router deployment: %s (derived from %s)", self.router_model, main_deployment)
             else:
                 # If deployment name doesn't match pattern or already contains "mini",
                 # use the same deployment for both (works if you only have one deployment)
                 self.router_model = main_deployment
-                logger.info(f"Using same deployment for router: {self.router_model}")
+                logger.info("Using same deployment for router: %s", self.router_model)
             
             self.responder_model = main_deployment
-            logger.info(f"Responder deployment: {self.responder_model}")
+            logger.info("Responder deployment: %s", self.responder_model)
         else:
             logger.info("Using OpenAI direct API")
-            self.client = OpenAI(api_key=api_key)
             self.router_model = "gpt-4o-mini"
             self.responder_model = "gpt-4o"
         
+        self.client = get_openai_client(api_key)
         self.registry = get_registry()
+        self.router_batching = settings.chat_router_batching
+        self.tool_round_timeout = settings.chat_tool_round_timeout
+        self.warm_connections = settings.chat_warm_connections
     
-    def _get_enabled_tools(self, sources: list[str]) -> list[dict]:
-        """Get OpenAI tool definitions for enabled sources."""
-        tools = []
-        enabled_prefixes = set()
-        
-        for source in sources:
-            if source in SOURCE_TOOL_MAP:
-                enabled_prefixes.update(SOURCE_TOOL_MAP[source])
-        
-        # If no sources specified, enable all
-        if not enabled_prefixes:
-            enabled_prefixes = {p for prefixes in SOURCE_TOOL_MAP.values() for p in prefixes}
+    async def _create_completion(self, **kwargs: Any) -> Any:
+        """Create a chat completion once a shared OpenAI request slot is free.
         
-        for tool in self.registry.list_tools():
-            if any(tool.name.startswith(prefix) for prefix in enabled_prefixes):
-                tools.append({
-                    "type": "function",
-                    "function": {
-                        "name": tool.name,
-                        "description": tool.description,
-                        "parameters": tool.inputSchema,
-                    }
-                })
-        
-        return tools
+        Router and responder calls start with different system prompts, so each
+        gets its own prompt_cache_key instead of splitting one key's cache between
+        two prefixes.
+        """
+        router = kwargs["messages"][0] is _ROUTER_SYSTEM_MSG
+        cache_options = prompt_cache_options("chat-v2-router" if router else "chat-v2-responder")
+        async with get_completion_limiter():
+            return await self.client.chat.completions.create(**kwargs, **cache_options)
+    
+    def _get_enabled_tools(self, sources: list[str]) -> list[dict]:
+        """Get OpenAI tool definitions for enabled sources (cached in the registry)."""
+        return self.registry.openai_tools(_prefixes_for_sources(tuple(sorted(set(sources)))))
     
     async def _execute_tool(self, tool_name: str, arguments: dict) -> str:
-        """Execute a tool and return the result as a string."""
+        """Execute a tool and return the result as a string (cached, see _execute_cached_tool)."""
+        return await _execute_cached_tool(tool_name, arguments, self._call_tool)
+    
+    async def _call_tool(self, tool_name: str, arguments: dict) -> str:
+        """Call a tool handler and return its result as a string."""
         tool = self.registry.get(tool_name)
         if not tool:
             return f"Tool not found: {tool_name}"
         
         try:
-            result = await tool.handler(arguments)
+            source = _source_for_tool(tool_name)
+            if source:
+                async with get_source_limiter(source):
+                    result = await tool.run(arguments)
+            else:
+                result = await tool.run(arguments)
             
             # Handle different result types
             if isinstance(result, TextContent):
@@ -315,68 +693,39 @@ class AgentRunnerV2:
             elif hasattr(result, 'text'):
                 return result.text
             elif isinstance(result, list):
-                return json.dumps([
-                    r.text if isinstance(r, TextContent) else str(r) 
-                    for r in result
-                ], ensure_ascii=False)
+                # Plain text keeps paragraphs intact for _compress_context
+                return "\n".join([r.text if isinstance(r, TextContent) else str(r) for r in result])
             else:
                 return str(result)
                 
         except Exception as e:
-            logger.error(f"Tool execution error: {tool_name}", exc_info=True)
+            logger.error("Tool execution error: %s", tool_name, exc_info=True)
             return f"Error executing {tool_name}: {str(e)}"
     
     def _extract_sources_from_results(
         self, tool_results: list[tuple[str, str, dict]], response_text: str
     ) -> list[SourceReference]:
         """Extract source references from tool results."""
-        import re
-        from urllib.parse import unquote
-        
         sources = []
         seen_urls = set()
-        response_lower = response_text.lower()
         
         for tool_name, result_text, arguments in tool_results:
             # Determine provider
-            provider = "riksantikvaren"
-            if tool_name.startswith("wikipedia-"):
-                provider = "wikipedia"
-            elif tool_name.startswith("snl-"):
-                provider = "snl"
+            tool_provider = _source_for_tool(tool_name) or "riksantikvaren"
             
             # Find URLs in result
-            url_pattern = r'https?://[^\s<>"{}|\\^`\[\])]+[^\s<>"{}|\\^`\[\].,)]'
-            urls = re.findall(url_pattern, result_text)
-            
-            for url in urls[:3]:
-                url = url.rstrip('.,;:)')
+            for url_match in islice(_URL_RE.finditer(result_text), 3):
+                url = url_match.group(0)
                 
                 if url not in seen_urls:
                     seen_urls.add(url)
                     
-                    # Determine title from URL
-                    if "kulturminnesok.no" in url:
-                        title = "Kulturminnesøk"
-                        provider = "riksantikvaren"
-                    elif "snl.no" in url:
-                        url_match = re.search(r'snl\.no/([^?#]+)', url)
-                        if url_match:
-                            article_name = unquote(url_match.group(1)).replace('_', ' ')
-                            title = f"{article_name} – Store norske leksikon"
-                        else:
-                            title = "Store norske leksikon"
-                        provider = "snl"
-                    elif "wikipedia.org" in url:
-                        url_match = re.search(r'wikipedia\.org/wiki/([^?#]+)', url)
-                        if url_match:
-                            article_name = unquote(url_match.group(1)).replace('_', ' ')
-                            title = f"{article_name} – Wikipedia"
-                        else:
-                            title = "Wikipedia"
-                        provider = "wikipedia"
+                    # Provider and title from the URL's site, one lookup per URL
+                    site = _SITE_SOURCES.get(_url_site(url))
+                    if site:
+                        provider, title = site[0], site[1](url)
                     else:
-                        title = arguments.get("query", "Kilde")
+                        provider, title = tool_provider, arguments.get("query", "Kilde")
                     
                     sources.append(SourceReference(
                         title=title,
@@ -384,8 +733,10 @@ class AgentRunnerV2:
                         provider=provider,
                         snippet=None
                     ))
+                    if len(sources) == MAX_SOURCES:
+                        return sources
         
-        return sources[:10]
+        return sources
     
     async def chat_stream(self, request: ChatRequest) -> AsyncGenerator[SSEEvent, None]:
         """
@@ -396,10 +747,10 @@ class AgentRunnerV2:
         2. Execute selected tools in parallel
         3. Generate response with gpt-4o using tool results (streaming)
         """
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
         tools_used: list[str] = []
         tool_results: list[tuple[str, str, dict]] = []
-        full_response_text = ""
+        response_parts: list[str] = []
         
         yield StatusEvent(message="Velger kilder...")
         
@@ -410,160 +761,183 @@ class AgentRunnerV2:
             yield ErrorEvent(message="Ingen kilder tilgjengelig")
             return
         
+        # Connect to the tool APIs while the router decides
+        if self.warm_connections:
+            warm_source_connections(request.sources)
+        
         try:
+            # Once per process, so token counting never blocks the event loop
+            await _load_encoding()
+            
             # =================================================================
             # PHASE 1: Fast tool selection with gpt-4o-mini
             # =================================================================
             
             router_messages = [
-                {"role": "system", "content": ROUTER_PROMPT},
+                _ROUTER_SYSTEM_MSG,
                 {"role": "user", "content": request.message}
             ]
             
             # Check circuit breaker - if mini was recently rate-limited, skip it
             use_router_model = self.router_model
-            if (AgentRunnerV2._router_rate_limited_until and 
-                time.time() < AgentRunnerV2._router_rate_limited_until and
+            if (AgentRunnerV2._router_breaker.is_open() and
                 self.router_model != self.responder_model):
-                logger.info(f"Skipping {self.router_model} (circuit breaker active), using {self.responder_model}")
+                logger.info("Skipping %s (circuit breaker active), using %s", self.router_model, self.responder_model)
                 use_router_model = self.responder_model
             
-            # Try router model first, fall back to responder if rate limited
-            try:
-                router_response = self.client.chat.completions.create(
-                    model=use_router_model,
-                    messages=router_messages,
-                    tools=tools,
-                    tool_choice="auto",
-                    max_tokens=150,
-                    parallel_tool_calls=True,
-                )
-                # If mini worked, reset circuit breaker
-                if use_router_model == self.router_model and AgentRunnerV2._router_rate_limited_until:
-                    logger.info(f"{self.router_model} working again, resetting circuit breaker")
-                    AgentRunnerV2._router_rate_limited_until = None
-            except Exception as e:
-                error_str = str(e)
-                # Check if it's a rate limit error
-                if ("RateLimitReached" in error_str or 
-                    "rate_limit" in error_str.lower() or 
-                    "429" in error_str or
-                    "Too Many Requests" in error_str):
-                    logger.warning(f"Rate limit hit for {use_router_model}, falling back to {self.responder_model}")
-                    # Set circuit breaker for 5 minutes
-                    AgentRunnerV2._router_rate_limited_until = time.time() + 300
-                    # Fall back to using responder model for routing
-                    router_response = self.client.chat.completions.create(
-                        model=self.responder_model,
+            # Under bursty load, questions arriving together share one router call
+            routed = None
+            if self.router_batching:
+                routed = await router_batcher.route(self, use_router_model, request.message, tools)
+            
+            if routed is not None:
+                router_stream = nullcontext()
+                tool_calls = _batched_tool_calls(routed)
+            else:
+                # Try router model first, fall back to responder if rate limited.
+                # Streamed, so each tool starts as soon as the router has written its call.
+                try:
+                    router_stream = await self._create_completion(
+                        model=use_router_model,
                         messages=router_messages,
                         tools=tools,
                         tool_choice="auto",
-                        max_tokens=150,
+                        max_tokens=ROUTER_MAX_TOKENS,
                         parallel_tool_calls=True,
+                        stream=True,
                     )
-                else:
-                    raise
+                    # If mini worked, reset circuit breaker
+                    if use_router_model == self.router_model and AgentRunnerV2._router_breaker.reset():
+                        logger.info("%s working again, resetting circuit breaker", self.router_model)
+                except Exception as e:
+                    if is_rate_limit_error(e):
+                        logger.warning("Rate limit hit for %s, falling back to %s", use_router_model, self.responder_model)
+                        # Route with the main model until the (growing) cooldown ends
+                        AgentRunnerV2._router_breaker.trip()
+                        # Fall back to using responder model for routing
+                        router_stream = await self._create_completion(
+                            model=self.responder_model,
+                            messages=router_messages,
+                            tools=tools,
+                            tool_choice="auto",
+                            max_tokens=ROUTER_MAX_TOKENS,
+                            parallel_tool_calls=True,
+                            stream=True,
+                        )
+                    else:
+                        raise
+                
+                tool_calls = _stream_tool_calls(router_stream)
             
-            tool_calls = router_response.choices[0].message.tool_calls or []
+            # =================================================================
+            # PHASE 2: Execute tools in parallel, as the router names them
+            # =================================================================
+            
+            async def execute_with_context(name: str, args: dict) -> tuple[str, str, dict]:
+                result = await self._execute_tool(name, args)
+                return (name, result, args)
+            
+            tool_tasks: list[asyncio.Task[tuple[str, str, dict]]] = []
+            pending: set[asyncio.Task[tuple[str, str, dict]]] = set()
+            try:
+                async with router_stream:
+                    async for tool_name, arguments in tool_calls:
+                        if not tool_tasks:
+                            yield StatusEvent(message="Søker i kildene...")
+                        tools_used.append(tool_name)
+                        yield ToolStartEvent(tool=tool_name, arguments=arguments)
+                        tool_tasks.append(asyncio.create_task(execute_with_context(tool_name, arguments)))
+                
+                # Report each tool as soon as it finishes; a slow provider can't hold
+                # the answer back past the round deadline
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + self.tool_round_timeout
+                pending = set(tool_tasks)
+                while pending:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    done, pending = await asyncio.wait(
+                        pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        name, result, _ = task.result()
+                        preview = result[:150] + "..." if len(result) > 150 else result
+                        yield ToolEndEvent(tool=name, success=True, preview=preview)
+                for task, tool_name in zip(tool_tasks, tools_used):
+                    if task in pending:
+                        logger.warning("Tool %s timed out after %ss", tool_name, self.tool_round_timeout)
+                        yield ToolEndEvent(tool=tool_name, success=False, preview="Tidsavbrudd")
+            finally:
+                # Only does anything if routing failed, tools timed out or the client went
+                # away; shared cacheable calls keep running (shielded) and fill the cache
+                for task in tool_tasks:
+                    task.cancel()
             
-            if not tool_calls:
+            if not tool_tasks:
                 # No tools selected - generate direct response
                 yield StatusEvent(message="Genererer svar...")
                 
-                stream = self.client.chat.completions.create(
+                stream = await self._create_completion(
                     model=self.responder_model,
                     messages=[
-                        {"role": "system", "content": RESPONDER_PROMPT},
+                        _RESPONDER_SYSTEM_MSG,
                         {"role": "user", "content": request.message}
                     ],
                     max_tokens=1500,
                     stream=True,
                 )
                 
-                for chunk in stream:
-                    if chunk.choices and len(chunk.choices) > 0 and chunk.choices[0].delta.content:
-                        token = chunk.choices[0].delta.content
-                        full_response_text += token
-                        yield TokenEvent(content=token)
+                async with stream, aclosing(_coalesce_tokens(stream)) as batches:
+                    async for text in batches:
+                        response_parts.append(text)
+                        yield TokenEvent(content=text)
             
             else:
-                # =============================================================
-                # PHASE 2: Execute tools in parallel
-                # =============================================================
-                
-                yield StatusEvent(message=f"Søker i {len(tool_calls)} kilder...")
+                # Results in call order (the context doesn't depend on timing), without
+                # the tools that timed out
+                tool_results.extend(task.result() for task in tool_tasks if task not in pending)
                 
-                # Prepare tool calls
-                tool_call_info = []
-                for tc in tool_calls:
-                    tool_name = tc.function.name
-                    tools_used.append(tool_name)
+                if not any(_has_results(result) for _, result, _ in tool_results):
+                    # Nothing to synthesize from: a fixed answer instead of a responder call
+                    response_parts.append(NO_RESULTS_RESPONSE)
+                    yield TokenEvent(content=NO_RESULTS_RESPONSE)
+                else:
+                    # =============================================================
+                    # PHASE 3: Generate response with gpt-4o
+                    # =============================================================
                     
-                    try:
-                        arguments = json.loads(tc.function.arguments)
-                    except json.JSONDecodeError:
-                        arguments = {}
+                    yield StatusEvent(message="Genererer svar...")
                     
-                    tool_call_info.append((tool_name, arguments))
-                    yield ToolStartEvent(tool=tool_name, arguments=arguments)
-                
-                # Execute all tools in parallel
-                async def execute_with_context(name: str, args: dict) -> tuple[str, str, dict]:
-                    result = await self._execute_tool(name, args)
-                    return (name, result, args)
-                
-                parallel_results = await asyncio.gather(*[
-                    execute_with_context(name, args) 
-                    for name, args in tool_call_info
-                ])
-                
-                # Process results
-                for name, result, args in parallel_results:
-                    tool_results.append((name, result, args))
-                    preview = result[:150] + "..." if len(result) > 150 else result
-                    yield ToolEndEvent(tool=name, success=True, preview=preview)
-                
-                # =============================================================
-                # PHASE 3: Generate response with gpt-4o
-                # =============================================================
-                
-                yield StatusEvent(message="Genererer svar...")
-                
-                # Build context from tool results
-                context_parts = []
-                for name, result, _ in tool_results:
-                    # Truncate large results
-                    truncated = result[:2000] if len(result) > 2000 else result
-                    context_parts.append(f"## {name}\n{truncated}")
-                
-                context = "\n\n---\n\n".join(context_parts)
-                
-                responder_messages = [
-                    {"role": "system", "content": RESPONDER_PROMPT},
-                    {"role": "user", "content": request.message},
-                    {"role": "assistant", "content": "I've searched the sources. Here's what I found:"},
-                    {"role": "user", "content": f"Search results:\n\n{context}\n\nPlease synthesize this into a helpful response."}
-                ]
-                
-                # Add conversation history if present
-                if request.conversation_history:
-                    # Insert history before current message
-                    for msg in request.conversation_history[-4:]:  # Last 4 messages
-                        responder_messages.insert(2, msg)
-                
-                stream = self.client.chat.completions.create(
-                    model=self.responder_model,
-                    messages=responder_messages,
-                    max_tokens=1500,
-                    temperature=0.7,
-                    stream=True,
-                )
-                
-                for chunk in stream:
-                    if chunk.choices and len(chunk.choices) > 0 and chunk.choices[0].delta.content:
-                        token = chunk.choices[0].delta.content
-                        full_response_text += token
-                        yield TokenEvent(content=token)
+                    context = _compress_context(tool_results)
+                    
+                    # Stable prefix first (system prompt, then the last 4 history messages in
+                    # order), so consecutive turns share as much cached prompt as possible;
+                    # everything specific to this turn goes in one final user message
+                    responder_messages = [
+                        _RESPONDER_SYSTEM_MSG,
+                        *request.conversation_history[-4:],
+                        {
+                            "role": "user",
+                            "content": (
+                                f"{request.message}\n\nSearch results:\n\n{context}\n\n"
+                                "Please synthesize this into a helpful response."
+                            ),
+                        },
+                    ]
+                    
+                    stream = await self._create_completion(
+                        model=self.responder_model,
+                        messages=responder_messages,
+                        max_tokens=1500,
+                        temperature=0.7,
+                        stream=True,
+                    )
+                    
+                    async with stream, aclosing(_coalesce_tokens(stream)) as batches:
+                        async for text in batches:
+                            response_parts.append(text)
+                            yield TokenEvent(content=text)
         
         except Exception as e:
             logger.error("Error in chat_stream", exc_info=True)
@@ -571,17 +945,15 @@ class AgentRunnerV2:
             return
         
         # Build final response
-        processing_time_ms = int((time.time() - start_time) * 1000)
+        full_response_text = "".join(response_parts)
+        processing_time_ms = (time.perf_counter_ns() - start_ns) // 1_000_000
         
         # Extract sources
         sources = self._extract_sources_from_results(tool_results, full_response_text)
         
-        # Determine providers consulted
-        providers = set()
-        for tool_name in tools_used:
-            for source, prefixes in SOURCE_TOOL_MAP.items():
-                if any(tool_name.startswith(p) for p in prefixes):
-                    providers.add(source)
+        # Determine providers consulted, reported in SOURCE_TOOL_MAP order
+        consulted = {_source_for_tool(tool_name) for tool_name in tools_used}
+        providers = [source for source in SOURCE_TOOL_MAP if source in consulted]
         
         final_response = ChatResponse(
             response=ResponseContent(text=full_response_text.strip()),
@@ -590,7 +962,7 @@ class AgentRunnerV2:
             related_queries=[],
             metadata=ChatResponseMetadata(
                 tools_used=tools_used,
-                providers_consulted=list(providers),
+                providers_consulted=providers,
                 processing_time_ms=processing_time_ms,
                 model=self.responder_model,
                 router_model=self.router_model,
@@ -22,6 +22,17 @@ class Settings(BaseSettings):
     azure_openai_deployment: str = "gpt-4o"  # deployment name in Azure (for responder)
     azure_openai_deployment_router: str = ""  # optional: router deployment name (defaults to deriving from main or using same)
     azure_openai_api_version: str = "2024-02-15-preview"
+    chat_router_enabled: bool = True  # Pick tools with the cheaper router model, synthesize with the main one
+    chat_max_tool_rounds: int = 1  # Router -> parallel tools rounds per message before synthesis
+    chat_batch_tool_enabled: bool = False  # Offer a synthetic "batch" tool so one call can run many lookups
+    chat_tool_round_timeout: float = 10.0  # Seconds to wait for a round's tools; slower ones are reported as timed out
+    chat_speculative_search: bool = False  # Start each source's search on the raw question while the router decides
+    chat_answer_cache_ttl: int = 0  # Seconds a finished answer is replayed for the same question (0 disables)
+    chat_warm_connections: bool = True  # Open connections to the chosen sources' APIs while the router decides
+    chat_router_batching: bool = False  # v2 runner: route questions arriving together in one router call
+    openai_max_concurrent: int = 32  # In-flight OpenAI requests per worker, shared by all chats
+    openai_max_retries: int = 2  # SDK retries (exponential backoff) on 429/5xx/connection errors
+    openai_timeout_seconds: float = 60.0  # Per-request read/write timeout (streams: between chunks); connect is 5s
 
     # Rate limiting
     rate_limit_enabled: bool = False
@@ -29,6 +40,9 @@ class Settings(BaseSettings):
     
     # Chat rate limiting (separate from MCP rate limiting)
     chat_rate_limit_per_hour: int = 50  # Messages per hour per IP
+    chat_max_concurrent: int = 10  # Chat sessions processed at once per worker
+    chat_sse_ping_seconds: int = 15  # Keepalive comment interval on chat streams
+    tool_max_concurrent_per_source: int = 4  # Parallel tool calls per provider API, shared by all chats
 
     # Logging
     log_level: str = "INFO"
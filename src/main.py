@@ -1,16 +1,18 @@
 """FastAPI MCP Server - Main application entrypoint."""
 
-import json
 import logging
 import time
 from collections import defaultdict
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 
+import orjson
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, ValidationError
 
+from src.agent.openai_client import close_openai_clients
 from src.config.loader import get_settings, load_api_config, get_enabled_providers
 from src.mcp.registry import get_registry
 from src.mcp.handlers import MCPHandlers
@@ -20,7 +22,8 @@ from src.mcp.transport_sse import (
     create_sse_response,
 )
 from src.security.auth import AuthMiddleware
-from src.utils.rate_limit import RateLimitMiddleware
+from src.utils.http import close_shared_client
+from src.utils.rate_limit import ConcurrencyLimiter, RateLimitMiddleware
 from src.utils.logging import setup_logging, set_request_id, get_logger
 
 logger = logging.getLogger(__name__)
@@ -55,6 +58,10 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
         else:
             log.warning("Failed to load provider", provider=provider)
     
+    # Pre-build OpenAI tool schemas for the chat agent
+    from src.agent.runner import warm_tool_schemas
+    warm_tool_schemas()
+    
     log.info(
         "Tool registry ready",
         tool_count=registry.tool_count,
@@ -70,6 +77,8 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     # Shutdown
     log.info("Shutting down MCP server")
     session_manager.stop_cleanup_task()
+    await close_openai_clients()
+    await close_shared_client()
 
 
 # Create FastAPI app
@@ -210,16 +219,16 @@ async def message_endpoint(request: Request) -> JSONResponse:
         # Notification - no response needed
         return JSONResponse(content={"status": "ok"}, status_code=202)
     
-    response_data = response.model_dump()
+    response_json = processor.serialize_response(response)
     
     # If there's a session, also push to SSE
     if session_id:
         session_manager = get_session_manager()
         session = session_manager.get_session(session_id)
         if session:
-            await session.send_event("message", json.dumps(response_data))
+            await session.send_event("message", response_json.decode())
     
-    return JSONResponse(content=response_data)
+    return Response(content=response_json, media_type="application/json")
 
 
 # =============================================================================
@@ -229,11 +238,14 @@ async def message_endpoint(request: Request) -> JSONResponse:
 # Simple in-memory rate limiter for chat (per IP)
 chat_rate_limits: dict[str, list[float]] = defaultdict(list)
 
+# Admission control: bounds concurrent chat sessions to protect OpenAI and tool backends
+chat_limiter = ConcurrencyLimiter(get_settings().chat_max_concurrent)
+
 
 def check_chat_rate_limit(client_ip: str) -> bool:
     """Check if client IP is within rate limit. Returns True if allowed."""
     settings = get_settings()
-    now = time.time()
+    now = time.monotonic()
     hour_ago = now - 3600
     
     # Clean old entries
@@ -291,20 +303,23 @@ async def chat_endpoint(request: Request) -> JSONResponse:
             }
         )
     
-    # Parse request body
-    try:
-        body = await request.json()
-    except Exception as e:
-        return JSONResponse(
-            status_code=400,
-            content={"error": f"Invalid JSON: {e}"}
-        )
-    
     # Import here to avoid circular imports
     from src.agent.runner import AgentRunner, ChatRequest
     
+    # Parse and validate the request body in a single pass
     try:
-        chat_request = ChatRequest(**body)
+        body = await request.body()
+        chat_request = ChatRequest.model_validate_json(body)
+    except ValidationError as e:
+        if any(err["type"] == "json_invalid" for err in e.errors()):
+            return JSONResponse(
+                status_code=400,
+                content={"error": f"Invalid JSON: {e}"}
+            )
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Invalid request: {e}"}
+        )
     except Exception as e:
         return JSONResponse(
             status_code=400,
@@ -317,7 +332,8 @@ async def chat_endpoint(request: Request) -> JSONResponse:
     
     try:
         runner = AgentRunner(settings.openai_api_key)
-        response = await runner.chat(chat_request)
+        async with chat_limiter:
+            response = await runner.chat(chat_request)
         
         log.info(
             "Chat response",
@@ -325,7 +341,7 @@ async def chat_endpoint(request: Request) -> JSONResponse:
             sources_consulted=response.metadata.providers_consulted,
         )
         
-        return JSONResponse(content=response.model_dump())
+        return Response(content=response.model_dump_json(), media_type="application/json")
         
     except Exception as e:
         log.error("Chat error", exc_info=True)
@@ -335,6 +351,30 @@ async def chat_endpoint(request: Request) -> JSONResponse:
         )
 
 
+# Chat events are framed directly to bytes instead of going through a model -> dict
+# -> ServerSentEvent hop. The frames are identical to what EventSourceResponse
+# produces for the dict form: compact JSON never contains a raw newline, so the
+# payload always fits on a single data line. The token event is by far the most
+# frequent (one per streamed batch) and skips pydantic entirely.
+_TOKEN_FRAME_PREFIX = b'event: token\r\ndata: {"type":"token","content":'
+_TOKEN_FRAME_SUFFIX = b"}\r\n\r\n"
+
+
+def encode_token_frame(content: str) -> bytes:
+    """Encode a token event as a complete SSE frame."""
+    return _TOKEN_FRAME_PREFIX + orjson.dumps(content) + _TOKEN_FRAME_SUFFIX
+
+
+def encode_event_frame(event: BaseModel) -> bytes:
+    """Encode any other chat SSE event (which has a ``type`` field) as a complete frame.
+    
+    Serializes straight to UTF-8 bytes (model_dump_json() would decode them to str
+    only for the frame to encode them again).
+    """
+    data = event.__pydantic_serializer__.to_json(event)
+    return b"event: %s\r\ndata: %s\r\n\r\n" % (event.type.encode(), data)
+
+
 @app.post("/api/chat/stream")
 async def chat_stream_endpoint(request: Request):
     """
@@ -352,7 +392,7 @@ async def chat_stream_endpoint(request: Request):
     - error: Error occurred
     """
     from sse_starlette.sse import EventSourceResponse
-    from src.agent.runner import AgentRunner, ChatRequest, ErrorEvent
+    from src.agent.runner import AgentRunner, ChatRequest, ErrorEvent, TokenEvent
     
     settings = get_settings()
     log = get_logger("chat_stream")
@@ -360,10 +400,7 @@ async def chat_stream_endpoint(request: Request):
     # Check if chat is enabled
     if not settings.chat_enabled:
         async def error_stream():
-            yield {
-                "event": "error",
-                "data": json.dumps({"type": "error", "message": "Chat service not configured"})
-            }
+            yield encode_event_frame(ErrorEvent(message="Chat service not configured"))
         return EventSourceResponse(error_stream())
     
     # Get client IP for rate limiting
@@ -372,25 +409,17 @@ async def chat_stream_endpoint(request: Request):
     # Check rate limit
     if not check_chat_rate_limit(client_ip):
         async def rate_limit_stream():
-            yield {
-                "event": "error",
-                "data": json.dumps({
-                    "type": "error",
-                    "message": f"Rate limit exceeded. Maximum {settings.chat_rate_limit_per_hour} messages per hour"
-                })
-            }
+            yield encode_event_frame(ErrorEvent(
+                message=f"Rate limit exceeded. Maximum {settings.chat_rate_limit_per_hour} messages per hour"
+            ))
         return EventSourceResponse(rate_limit_stream())
     
     # Parse request body
     try:
-        body = await request.json()
-        chat_request = ChatRequest(**body)
+        chat_request = ChatRequest.model_validate_json(await request.body())
     except Exception as e:
         async def parse_error_stream():
-            yield {
-                "event": "error",
-                "data": json.dumps({"type": "error", "message": f"Invalid request: {e}"})
-            }
+            yield encode_event_frame(ErrorEvent(message=f"Invalid request: {e}"))
         return EventSourceResponse(parse_error_stream())
     
     log.info("Chat stream request", message_length=len(chat_request.message), sources=chat_request.sources)
@@ -399,21 +428,18 @@ async def chat_stream_endpoint(request: Request):
         try:
             runner = AgentRunner(settings.openai_api_key)
             
-            async for event in runner.chat_stream(chat_request):
-                event_data = event.model_dump()
-                yield {
-                    "event": event.type,
-                    "data": json.dumps(event_data, ensure_ascii=False)
-                }
+            async with chat_limiter:
+                async for event in runner.chat_stream(chat_request):
+                    if isinstance(event, TokenEvent):
+                        yield encode_token_frame(event.content)
+                    else:
+                        yield encode_event_frame(event)
                 
         except Exception as e:
             log.error("Chat stream error", exc_info=True)
-            yield {
-                "event": "error",
-                "data": json.dumps({"type": "error", "message": str(e)})
-            }
+            yield encode_event_frame(ErrorEvent(message=str(e)))
     
-    return EventSourceResponse(event_generator())
+    return EventSourceResponse(event_generator(), ping=settings.chat_sse_ping_seconds)
 
 
 @app.get("/api/chat/status")
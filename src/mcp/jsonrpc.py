@@ -1,9 +1,9 @@
 """JSON-RPC 2.0 message processing."""
 
-import json
 import logging
 from typing import Any
 
+import orjson
 from pydantic import ValidationError
 
 from src.mcp.models import JsonRpcRequest, JsonRpcResponse, JsonRpcError
@@ -27,10 +27,8 @@ class JsonRpcProcessor:
         """
         # Try to parse JSON
         try:
-            if isinstance(raw_data, bytes):
-                raw_data = raw_data.decode("utf-8")
-            data = json.loads(raw_data)
-        except json.JSONDecodeError as e:
+            data = orjson.loads(raw_data)
+        except orjson.JSONDecodeError as e:
             return None, make_error_data(PARSE_ERROR, f"Invalid JSON: {e}")
 
         # Validate JSON-RPC structure
@@ -88,7 +86,11 @@ class JsonRpcProcessor:
 
         return await self.process_request(request)  # type: ignore
 
-    def serialize_response(self, response: JsonRpcResponse) -> str:
-        """Serialize a JSON-RPC response to JSON string."""
-        return json.dumps(response.model_dump())
+    def serialize_response(self, response: JsonRpcResponse) -> bytes:
+        """Serialize a JSON-RPC response to compact UTF-8 JSON.
+        
+        tools/call results carry whole provider payloads, so this uses orjson and
+        is done once per response, shared by the HTTP body and the SSE push.
+        """
+        return orjson.dumps(response.model_dump(), option=orjson.OPT_NON_STR_KEYS)
 
@@ -1,7 +1,10 @@
 """Tool registry for managing MCP tools."""
 
+import asyncio
 import importlib
+import inspect
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Callable, Awaitable
 from pathlib import Path
 
@@ -9,8 +12,11 @@ from src.mcp.models import Tool, TextContent, ToolCallResult
 
 logger = logging.getLogger(__name__)
 
-# Type alias for tool handlers
-ToolHandler = Callable[[dict[str, Any]], Awaitable[list[TextContent]]]
+# Type alias for tool handlers (async; plain sync handlers are also accepted)
+ToolHandler = Callable[[dict[str, Any]], Awaitable[list[TextContent]] | list[TextContent]]
+
+# Bounded pool for synchronous (blocking) tool handlers so they never stall the event loop
+_TOOL_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix="mcp-tool")
 
 
 class ToolDefinition:
@@ -27,6 +33,26 @@ class ToolDefinition:
         self.description = description
         self.input_schema = input_schema
         self.handler = handler
+        self.is_async = inspect.iscoroutinefunction(handler)
+        # OpenAI function-tool definition, built once and shared by every tool list
+        self.openai_definition: dict[str, Any] = {
+            "type": "function",
+            "function": {
+                "name": name,
+                "description": description,
+                "parameters": input_schema,
+            },
+        }
+
+    async def run(self, arguments: dict[str, Any]) -> list[TextContent]:
+        """Run the handler. Synchronous handlers are offloaded to the tool thread pool."""
+        if self.is_async:
+            return await self.handler(arguments)
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(_TOOL_POOL, self.handler, arguments)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
 
     def to_mcp_tool(self) -> Tool:
         """Convert to MCP Tool model for protocol responses."""
@@ -43,6 +69,8 @@ class ToolRegistry:
     def __init__(self) -> None:
         self._tools: dict[str, ToolDefinition] = {}
         self._providers: set[str] = set()
+        self._openai_tools: dict[tuple[str, ...], list[dict[str, Any]]] = {}
+        self._mcp_tools: list[Tool] | None = None
 
     def register(
         self,
@@ -60,6 +88,8 @@ class ToolRegistry:
             input_schema=input_schema,
             handler=handler,
         )
+        self._openai_tools.clear()
+        self._mcp_tools = None
         logger.info(f"Registered tool: {name}")
 
     def get(self, name: str) -> ToolDefinition | None:
@@ -67,8 +97,30 @@ class ToolRegistry:
         return self._tools.get(name)
 
     def list_tools(self) -> list[Tool]:
-        """List all registered tools as MCP Tool models."""
-        return [tool.to_mcp_tool() for tool in self._tools.values()]
+        """List all registered tools as MCP Tool models.
+        
+        Built once and cached until the next registration, so tools/list requests
+        don't rebuild a model per tool. The returned list must not be mutated.
+        """
+        if self._mcp_tools is None:
+            self._mcp_tools = [tool.to_mcp_tool() for tool in self._tools.values()]
+        return self._mcp_tools
+
+    def openai_tools(self, prefixes: tuple[str, ...]) -> list[dict[str, Any]]:
+        """Get OpenAI function-tool definitions for tools matching any of the prefixes.
+        
+        Built once per prefix tuple and cached until the next registration.
+        The returned list is shared between callers and must not be mutated.
+        """
+        tools = self._openai_tools.get(prefixes)
+        if tools is None:
+            tools = [
+                tool.openai_definition
+                for tool in self._tools.values()
+                if tool.name.startswith(prefixes)
+            ]
+            self._openai_tools[prefixes] = tools
+        return tools
 
     async def call_tool(self, name: str, arguments: dict[str, Any]) -> ToolCallResult:
         """Call a tool by name with the given arguments."""
@@ -80,7 +132,7 @@ class ToolRegistry:
             )
 
         try:
-            content = await tool.handler(arguments)
+            content = await tool.run(arguments)
             return ToolCallResult(content=content, isError=False)
         except Exception as e:
             logger.exception(f"Error executing tool {name}")
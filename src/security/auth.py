@@ -48,8 +48,9 @@ def extract_bearer_token(authorization: str | None) -> str | None:
 class AuthMiddleware(BaseHTTPMiddleware):
     """Middleware to enforce authentication on protected endpoints."""
     
-    # Paths that require authentication (when enabled)
-    PROTECTED_PATHS = ["/sse", "/message", "/api/chat", "/api/chat/stream"]
+    # Paths that require authentication (when enabled); a tuple so every request is
+    # checked with one str.startswith() call
+    PROTECTED_PATHS = ("/sse", "/message", "/api/chat", "/api/chat/stream")
     
     # Paths that are always public (no auth required)
     PUBLIC_PATHS = [
@@ -67,8 +68,8 @@ class AuthMiddleware(BaseHTTPMiddleware):
         
         path = request.url.path
         logger.debug(
-            f"Auth check: path={path}, auth_enabled={settings.auth_enabled}, "
-            f"token_set={bool(settings.mcp_auth_token)}"
+            "Auth check: path=%s, auth_enabled=%s, token_set=%s",
+            path, settings.auth_enabled, bool(settings.mcp_auth_token),
         )
         
         # Skip auth if not enabled
@@ -77,7 +78,7 @@ class AuthMiddleware(BaseHTTPMiddleware):
             return await call_next(request)
         
         # Check protected paths FIRST (before public paths check)
-        if any(path.startswith(p) for p in self.PROTECTED_PATHS):
+        if path.startswith(self.PROTECTED_PATHS):
             auth_header = request.headers.get("Authorization")
             token = extract_bearer_token(auth_header)
             
@@ -1,9 +1,10 @@
 """Riksantikvaren ArcGIS REST API client."""
 
-import json
 import logging
 from typing import Any
 
+import orjson
+
 from src.utils.http import fetch_json
 
 logger = logging.getLogger(__name__)
@@ -106,7 +107,7 @@ class RiksantikvarenArcGISClient:
         }
 
         if geometry:
-            params["geometry"] = json.dumps(geometry)
+            params["geometry"] = orjson.dumps(geometry).decode()
             params["geometryType"] = geometry_type
             params["spatialRel"] = spatial_rel
             params["inSR"] = "4326"
@@ -150,7 +151,7 @@ class RiksantikvarenArcGISClient:
         
         params = {
             "where": "1=1",
-            "geometry": json.dumps(geometry),
+            "geometry": orjson.dumps(geometry).decode(),
             "geometryType": "esriGeometryPoint",
             "spatialRel": "esriSpatialRelIntersects",
             "distance": distance,
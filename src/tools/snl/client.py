@@ -3,7 +3,7 @@
 import logging
 from typing import Any
 
-from src.utils.http import create_http_client
+from src.utils.http import get_shared_client
 
 logger = logging.getLogger(__name__)
 
@@ -33,12 +33,12 @@ class SNLClient:
             "offset": offset,
         }
 
-        async with create_http_client(timeout=30) as client:
-            response = await client.get(
-                f"{self.BASE_URL}/api/v1/search", params=params
-            )
-            response.raise_for_status()
-            return response.json()
+        client = await get_shared_client()
+        response = await client.get(
+            f"{self.BASE_URL}/api/v1/search", params=params
+        )
+        response.raise_for_status()
+        return response.json()
 
     async def get_article(self, identifier: str) -> dict[str, Any]:
         """
@@ -59,10 +59,10 @@ class SNLClient:
             slug = identifier.lstrip("/")
             url = f"{self.BASE_URL}/{slug}.json"
 
-        async with create_http_client(timeout=30) as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            return response.json()
+        client = await get_shared_client()
+        response = await client.get(url)
+        response.raise_for_status()
+        return response.json()
 
 
 # Singleton client
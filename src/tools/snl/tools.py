@@ -1,6 +1,7 @@
 """SNL provider tools."""
 
 import logging
+import re
 from typing import Any
 
 from src.mcp.models import TextContent
@@ -9,6 +10,8 @@ from src.tools.snl.client import get_client
 
 logger = logging.getLogger(__name__)
 
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+
 
 async def search_handler(arguments: dict[str, Any]) -> list[TextContent]:
     """Handle snl-search tool call."""
@@ -67,8 +70,7 @@ async def article_handler(arguments: dict[str, Any]) -> list[TextContent]:
         # Clean HTML from body if it's HTML
         if "<" in body:
             # Simple HTML cleanup - remove common tags
-            import re
-            body = re.sub(r'<[^>]+>', '', body)
+            body = _HTML_TAG_RE.sub('', body)
             body = body.replace('&nbsp;', ' ').replace('&amp;', '&')
         
         # Truncate if very long
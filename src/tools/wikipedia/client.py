@@ -5,7 +5,7 @@ from typing import Any
 
 import httpx
 
-from src.utils.http import create_http_client
+from src.utils.http import get_shared_client
 
 logger = logging.getLogger(__name__)
 
@@ -40,10 +40,10 @@ class WikipediaClient:
             "format": "json",
         }
 
-        async with create_http_client(timeout=30) as client:
-            response = await client.get(self.base_url, params=params)
-            response.raise_for_status()
-            data = response.json()
+        client = await get_shared_client()
+        response = await client.get(self.base_url, params=params)
+        response.raise_for_status()
+        data = response.json()
 
         if "error" in data:
             raise Exception(f"Wikipedia API error: {data['error'].get('info', 'Unknown error')}")
@@ -77,10 +77,10 @@ class WikipediaClient:
         if sentences:
             params["exsentences"] = sentences
 
-        async with create_http_client(timeout=30) as client:
-            response = await client.get(self.base_url, params=params)
-            response.raise_for_status()
-            data = response.json()
+        client = await get_shared_client()
+        response = await client.get(self.base_url, params=params)
+        response.raise_for_status()
+        data = response.json()
 
         if "error" in data:
             raise Exception(f"Wikipedia API error: {data['error'].get('info', 'Unknown error')}")
@@ -118,10 +118,10 @@ class WikipediaClient:
             "format": "json",
         }
 
-        async with create_http_client(timeout=30) as client:
-            response = await client.get(self.base_url, params=params)
-            response.raise_for_status()
-            data = response.json()
+        client = await get_shared_client()
+        response = await client.get(self.base_url, params=params)
+        response.raise_for_status()
+        data = response.json()
 
         if "error" in data:
             raise Exception(f"Wikipedia API error: {data['error'].get('info', 'Unknown error')}")
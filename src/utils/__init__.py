@@ -2,12 +2,13 @@
 
 from src.utils.logging import setup_logging, get_logger
 from src.utils.http import create_http_client
-from src.utils.rate_limit import RateLimiter, RateLimitMiddleware
+from src.utils.rate_limit import ConcurrencyLimiter, RateLimiter, RateLimitMiddleware
 
 __all__ = [
     "setup_logging",
     "get_logger",
     "create_http_client",
+    "ConcurrencyLimiter",
     "RateLimiter",
     "RateLimitMiddleware",
 ]
@@ -3,7 +3,7 @@
 import asyncio
 import logging
 import time
-from typing import Any
+from typing import Any, Iterable
 
 import httpx
 from tenacity import (
@@ -66,6 +66,36 @@ async def close_shared_client() -> None:
         logger.debug("Closed shared HTTP client")
 
 
+# Origins warmed recently enough that their pooled connection should still be open
+# (the shared client keeps idle connections for 30 seconds)
+WARMUP_INTERVAL = 30.0  # seconds
+_warmed_at: dict[str, float] = {}
+
+
+async def warm_connections(origins: Iterable[str]) -> None:
+    """Open pooled connections to origins ahead of the first real request.
+    
+    Sends a HEAD to each origin not warmed in the last WARMUP_INTERVAL, so the
+    TCP and TLS handshakes happen while the caller waits on something else.
+    Failures are only logged; the real request connects (and reports) on its own.
+    """
+    now = time.monotonic()
+    origins = [
+        origin for origin in dict.fromkeys(origins)
+        if origin not in _warmed_at or now - _warmed_at[origin] >= WARMUP_INTERVAL
+    ]
+    if not origins:
+        return
+    for origin in origins:
+        _warmed_at[origin] = now
+    
+    client = await get_shared_client()
+    results = await asyncio.gather(*(client.head(origin) for origin in origins), return_exceptions=True)
+    for origin, result in zip(origins, results):
+        if isinstance(result, Exception):
+            logger.debug("Connection warmup to %s failed: %s", origin, result)
+
+
 def create_http_client(
     timeout: float | None = None,
     base_url: str | None = None,
@@ -106,17 +136,21 @@ def create_http_client(
 class SimpleCache:
     """Simple TTL cache for API responses."""
     
-    def __init__(self, default_ttl: int = 300):
-        """Initialize cache with default TTL in seconds."""
+    def __init__(self, default_ttl: int = 300, max_entries: int | None = None):
+        """Initialize cache with default TTL in seconds.
+        
+        If max_entries is set, the oldest entry is evicted when the cache is full.
+        """
         self._cache: dict[str, tuple[Any, float]] = {}
         self._default_ttl = default_ttl
+        self._max_entries = max_entries
     
     def get(self, key: str) -> Any | None:
         """Get value from cache if not expired."""
         if key in self._cache:
             value, expires_at = self._cache[key]
-            if time.time() < expires_at:
-                logger.debug(f"Cache hit: {key}")
+            if time.monotonic() < expires_at:
+                logger.debug("Cache hit: %s", key)
                 return value
             else:
                 # Expired, remove it
@@ -126,8 +160,11 @@ class SimpleCache:
     def set(self, key: str, value: Any, ttl: int | None = None) -> None:
         """Set value in cache with TTL."""
         ttl = ttl or self._default_ttl
-        self._cache[key] = (value, time.time() + ttl)
-        logger.debug(f"Cache set: {key} (TTL: {ttl}s)")
+        if self._max_entries and key not in self._cache and len(self._cache) >= self._max_entries:
+            # Dicts keep insertion order, so the first key is the oldest entry
+            del self._cache[next(iter(self._cache))]
+        self._cache[key] = (value, time.monotonic() + ttl)
+        logger.debug("Cache set: %s (TTL: %ss)", key, ttl)
     
     def clear(self) -> None:
         """Clear all cached values."""
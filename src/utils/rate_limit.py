@@ -1,6 +1,8 @@
 """Rate limiting middleware and utilities."""
 
+import asyncio
 import logging
+import threading
 import time
 from collections import defaultdict
 from typing import Callable
@@ -32,7 +34,7 @@ class RateLimiter:
         Returns:
             Tuple of (is_allowed, remaining_requests).
         """
-        now = time.time()
+        now = time.monotonic()
         window_start = now - self.window_size
         
         # Clean old requests
@@ -59,6 +61,100 @@ class RateLimiter:
             self._requests.pop(key, None)
 
 
+class ConcurrencyLimiter:
+    """Admission control bounding how many tasks run at once.
+    
+    Uses an asyncio.Condition guarding an explicit counter instead of a Semaphore,
+    so the number of admitted tasks can be read directly (active).
+    """
+    
+    def __init__(self, max_concurrent: int):
+        self.max_concurrent = max_concurrent
+        self._active = 0
+        self._cond = asyncio.Condition()
+    
+    @property
+    def active(self) -> int:
+        """Number of currently admitted tasks."""
+        return self._active
+    
+    async def acquire(self) -> None:
+        """Wait until a slot is free, then take it."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._active < self.max_concurrent)
+            self._active += 1
+    
+    async def release(self) -> None:
+        """Give back a slot and wake one waiter."""
+        async with self._cond:
+            self._active -= 1
+            self._cond.notify(1)
+    
+    async def __aenter__(self) -> "ConcurrencyLimiter":
+        await self.acquire()
+        return self
+    
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.release()
+
+
+# One limiter per tool provider, shared by every chat (and both agent runners) in
+# the worker, so parallel tool calls can't flood one upstream API (e.g. five
+# wikipedia-* calls at once) and get the whole worker throttled
+_source_limiters: dict[str, ConcurrencyLimiter] = {}
+
+
+def get_source_limiter(source: str) -> ConcurrencyLimiter:
+    """Get the limiter bounding concurrent tool calls to one provider."""
+    limiter = _source_limiters.get(source)
+    if limiter is None:
+        limiter = ConcurrencyLimiter(get_settings().tool_max_concurrent_per_source)
+        _source_limiters[source] = limiter
+    return limiter
+
+
+class CircuitBreaker:
+    """Cooldown switch for a dependency that reported overload (e.g. HTTP 429).
+    
+    Each trip opens the breaker for the current cooldown and doubles the next one,
+    up to cooldown_max, until a success resets it. Deadlines use time.monotonic(),
+    so wall-clock adjustments can't shorten or stretch a cooldown, and state changes
+    hold a lock so the breaker can be shared across worker threads.
+    """
+    
+    def __init__(self, cooldown_base: float = 30.0, cooldown_max: float = 600.0):
+        self.cooldown_base = cooldown_base
+        self.cooldown_max = cooldown_max
+        self._cooldown = cooldown_base
+        self._open_until = 0.0
+        self._tripped = False
+        self._lock = threading.Lock()
+    
+    def is_open(self) -> bool:
+        """Whether calls should currently avoid the dependency."""
+        return time.monotonic() < self._open_until
+    
+    def trip(self) -> float:
+        """Open the breaker; returns the cooldown in seconds."""
+        with self._lock:
+            cooldown = self._cooldown
+            self._open_until = time.monotonic() + cooldown
+            self._cooldown = min(cooldown * 2, self.cooldown_max)
+            self._tripped = True
+            return cooldown
+    
+    def reset(self) -> bool:
+        """Close the breaker after a success; returns whether it had been tripped."""
+        if not self._tripped:
+            return False
+        with self._lock:
+            was_tripped = self._tripped
+            self._open_until = 0.0
+            self._cooldown = self.cooldown_base
+            self._tripped = False
+            return was_tripped
+
+
 class RateLimitMiddleware(BaseHTTPMiddleware):
     """Middleware to enforce rate limiting."""
     
@@ -0,0 +1,1870 @@
+"""Tests for agent runner helpers."""
+
+import asyncio
+import functools
+import json
+import threading
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+from sse_starlette.event import ServerSentEvent
+
+from src.agent.openai_client import (
+    get_openai_client,
+    is_rate_limit_error,
+    prompt_cache_options,
+)
+import src.agent.openai_client as openai_client_module
+import src.agent.runner as runner_module
+import src.agent.runner_v2 as runner_v2_module
+import src.utils.rate_limit as rate_limit_module
+from src.agent.runner import (
+    BATCH_TOOL_NAME,
+    HISTORY_OLD_MESSAGE_CHARS,
+    POSTPROCESS_THREAD_CHARS,
+    ROUTER_MAX_TOKENS,
+    AgentRunner,
+    ChatRequest,
+    ChatResponse,
+    ChatResponseMetadata,
+    DoneEvent,
+    ErrorEvent,
+    Location,
+    ResponseContent,
+    SourceReference,
+    StatusEvent,
+    TokenEvent,
+    ToolEndEvent,
+    ToolStartEvent,
+    _SIGNIFICANT_WORD_RE,
+    _TOKEN_RE,
+    _answer_cache_key,
+    _coalesce_tokens,
+    _compact_history,
+    _completion_cache_key,
+    _prefixes_for_sources,
+    _source_for_tool,
+    answer_cache,
+    completion_cache,
+    tool_result_cache,
+)
+from src.agent.runner_v2 import AgentRunnerV2
+from src.agent.runner_v2 import ChatRequest as V2ChatRequest
+from src.agent.runner_v2 import TokenEvent as V2TokenEvent
+from src.agent.runner_v2 import (
+    MAX_CONTEXT_TOKENS,
+    NO_RESULTS_RESPONSE,
+    RouterBatcher,
+    _RESPONDER_SYSTEM_MSG,
+    _compress_context,
+    _count_tokens,
+    _stream_tool_calls,
+    _truncate_tokens,
+)
+from src.config.loader import get_settings
+from src.main import encode_event_frame, encode_token_frame
+from src.mcp.models import TextContent
+from src.mcp.registry import ToolRegistry
+
+
+@pytest.fixture(autouse=True)
+def _clear_completion_cache(monkeypatch):
+    """Start every test without cached routing responses or answers, and offline."""
+    completion_cache.clear()
+    answer_cache.clear()
+    monkeypatch.setattr(get_settings(), "chat_warm_connections", False)
+
+
+def _chunk(content):
+    """Build a minimal streamed completion chunk."""
+    delta = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+async def _fake_stream(contents, pause_after=None, pause=0.0):
+    """Yield chunks, optionally pausing after a given index."""
+    for i, content in enumerate(contents):
+        yield _chunk(content)
+        if i == pause_after:
+            await asyncio.sleep(pause)
+
+
+class _FakeStream:
+    """Endless streamed completion that records whether it was closed."""
+
+    def __init__(self):
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        self.closed = True
+
+    async def __aiter__(self):
+        while not self.closed:
+            yield _chunk("tekst ")
+            await asyncio.sleep(0)
+
+
+class _FakeToolCallStream:
+    """Streamed routing completion: each tool call's name, then its arguments in two parts."""
+
+    def __init__(self, tool_calls):
+        self.tool_calls = tool_calls or []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def __aiter__(self):
+        for index, call in enumerate(self.tool_calls):
+            arguments = call.function.arguments
+            half = len(arguments) // 2
+            for name, part in ((call.function.name, ""), (None, arguments[:half]), (None, arguments[half:])):
+                delta = SimpleNamespace(index=index, id=call.id, function=SimpleNamespace(name=name, arguments=part))
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None, tool_calls=[delta]))])
+                await asyncio.sleep(0)
+
+
+class _FakeCompletions:
+    """Stand-in for client.chat.completions; requests the given tool calls once."""
+
+    def __init__(self, tool_calls=None):
+        self.stream = _FakeStream()
+        self.tool_calls = tool_calls
+        self.requests = []
+
+    async def create(self, **kwargs):
+        self.requests.append({**kwargs, "messages": list(kwargs["messages"])})
+        if kwargs.get("stream") and kwargs.get("tools"):
+            stream = _FakeToolCallStream(self.tool_calls)
+            self.tool_calls = None
+            return stream
+        if kwargs.get("stream"):
+            return self.stream
+        message = SimpleNamespace(content=None, tool_calls=self.tool_calls)
+        self.tool_calls = None
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def _tool_call(call_id, name, arguments="{}"):
+    """Build a minimal tool call as returned by the OpenAI SDK."""
+    return SimpleNamespace(id=call_id, function=SimpleNamespace(name=name, arguments=arguments))
+
+
+class TestChatRequest:
+    """Tests for chat request parsing."""
+
+    def test_history_not_copied(self):
+        """Test that conversation history is passed through without re-validation."""
+        history = [{"role": "user", "content": "Hei"}, {"role": "assistant", "content": "Hallo"}]
+        request = ChatRequest.model_validate({"message": "Hva er Nidarosdomen?", "conversation_history": history})
+        assert request.conversation_history is history
+
+    def test_history_from_json(self):
+        """Test that history is decoded from a JSON body."""
+        body = '{"message": "Hei", "conversation_history": [{"role": "user", "content": "x"}]}'
+        request = ChatRequest.model_validate_json(body)
+        assert request.conversation_history == [{"role": "user", "content": "x"}]
+        assert ChatRequest(message="Hei").conversation_history == []
+
+
+class TestCompactHistory:
+    """Tests for trimming conversation history before it is re-sent."""
+
+    def test_recent_messages_passed_through(self):
+        """Test that short plain histories are sent unchanged."""
+        history = [{"role": "user", "content": "Hei"}, {"role": "assistant", "content": "Hallo"}]
+        compacted = _compact_history(history)
+        assert compacted == history
+        assert compacted[0] is history[0]
+
+    def test_tool_messages_dropped(self):
+        """Test that earlier tool results and the calls that requested them are dropped."""
+        history = [
+            {"role": "user", "content": "Hva er Bryggen?"},
+            {"role": "assistant", "content": None, "tool_calls": [{"id": "call-1"}]},
+            {"role": "tool", "tool_call_id": "call-1", "content": "x" * 10_000},
+            {"role": "assistant", "content": "Bryggen er...", "tool_calls": [{"id": "call-2"}]},
+        ]
+        assert _compact_history(history) == [
+            {"role": "user", "content": "Hva er Bryggen?"},
+            {"role": "assistant", "content": "Bryggen er..."},
+        ]
+
+    def test_old_messages_truncated(self):
+        """Test that only messages before the last HISTORY_KEEP_LAST are cut down."""
+        history = [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": str(i) * 1000, "name": "x"}
+            for i in range(8)
+        ]
+        compacted = _compact_history(history)
+        assert compacted[0] == {"role": "user", "content": "0" * HISTORY_OLD_MESSAGE_CHARS}
+        assert compacted[1] == {"role": "assistant", "content": "1" * HISTORY_OLD_MESSAGE_CHARS}
+        assert compacted[2:] == history[2:]
+
+
+class TestConstructedResponse:
+    """Tests for the unvalidated final response."""
+
+    def test_serializes_like_validated_response(self):
+        """Test that model_construct() output matches the validated model on the wire."""
+        fields = {
+            "sources": [SourceReference(title="Nidarosdomen", url="https://snl.no/Nidarosdomen", provider="snl")],
+            "locations": [],
+            "related_queries": ["Hvem bygget Nidarosdomen?"],
+        }
+        validated = DoneEvent(response=ChatResponse(
+            response=ResponseContent(text="Svar.", summary=None),
+            metadata=ChatResponseMetadata(tools_used=["snl-search"], providers_consulted=["snl"], model="gpt-4o"),
+            **fields,
+        ))
+        constructed = DoneEvent.model_construct(response=ChatResponse.model_construct(
+            response=ResponseContent.model_construct(text="Svar.", summary=None),
+            metadata=ChatResponseMetadata.model_construct(
+                tools_used=["snl-search"], providers_consulted=["snl"], processing_time_ms=0, model="gpt-4o"
+            ),
+            **fields,
+        ))
+        assert constructed.model_dump_json() == validated.model_dump_json()
+
+
+class TestChatStream:
+    """Tests for the streaming chat loop."""
+
+    @pytest.mark.asyncio
+    async def test_stream_closed_on_disconnect(self):
+        """Test that the OpenAI stream is closed when the consumer stops early."""
+        runner = AgentRunner("test-key")
+        completions = _FakeCompletions()
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        events = runner.chat_stream(ChatRequest(message="Hei", sources=[]))
+        async for event in events:
+            if isinstance(event, TokenEvent):
+                break
+        await events.aclose()
+        assert completions.stream.closed
+
+
+    @pytest.mark.asyncio
+    async def test_tokens_reach_client_before_generation_ends(self):
+        """Test that the first tokens are yielded while the model is still generating."""
+        runner = AgentRunner("test-key")
+        completions = _FakeCompletions()
+        first_token_seen = asyncio.Event()
+
+        class _GatedStream(_FakeStream):
+            async def __aiter__(self):
+                yield _chunk("Nidarosdomen\n\n")
+                await first_token_seen.wait()
+                yield _chunk("er en katedral.")
+
+        completions.stream = _GatedStream()
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        tokens = []
+        async def consume():
+            async for event in runner.chat_stream(ChatRequest(message="Hei", sources=[])):
+                if isinstance(event, TokenEvent):
+                    tokens.append(event.content)
+                    first_token_seen.set()
+
+        await asyncio.wait_for(consume(), timeout=1.0)
+        assert tokens == ["Nidarosdomen\n\n", "er en katedral."]
+
+    @pytest.mark.asyncio
+    async def test_single_tool_round_goes_straight_to_synthesis(self):
+        """Test that after the last allowed tool round the router is not asked again."""
+        runner = AgentRunner("test-key")
+        assert runner.max_tool_iterations == 1
+        runner.registry = ToolRegistry()
+        tool_result_cache.clear()
+
+        async def handler(args):
+            return [TextContent(text="ok")]
+
+        runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=handler)
+        completions = _FakeCompletions([_tool_call("call-1", "snl-search")])
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        events = runner.chat_stream(ChatRequest(message="Hei", sources=["snl"]))
+        async for event in events:
+            if isinstance(event, TokenEvent):
+                break
+        await events.aclose()
+
+        assert [bool(r.get("stream")) for r in completions.requests] == [False, True]
+        assert completions.requests[1]["model"] == runner.model
+        assert completions.requests[0]["max_tokens"] == ROUTER_MAX_TOKENS
+        assert completions.requests[1]["max_tokens"] == 2048
+
+
+    @pytest.mark.asyncio
+    async def test_tool_end_in_completion_order(self):
+        """Test that fast tools are reported first while tool messages keep call order."""
+        runner = AgentRunner("test-key")
+        runner.registry = ToolRegistry()
+        tool_result_cache.clear()
+        for name, delay in (("snl-slow", 0.05), ("snl-fast", 0.0)):
+            async def handler(args, name=name, delay=delay):
+                await asyncio.sleep(delay)
+                return [TextContent(text=f"{name} result")]
+
+            runner.registry.register(name=name, description="", input_schema={"type": "object"}, handler=handler)
+        completions = _FakeCompletions([_tool_call("call-1", "snl-slow"), _tool_call("call-2", "snl-fast")])
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        ended = []
+        events = runner.chat_stream(ChatRequest(message="Hei", sources=["snl"]))
+        async for event in events:
+            if isinstance(event, ToolEndEvent):
+                ended.append(event.tool)
+            elif isinstance(event, TokenEvent):
+                break
+        await events.aclose()
+
+        assert ended == ["snl-fast", "snl-slow"]
+        tool_messages = [m for m in completions.requests[1]["messages"] if m["role"] == "tool"]
+        assert [m["tool_call_id"] for m in tool_messages] == ["call-1", "call-2"]
+
+    @pytest.mark.asyncio
+    async def test_slow_tool_reported_as_timeout(self):
+        """Test that a tool still running at the round deadline doesn't hold back the answer."""
+        runner = AgentRunner("test-key")
+        runner.tool_round_timeout = 0.05
+        runner.registry = ToolRegistry()
+        tool_result_cache.clear()
+
+        async def slow(args):
+            await asyncio.sleep(10)
+            return [TextContent(text="too late")]
+
+        async def fast(args):
+            return [TextContent(text="ok")]
+
+        runner.registry.register(name="arcgis-slow", description="", input_schema={"type": "object"}, handler=slow)
+        runner.registry.register(name="snl-fast", description="", input_schema={"type": "object"}, handler=fast)
+        completions = _FakeCompletions([_tool_call("call-1", "arcgis-slow"), _tool_call("call-2", "snl-fast")])
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        ended = []
+        events = runner.chat_stream(ChatRequest(message="Hei", sources=["snl", "riksantikvaren"]))
+        async for event in events:
+            if isinstance(event, ToolEndEvent):
+                ended.append((event.tool, event.success))
+            elif isinstance(event, TokenEvent):
+                break
+        await events.aclose()
+
+        assert ended == [("snl-fast", True), ("arcgis-slow", False)]
+        tool_messages = [m for m in completions.requests[1]["messages"] if m["role"] == "tool"]
+        assert [m["tool_call_id"] for m in tool_messages] == ["call-1", "call-2"]
+        assert json.loads(tool_messages[0]["content"])["status"] == "timeout"
+        assert tool_messages[1]["content"] == "ok"
+        for task in list(runner_module._inflight_tool_calls.values()):
+            task.cancel()
+
+    @pytest.mark.asyncio
+    async def test_failing_tool_does_not_abort_siblings(self):
+        """Test that a tool raising an exception becomes an error payload for its call only."""
+        runner = AgentRunner("test-key")
+        runner.registry = ToolRegistry()
+        tool_result_cache.clear()
+
+        async def broken(args):
+            raise RuntimeError("upstream down")
+
+        async def working(args):
+            await asyncio.sleep(0.01)
+            return [TextContent(text="ok")]
+
+        runner.registry.register(name="snl-broken", description="", input_schema={"type": "object"}, handler=broken)
+        runner.registry.register(name="snl-working", description="", input_schema={"type": "object"}, handler=working)
+        completions = _FakeCompletions([_tool_call("call-1", "snl-broken"), _tool_call("call-2", "snl-working")])
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        events = runner.chat_stream(ChatRequest(message="Hei", sources=["snl"]))
+        async for event in events:
+            if isinstance(event, TokenEvent):
+                break
+        await events.aclose()
+
+        tool_messages = [m for m in completions.requests[1]["messages"] if m["role"] == "tool"]
+        assert [m["tool_call_id"] for m in tool_messages] == ["call-1", "call-2"]
+        assert "upstream down" in json.loads(tool_messages[0]["content"])["error"]
+        assert tool_messages[1]["content"] == "ok"
+
+    @pytest.mark.asyncio
+    async def test_providers_consulted(self):
+        """Test that the final response lists each consulted source once, in source order."""
+        runner = AgentRunner("test-key")
+        runner.registry = ToolRegistry()
+        tool_result_cache.clear()
+
+        async def handler(args):
+            return [TextContent(text="ok")]
+
+        names = ("snl-search", "snl-article", "arcgis-nearby", "example-ping")
+        for name in names:
+            runner.registry.register(name=name, description="", input_schema={"type": "object"}, handler=handler)
+        completions = _FakeCompletions([_tool_call(f"call-{i}", name) for i, name in enumerate(names)])
+
+        class _ShortStream(_FakeStream):
+            async def __aiter__(self):
+                yield _chunk("Svar.")
+
+        completions.stream = _ShortStream()
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        response = await runner.chat(ChatRequest(message="Hei", sources=["snl", "riksantikvaren"]))
+        assert response.metadata.providers_consulted == ["snl", "riksantikvaren"]
+        assert response.metadata.tools_used == list(names)
+
+    @pytest.mark.asyncio
+    async def test_connections_warmed_while_routing(self, monkeypatch):
+        """Test that a chat starts warming the selected sources' API hosts in the background."""
+        monkeypatch.setattr(get_settings(), "chat_warm_connections", True)
+        warmed = []
+
+        async def warm_connections(origins):
+            warmed.extend(origins)
+
+        monkeypatch.setattr(runner_module, "warm_connections", warm_connections)
+        runner = AgentRunner("test-key")
+        runner.registry = ToolRegistry()
+
+        async def handler(args):
+            return [TextContent(text="ok")]
+
+        runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=handler)
+        completions = _FakeCompletions([_tool_call("call-1", "snl-search")])
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        events = runner.chat_stream(ChatRequest(message="Hei", sources=["snl"]))
+        async for event in events:
+            if isinstance(event, ToolStartEvent):
+                break
+        await events.aclose()
+        await asyncio.sleep(0)
+        assert warmed == ["https://snl.no"]
+
+    @pytest.mark.asyncio
+    async def test_repeated_question_answered_from_cache(self):
+        """Test that the same question, sources and history replay the answer without calls."""
+        runner = AgentRunner("test-key")
+        runner.answer_cache_ttl = 600
+        runner.registry = ToolRegistry()
+
+        async def handler(args):
+            return [TextContent(text="ok")]
+
+        runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=handler)
+        completions = _FakeCompletions([_tool_call("call-1", "snl-search")])
+
+        class _ShortStream(_FakeStream):
+            async def __aiter__(self):
+                yield _chunk("Nidarosdomen er en katedral.")
+
+        completions.stream = _ShortStream()
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        first = await runner.chat(ChatRequest(message="Hva er Nidarosdomen?", sources=["snl"]))
+        calls = len(completions.requests)
+        events = [
+            event async for event in runner.chat_stream(ChatRequest(message="hva er  nidarosdomen?", sources=["snl"]))
+        ]
+        assert [type(event) for event in events] == [TokenEvent, DoneEvent]
+        assert events[0].content == first.response.text == "Nidarosdomen er en katedral."
+        assert events[1].response.metadata.tools_used == ["snl-search"]
+        assert len(completions.requests) == calls
+
+        history = [{"role": "user", "content": "Hei"}, {"role": "assistant", "content": "Hei!"}]
+        await runner.chat(ChatRequest(message="Hva er Nidarosdomen?", sources=["snl"], conversation_history=history))
+        assert len(completions.requests) > calls
+
+    @pytest.mark.asyncio
+    async def test_answer_with_timed_out_tool_not_cached(self):
+        """Test that an answer missing a timed-out tool's results is not replayed."""
+        runner = AgentRunner("test-key")
+        runner.answer_cache_ttl = 600
+        runner.tool_round_timeout = 0.05
+        runner.registry = ToolRegistry()
+
+        async def slow(args):
+            await asyncio.sleep(10)
+            return [TextContent(text="too late")]
+
+        runner.registry.register(name="arcgis-slow", description="", input_schema={"type": "object"}, handler=slow)
+        completions = _FakeCompletions([_tool_call("call-1", "arcgis-slow")])
+
+        class _ShortStream(_FakeStream):
+            async def __aiter__(self):
+                yield _chunk("Svar.")
+
+        completions.stream = _ShortStream()
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        request = ChatRequest(message="Hei", sources=["riksantikvaren"])
+        await runner.chat(request)
+        assert answer_cache.get(_answer_cache_key(request)) is None
+        for task in list(runner_module._inflight_tool_calls.values()):
+            task.cancel()
+
+    @pytest.mark.asyncio
+    async def test_answer_with_failed_tool_not_cached(self):
+        """Test that an answer built on a tool error is not replayed."""
+        runner = AgentRunner("test-key")
+        runner.answer_cache_ttl = 600
+        runner.registry = ToolRegistry()
+        tool_result_cache.clear()
+
+        async def broken(args):
+            raise RuntimeError("upstream down")
+
+        runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=broken)
+        completions = _FakeCompletions([_tool_call("call-1", "snl-search")])
+
+        class _ShortStream(_FakeStream):
+            async def __aiter__(self):
+                yield _chunk("Svar.")
+
+        completions.stream = _ShortStream()
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        request = ChatRequest(message="Hei", sources=["snl"])
+        await runner.chat(request)
+        assert answer_cache.get(_answer_cache_key(request)) is None
+
+    @pytest.mark.asyncio
+    async def test_answer_routed_under_rate_limit_not_cached(self, monkeypatch):
+        """Test that an answer routed by the fallback model is not replayed."""
+        monkeypatch.setattr(AgentRunner, "_router_breaker", rate_limit_module.CircuitBreaker())
+        runner = AgentRunner("test-key")
+        runner.answer_cache_ttl = 600
+        runner.router_model, runner.model = "router", "responder"
+
+        class _LimitedCompletions(_FakeCompletions):
+            async def create(self, **kwargs):
+                if kwargs["model"] == "router":
+                    raise RuntimeError("Error code: 429 - Too Many Requests")
+                return await super().create(**kwargs)
+
+        completions = _LimitedCompletions()
+
+        class _ShortStream(_FakeStream):
+            async def __aiter__(self):
+                yield _chunk("Hei!")
+
+        completions.stream = _ShortStream()
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        request = ChatRequest(message="Hei", sources=["snl"])
+        response = await runner.chat(request)
+        assert response.response.text == "Hei!"
+        assert answer_cache.get(_answer_cache_key(request)) is None
+
+    @pytest.mark.asyncio
+    async def test_large_results_postprocessed_off_loop(self):
+        """Test that the final response is built in a worker thread only for large tool output."""
+        runner = AgentRunner("test-key")
+        runner.registry = ToolRegistry()
+        tool_result_cache.clear()
+
+        async def small(args):
+            return [TextContent(text="ok")]
+
+        async def large(args):
+            return [TextContent(text="x" * (POSTPROCESS_THREAD_CHARS + 1))]
+
+        runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=small)
+        runner.registry.register(name="snl-article", description="", input_schema={"type": "object"}, handler=large)
+
+        class _ShortStream(_FakeStream):
+            async def __aiter__(self):
+                yield _chunk("Svar.")
+
+        threads = []
+        build_response = runner._build_response
+
+        def recording_build_response(*args):
+            threads.append(threading.current_thread() is threading.main_thread())
+            return build_response(*args)
+
+        runner._build_response = recording_build_response
+        for name in ("snl-search", "snl-article"):
+            completions = _FakeCompletions([_tool_call("call-1", name)])
+            completions.stream = _ShortStream()
+            runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+            response = await runner.chat(ChatRequest(message=f"Hei {name}", sources=["snl"]))
+            assert response.response.text == "Svar."
+
+        assert threads == [True, False]
+
+    @pytest.mark.asyncio
+    async def test_tool_payload_sent_without_copies(self):
+        """Test that a dict tool result is encoded once and the same string reaches the request."""
+        runner = AgentRunner("test-key")
+        runner.registry = ToolRegistry()
+        tool_result_cache.clear()
+        features = {"features": [{"navn": "Bryggen", "id": i} for i in range(100)]}
+
+        async def handler(args):
+            return features
+
+        runner.registry.register(name="arcgis-nearby", description="", input_schema={"type": "object"}, handler=handler)
+        completions = _FakeCompletions([_tool_call("call-1", "arcgis-nearby")])
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        events = runner.chat_stream(ChatRequest(message="Hei", sources=["riksantikvaren"]))
+        async for event in events:
+            if isinstance(event, TokenEvent):
+                break
+        await events.aclose()
+
+        content = [m for m in completions.requests[1]["messages"] if m["role"] == "tool"][0]["content"]
+        assert content is tool_result_cache.get("arcgis-nearby:{}")
+        assert content == json.dumps(features, ensure_ascii=False, separators=(",", ":"))
+
+    @pytest.mark.asyncio
+    async def test_batch_tool_call_fans_out(self):
+        """Test that one batch call runs each invocation and answers with an ordered array."""
+        runner = AgentRunner("test-key")
+        runner.batch_tool_enabled = True
+        runner.registry = ToolRegistry()
+        tool_result_cache.clear()
+
+        async def handler(args):
+            await asyncio.sleep(0.01 if args["q"] == "Bergen" else 0)
+            return [TextContent(text=f"result {args['q']}")]
+
+        for name in ("snl-search", "wikipedia-search"):
+            runner.registry.register(name=name, description="", input_schema={"type": "object"}, handler=handler)
+        assert runner._get_enabled_tools(["snl"])[-1]["function"]["name"] == BATCH_TOOL_NAME
+
+        invocations = [
+            {"tool_name": "snl-search", "arguments": {"q": "Bergen"}},
+            {"tool_name": "wikipedia-search", "arguments": {"q": "Oslo"}},
+        ]
+        completions = _FakeCompletions([
+            _tool_call("call-1", BATCH_TOOL_NAME, json.dumps({"invocations": invocations})),
+            _tool_call("call-2", "snl-search", '{"q": "Trondheim"}'),
+        ])
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        events = runner.chat_stream(ChatRequest(message="Hei", sources=["snl", "wikipedia"]))
+        async for event in events:
+            if isinstance(event, TokenEvent):
+                break
+        await events.aclose()
+
+        tool_messages = [m for m in completions.requests[1]["messages"] if m["role"] == "tool"]
+        assert [m["tool_call_id"] for m in tool_messages] == ["call-1", "call-2"]
+        assert json.loads(tool_messages[0]["content"]) == ["result Bergen", "result Oslo"]
+        assert tool_messages[1]["content"] == "result Trondheim"
+
+    @pytest.mark.asyncio
+    async def test_batch_tool_call_rejects_disabled_and_malformed(self):
+        """Test that batch invocations of disabled tools or with non-object arguments aren't run."""
+        runner = AgentRunner("test-key")
+        runner.batch_tool_enabled = True
+        runner.registry = ToolRegistry()
+        tool_result_cache.clear()
+        calls = []
+
+        async def handler(args):
+            calls.append(args)
+            return [TextContent(text=f"result {args['q']}")]
+
+        for name in ("snl-search", "wikipedia-search"):
+            runner.registry.register(name=name, description="", input_schema={"type": "object"}, handler=handler)
+
+        invocations = [
+            {"tool_name": "wikipedia-search", "arguments": {"q": "Oslo"}},
+            {"tool_name": "snl-search", "arguments": ["Bergen"]},
+            {"tool_name": "snl-search", "arguments": {"q": "Bergen"}},
+        ]
+        completions = _FakeCompletions([
+            _tool_call("call-1", BATCH_TOOL_NAME, json.dumps({"invocations": invocations})),
+        ])
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        started = []
+        events = runner.chat_stream(ChatRequest(message="Hei", sources=["snl"]))
+        async for event in events:
+            if isinstance(event, ToolStartEvent):
+                started.append(event.tool)
+            elif isinstance(event, TokenEvent):
+                break
+        await events.aclose()
+
+        assert started == ["snl-search"]
+        assert calls == [{"q": "Bergen"}]
+        tool_messages = [m for m in completions.requests[1]["messages"] if m["role"] == "tool"]
+        results = json.loads(tool_messages[0]["content"])
+        assert "not enabled" in json.loads(results[0])["error"]
+        assert "JSON object" in json.loads(results[1])["error"]
+        assert results[2] == "result Bergen"
+
+    @pytest.mark.asyncio
+    async def test_duplicate_tool_calls_run_once(self):
+        """Test that identical calls in one round run once and answer every call id."""
+        runner = AgentRunner("test-key")
+        runner.registry = ToolRegistry()
+        tool_result_cache.clear()
+        calls = []
+
+        async def handler(args):
+            calls.append(args)
+            return [TextContent(text=f"result {args['query']}")]
+
+        runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=handler)
+        completions = _FakeCompletions([
+            _tool_call("call-1", "snl-search", '{"query": "Bergen", "limit": 3}'),
+            _tool_call("call-2", "snl-search", '{"limit": 3, "query": "Bergen"}'),
+            _tool_call("call-3", "snl-search", '{"query": "Oslo", "limit": 3}'),
+        ])
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        started = []
+        events = runner.chat_stream(ChatRequest(message="Hei", sources=["snl"]))
+        async for event in events:
+            if isinstance(event, ToolStartEvent):
+                started.append(event.arguments["query"])
+            elif isinstance(event, TokenEvent):
+                break
+        await events.aclose()
+
+        assert started == ["Bergen", "Oslo"]
+        assert [args["query"] for args in calls] == ["Bergen", "Oslo"]
+        tool_messages = [m for m in completions.requests[1]["messages"] if m["role"] == "tool"]
+        assert [(m["tool_call_id"], m["content"]) for m in tool_messages] == [
+            ("call-1", "result Bergen"),
+            ("call-2", "result Bergen"),
+            ("call-3", "result Oslo"),
+        ]
+
+    @pytest.mark.asyncio
+    async def test_speculative_search_joined_by_routed_call(self, monkeypatch):
+        """Test that the raw-question search runs during routing and a matching call reuses it."""
+        monkeypatch.setattr(get_settings(), "chat_speculative_search", True)
+        runner = AgentRunner("test-key")
+        runner.registry = ToolRegistry()
+        tool_result_cache.clear()
+        calls = []
+        searching = asyncio.Event()
+
+        async def handler(args):
+            calls.append(args)
+            searching.set()
+            await asyncio.sleep(0.01)
+            return [TextContent(text=f"result {args['query']}")]
+
+        for name in ("wikipedia-search", "snl-search"):
+            runner.registry.register(name=name, description="", input_schema={"type": "object"}, handler=handler)
+
+        class _RoutingCompletions(_FakeCompletions):
+            async def create(self, **kwargs):
+                if not kwargs.get("stream"):
+                    await asyncio.wait_for(searching.wait(), timeout=1)
+                return await super().create(**kwargs)
+
+        completions = _RoutingCompletions([_tool_call("call-1", "wikipedia-search", '{"query": "Hvem var Snorre?"}')])
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        events = runner.chat_stream(ChatRequest(message="Hvem var Snorre?", sources=["wikipedia"]))
+        async for event in events:
+            if isinstance(event, TokenEvent):
+                break
+        await events.aclose()
+
+        assert calls == [{"query": "Hvem var Snorre?"}]
+        tool_messages = [m for m in completions.requests[1]["messages"] if m["role"] == "tool"]
+        assert tool_messages[0]["content"] == "result Hvem var Snorre?"
+
+    @pytest.mark.asyncio
+    async def test_speculative_search_cancelled_when_routing_fails(self, monkeypatch):
+        """Test that a failed routing call doesn't leave the speculative searches' tasks running."""
+        runner = AgentRunner("test-key")
+        runner.registry = ToolRegistry()
+        runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=None)
+        speculative = asyncio.create_task(asyncio.sleep(60))
+        monkeypatch.setattr(runner, "_start_speculative_searches", lambda sources, query: [speculative])
+
+        class _FailingCompletions:
+            async def create(self, **kwargs):
+                raise RuntimeError("router down")
+
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=_FailingCompletions()))
+
+        events = [event async for event in runner.chat_stream(ChatRequest(message="Hvem var Snorre?", sources=["snl"]))]
+        await asyncio.sleep(0)
+
+        assert isinstance(events[-1], ErrorEvent)
+        assert speculative.cancelled()
+
+
+class TestAgentRunnerV2:
+    """Tests for the two-model runner."""
+
+    def test_source_extraction_provider(self):
+        """Test that sources are attributed to the provider of the tool that found them."""
+        runner = AgentRunnerV2("test-key")
+        results = [
+            ("snl-search", "https://snl.no/Bryggen", {}),
+            ("arcgis-nearby", "https://kulturminnesok.no/minne/?queryString=x", {}),
+        ]
+        sources = runner._extract_sources_from_results(results, "")
+        assert [source.provider for source in sources] == ["snl", "riksantikvaren"]
+
+    def test_source_provider_from_url_host(self):
+        """Test that a site name in a query string doesn't pick the provider."""
+        runner = AgentRunnerV2("test-key")
+        result = "https://no.wikipedia.org/wiki/Akershus_festning https://example.org/?ref=snl.no"
+        sources = runner._extract_sources_from_results([("snl-search", result, {"query": "Akershus"})], "")
+        assert [(source.title, source.provider) for source in sources] == [
+            ("Akershus festning – Wikipedia", "wikipedia"),
+            ("Akershus", "snl"),
+        ]
+
+    def test_enabled_tools_from_registry_cache(self):
+        """Test that tool lists come from the registry cache, defaulting to all sources."""
+        runner = AgentRunnerV2("test-key")
+        runner.registry = ToolRegistry()
+
+        async def handler(args):
+            return []
+
+        for name in ("snl-search", "wikipedia-search", "example-ping"):
+            runner.registry.register(name=name, description="", input_schema={"type": "object"}, handler=handler)
+
+        tools = runner._get_enabled_tools(["snl"])
+        assert [t["function"]["name"] for t in tools] == ["snl-search"]
+        assert runner._get_enabled_tools(["snl", "snl"]) is tools
+        assert [t["function"]["name"] for t in runner._get_enabled_tools([])] == ["snl-search", "wikipedia-search"]
+
+    @pytest.mark.asyncio
+    async def test_uses_shared_async_client(self):
+        """Test that routing, tools and the streamed answer all run without blocking the loop."""
+        runner = AgentRunnerV2("test-key")
+        assert runner.client is get_openai_client("test-key")
+        runner.registry = ToolRegistry()
+        tool_result_cache.clear()
+
+        async def handler(args):
+            return [TextContent(text="Nidarosdomen")]
+
+        runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=handler)
+        completions = _FakeCompletions([_tool_call("call-1", "snl-search")])
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        events = runner.chat_stream(V2ChatRequest(message="Hei", sources=["snl"]))
+        async for event in events:
+            if isinstance(event, V2TokenEvent):
+                break
+        await events.aclose()
+
+        assert completions.stream.closed
+        assert "Nidarosdomen" in completions.requests[1]["messages"][-1]["content"]
+
+    @pytest.mark.asyncio
+    async def test_answer_tokens_coalesced(self):
+        """Test that streamed deltas reach the client in batches, not one event each."""
+        runner = AgentRunnerV2("test-key")
+        runner.registry = ToolRegistry()
+
+        async def handler(args):
+            return [TextContent(text="ok")]
+
+        runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=handler)
+        completions = _FakeCompletions([_tool_call("call-1", "snl-search")])
+
+        class _ShortStream(_FakeStream):
+            async def __aiter__(self):
+                for letter in "abcdefghijklmnop":
+                    yield _chunk(letter)
+
+        completions.stream = _ShortStream()
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        tokens = [
+            event.content
+            async for event in runner.chat_stream(V2ChatRequest(message="Hei", sources=["snl"]))
+            if isinstance(event, V2TokenEvent)
+        ]
+        assert "".join(tokens) == "abcdefghijklmnop"
+        assert len(tokens) == 2
+
+    @pytest.mark.asyncio
+    async def test_tokenizer_loaded_off_loop(self, monkeypatch):
+        """Test that the tokenizer is loaded once, in a worker thread, not on the event loop."""
+        loads = []
+
+        @functools.lru_cache(maxsize=1)
+        def get_encoding():
+            loads.append(threading.current_thread() is threading.main_thread())
+            return None
+
+        monkeypatch.setattr(runner_v2_module, "_get_encoding", get_encoding)
+        await runner_v2_module._load_encoding()
+        await runner_v2_module._load_encoding()
+        assert loads == [False]
+
+    @pytest.mark.asyncio
+    async def test_tools_reported_as_they_finish(self):
+        """Test that fast tools are reported first, slow ones time out, and the context keeps call order."""
+        runner = AgentRunnerV2("test-key")
+        runner.tool_round_timeout = 0.1
+        runner.registry = ToolRegistry()
+        for name, delay in (("snl-slow", 0.05), ("snl-fast", 0.0), ("snl-stuck", 10)):
+            async def handler(args, name=name, delay=delay):
+                await asyncio.sleep(delay)
+                return [TextContent(text=f"{name} result")]
+
+            runner.registry.register(name=name, description="", input_schema={"type": "object"}, handler=handler)
+        completions = _FakeCompletions([
+            _tool_call("call-1", "snl-slow"), _tool_call("call-2", "snl-fast"), _tool_call("call-3", "snl-stuck"),
+        ])
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        ended = []
+        events = runner.chat_stream(V2ChatRequest(message="Hei", sources=["snl"]))
+        async for event in events:
+            if event.type == "tool_end":
+                ended.append((event.tool, event.success))
+            elif isinstance(event, V2TokenEvent):
+                break
+        await events.aclose()
+
+        assert ended == [("snl-fast", True), ("snl-slow", True), ("snl-stuck", False)]
+        context = completions.requests[1]["messages"][-1]["content"]
+        assert context.index("snl-slow result") < context.index("snl-fast result")
+        assert "snl-stuck" not in context
+        for task in list(runner_module._inflight_tool_calls.values()):
+            task.cancel()
+
+    @pytest.mark.asyncio
+    async def test_empty_results_skip_responder(self):
+        """Test that when every tool comes back empty, a fixed answer replaces the responder call."""
+        runner = AgentRunnerV2("test-key")
+        runner.registry = ToolRegistry()
+
+        async def empty(args):
+            return [TextContent(text="No SNL articles found for: Hei")]
+
+        async def broken(args):
+            raise RuntimeError("boom")
+
+        runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=empty)
+        runner.registry.register(name="snl-article", description="", input_schema={"type": "object"}, handler=broken)
+        completions = _FakeCompletions([_tool_call("call-1", "snl-search"), _tool_call("call-2", "snl-article")])
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        events = [event async for event in runner.chat_stream(V2ChatRequest(message="Hei", sources=["snl"]))]
+        assert [event.content for event in events if isinstance(event, V2TokenEvent)] == [NO_RESULTS_RESPONSE]
+        assert events[-1].response.response.text == NO_RESULTS_RESPONSE
+        assert len(completions.requests) == 1
+
+    @pytest.mark.asyncio
+    async def test_providers_in_source_order(self):
+        """Test that the final response lists each consulted provider once, in source order."""
+        runner = AgentRunnerV2("test-key")
+        runner.registry = ToolRegistry()
+
+        async def handler(args):
+            return [TextContent(text="ok")]
+
+        names = ("arcgis-nearby", "snl-search", "riksantikvaren-features", "wikipedia-search")
+        for name in names:
+            runner.registry.register(name=name, description="", input_schema={"type": "object"}, handler=handler)
+        completions = _FakeCompletions([_tool_call(f"call-{i}", name) for i, name in enumerate(names)])
+
+        class _ShortStream(_FakeStream):
+            async def __aiter__(self):
+                yield _chunk("Svar.")
+
+        completions.stream = _ShortStream()
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        done = [
+            event async for event in runner.chat_stream(V2ChatRequest(message="Hei", sources=[]))
+            if event.type == "done"
+        ]
+        assert done[0].response.metadata.providers_consulted == ["wikipedia", "snl", "riksantikvaren"]
+
+    @pytest.mark.asyncio
+    async def test_responder_gets_one_turn_message(self):
+        """Test that the question and search results go in one user message, with no filler turn."""
+        runner = AgentRunnerV2("test-key")
+        runner.registry = ToolRegistry()
+
+        async def handler(args):
+            return [TextContent(text="Nidarosdomen")]
+
+        runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=handler)
+        completions = _FakeCompletions([_tool_call("call-1", "snl-search")])
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        events = runner.chat_stream(V2ChatRequest(message="Hei", sources=["snl"]))
+        async for event in events:
+            if isinstance(event, V2TokenEvent):
+                break
+        await events.aclose()
+
+        messages = completions.requests[1]["messages"]
+        assert [m["role"] for m in messages] == ["system", "user"]
+        assert messages[1]["content"].startswith("Hei\n\nSearch results:")
+
+    @pytest.mark.asyncio
+    async def test_concurrent_sessions_interleave(self):
+        """Test that two sessions' routing calls are in flight on the loop at the same time."""
+        both_routing = asyncio.Barrier(2)
+
+        class _WaitingCompletions(_FakeCompletions):
+            async def create(self, **kwargs):
+                if kwargs.get("tools"):
+                    await both_routing.wait()
+                return await super().create(**kwargs)
+
+        async def first_token(runner):
+            events = runner.chat_stream(V2ChatRequest(message="Hei", sources=["snl"]))
+            async for event in events:
+                if isinstance(event, V2TokenEvent):
+                    break
+            await events.aclose()
+
+        async def handler(args):
+            return [TextContent(text="ok")]
+
+        runners = []
+        for i in range(2):
+            runner = AgentRunnerV2("test-key")
+            runner.registry = ToolRegistry()
+            runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=handler)
+            completions = _WaitingCompletions([_tool_call(f"call-{i}", "snl-search", f'{{"query": "{i}"}}')])
+            runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+            runners.append(runner)
+
+        await asyncio.wait_for(asyncio.gather(*(first_token(runner) for runner in runners)), timeout=2)
+        assert all(runner.client.chat.completions.stream.closed for runner in runners)
+
+    @pytest.mark.asyncio
+    async def test_tool_calls_yielded_while_router_streams(self):
+        """Test that each routed call is available as soon as its arguments are complete."""
+        stream = _FakeToolCallStream([
+            _tool_call("call-1", "snl-search", '{"query": "Bryggen"}'),
+            _tool_call("call-2", "wikipedia-search", '{"query": "Bry'),
+        ])
+        chunks_read = 0
+
+        async def counted():
+            nonlocal chunks_read
+            async for chunk in stream:
+                chunks_read += 1
+                yield chunk
+
+        calls = []
+        async for name, arguments in _stream_tool_calls(counted()):
+            calls.append((name, arguments, chunks_read))
+        assert calls == [
+            ("snl-search", {"query": "Bryggen"}, 3),
+            ("wikipedia-search", {}, 6),
+        ]
+
+    def test_context_drops_urls_and_repeated_paragraphs(self):
+        """Test that the responder context skips URLs and paragraphs another tool already gave."""
+        shared = "Akershus festning er en middelalderborg i Oslo."
+        context = _compress_context([
+            ("snl-search", f"{shared}\n\nLes mer: https://snl.no/Akershus_festning", {}),
+            ("wikipedia-search", f"{shared}  \n\nBygget rundt 1300.", {}),
+        ])
+        assert context == (
+            f"## snl-search\n{shared}\n\nLes mer:"
+            "\n\n---\n\n## wikipedia-search\nBygget rundt 1300."
+        )
+
+    def test_context_budget_shared_between_tools(self):
+        """Test that a large first result can't use up the whole context budget."""
+        big = "\n\n".join(f"{i} " + "x" * 400 for i in range(40))
+        context = _compress_context([("snl-search", big, {}), ("wikipedia-search", "Kort svar.", {})])
+        assert "## wikipedia-search\nKort svar." in context
+        assert _count_tokens(context) <= MAX_CONTEXT_TOKENS + 20
+
+    def test_long_result_read_only_to_budget(self, monkeypatch):
+        """Test that paragraphs past a tool's budget are never processed."""
+        url_re = runner_v2_module._URL_RE
+        scanned = []
+
+        def sub(replacement, text):
+            scanned.append(text)
+            return url_re.sub(replacement, text)
+
+        monkeypatch.setattr(runner_v2_module, "_URL_RE", SimpleNamespace(sub=sub))
+        huge = "\n\n".join(f"Avsnitt {i}. " + "ord " * 50 for i in range(5000))
+        context = _compress_context([("arcgis-nearby", huge, {})])
+        assert context.startswith("## arcgis-nearby\nAvsnitt 0.")
+        assert len(scanned) < 50
+
+    def test_truncation_ends_at_sentence(self):
+        """Test that a cut result is trimmed back to a nearby sentence end."""
+        text = "Første setning er her. " * 50
+        cut = _truncate_tokens(text, 30)
+        assert cut.endswith("her.")
+        assert _count_tokens(cut) <= 30
+        assert _truncate_tokens("Kort.", 30) == "Kort."
+
+    @pytest.mark.asyncio
+    async def test_identical_tool_calls_share_one_run(self):
+        """Test that concurrent identical calls run once and later ones hit the cache."""
+        runner = AgentRunnerV2("test-key")
+        runner.registry = ToolRegistry()
+        calls = []
+
+        async def handler(args):
+            calls.append(args)
+            await asyncio.sleep(0.01)
+            return [TextContent(text="Akershus festning")]
+
+        runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=handler)
+
+        results = await asyncio.gather(
+            runner._execute_tool("snl-search", {"query": "Akershus", "limit": 3}),
+            runner._execute_tool("snl-search", {"limit": 3, "query": "Akershus"}),
+        )
+        assert await runner._execute_tool("snl-search", {"query": "Akershus", "limit": 3}) == results[0]
+        assert results[0] == results[1]
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_tool_concurrency_shared_with_v1(self, monkeypatch):
+        """Test that v2 tool calls queue on the same per-provider limiter as the v1 runner."""
+        monkeypatch.setattr(rate_limit_module, "_source_limiters", {})
+        monkeypatch.setattr(get_settings(), "tool_max_concurrent_per_source", 1)
+        registry = ToolRegistry()
+        active = peak = 0
+
+        async def handler(args):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return [TextContent(text=args["query"])]
+
+        registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=handler)
+        v1, v2 = AgentRunner("test-key"), AgentRunnerV2("test-key")
+        v1.registry = v2.registry = registry
+        tool_result_cache.clear()
+
+        await asyncio.gather(
+            v1._execute_tool("snl-search", {"query": "a"}),
+            v2._execute_tool("snl-search", {"query": "b"}),
+            v2._execute_tool("snl-search", {"query": "c"}),
+        )
+        assert peak == 1
+
+    @pytest.mark.asyncio
+    async def test_tool_errors_not_cached(self):
+        """Test that failed tool calls are retried on the next request."""
+        runner = AgentRunnerV2("test-key")
+        runner.registry = ToolRegistry()
+        calls = []
+
+        async def handler(args):
+            calls.append(args)
+            raise RuntimeError("upstream down")
+
+        runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=handler)
+
+        for _ in range(2):
+            result = await runner._execute_tool("snl-search", {"query": "Akershus"})
+        assert len(calls) == 2
+        assert result.startswith("Error")
+
+    @pytest.mark.asyncio
+    async def test_history_kept_in_order_before_message(self):
+        """Test that history follows the shared system message, oldest first, before the question."""
+        runner = AgentRunnerV2("test-key")
+        runner.registry = ToolRegistry()
+        tool_result_cache.clear()
+
+        async def handler(args):
+            return [TextContent(text="ok")]
+
+        runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=handler)
+        completions = _FakeCompletions([_tool_call("call-1", "snl-search")])
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        history = [{"role": "user", "content": str(i)} for i in range(6)]
+
+        events = runner.chat_stream(V2ChatRequest(message="Hei", sources=["snl"], conversation_history=history))
+        async for event in events:
+            if isinstance(event, V2TokenEvent):
+                break
+        await events.aclose()
+
+        messages = completions.requests[1]["messages"]
+        assert messages[0] is _RESPONDER_SYSTEM_MSG
+        assert [m["content"] for m in messages[1:5]] == ["2", "3", "4", "5"]
+        assert len(messages) == 6
+        assert messages[5]["content"].startswith("Hei\n\nSearch results:")
+
+
+class TestRouterBatcher:
+    """Tests for coalescing v2 router calls."""
+
+    def _runner(self, tool_calls):
+        runner = AgentRunnerV2("test-key")
+        runner.registry = ToolRegistry()
+
+        async def handler(args):
+            return [TextContent(text="ok")]
+
+        for name in ("snl-search", "wikipedia-search"):
+            runner.registry.register(name=name, description="", input_schema={"type": "object"}, handler=handler)
+        completions = _FakeCompletions(tool_calls)
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        return runner, completions
+
+    @pytest.mark.asyncio
+    async def test_concurrent_questions_share_one_call(self):
+        """Test that questions in the same window get one router call and their own tool calls."""
+        runner, completions = self._runner([
+            _tool_call("call-1", "snl-search", '{"query": "Bryggen", "request_index": 2}'),
+            _tool_call("call-2", "wikipedia-search", '{"query": "Nidarosdomen", "request_index": 1}'),
+            _tool_call("call-3", "snl-search", '{"query": "Nidarosdomen", "request_index": 1}'),
+        ])
+        batcher = RouterBatcher()
+        tools = runner._get_enabled_tools(["snl", "wikipedia"])
+
+        routed = await asyncio.gather(
+            batcher.route(runner, "router", "Nidarosdomen?", tools),
+            batcher.route(runner, "router", "Bryggen?", tools),
+        )
+        assert routed == [
+            [("wikipedia-search", {"query": "Nidarosdomen"}), ("snl-search", {"query": "Nidarosdomen"})],
+            [("snl-search", {"query": "Bryggen"})],
+        ]
+        assert len(completions.requests) == 1
+        assert completions.requests[0]["messages"][-1]["content"] == "[1] Nidarosdomen?\n[2] Bryggen?"
+
+    @pytest.mark.asyncio
+    async def test_lone_question_routed_alone(self):
+        """Test that a question with no company in its window is handed back unrouted."""
+        runner, completions = self._runner([])
+        batcher = RouterBatcher()
+
+        assert await batcher.route(runner, "router", "Hei", runner._get_enabled_tools(["snl"])) is None
+        assert completions.requests == []
+
+    @pytest.mark.asyncio
+    async def test_unmatched_call_routes_each_alone(self):
+        """Test that a tool call without a valid request_index sends every question back."""
+        runner, completions = self._runner([_tool_call("call-1", "snl-search", '{"query": "Bryggen"}')])
+        batcher = RouterBatcher()
+        tools = runner._get_enabled_tools(["snl"])
+
+        routed = await asyncio.gather(
+            batcher.route(runner, "router", "Nidarosdomen?", tools),
+            batcher.route(runner, "router", "Bryggen?", tools),
+        )
+        assert routed == [None, None]
+
+    @pytest.mark.asyncio
+    async def test_full_batch_sent_without_waiting(self):
+        """Test that a batch is sent as soon as it is full, before the window closes."""
+        runner, completions = self._runner([_tool_call("call-1", "snl-search", '{"request_index": 2}')])
+        batcher = RouterBatcher(max_size=2, window=60.0)
+        tools = runner._get_enabled_tools(["snl"])
+
+        routed = await asyncio.wait_for(asyncio.gather(
+            batcher.route(runner, "router", "Nidarosdomen?", tools),
+            batcher.route(runner, "router", "Bryggen?", tools),
+        ), timeout=1.0)
+        assert routed == [[], [("snl-search", {})]]
+
+    @pytest.mark.asyncio
+    async def test_chat_stream_uses_batched_route(self, monkeypatch):
+        """Test that with batching on, each session runs the tools routed for its own question."""
+        monkeypatch.setattr(get_settings(), "chat_router_batching", True)
+        runner, completions = self._runner([
+            _tool_call("call-1", "snl-search", '{"query": "Bryggen", "request_index": 2}'),
+            _tool_call("call-2", "snl-search", '{"query": "Nidarosdomen", "request_index": 1}'),
+        ])
+
+        class _ShortStream(_FakeStream):
+            async def __aiter__(self):
+                yield _chunk("Svar.")
+
+        completions.stream = _ShortStream()
+
+        async def started(question):
+            return [
+                event.arguments
+                async for event in runner.chat_stream(V2ChatRequest(message=question, sources=["snl"]))
+                if event.type == "tool_start"
+            ]
+
+        assert await asyncio.gather(started("Nidarosdomen?"), started("Bryggen?")) == [
+            [{"query": "Nidarosdomen"}],
+            [{"query": "Bryggen"}],
+        ]
+        assert [bool(r.get("stream")) for r in completions.requests] == [False, True, True]
+
+
+class TestExecuteTool:
+    """Tests for tool execution, serialization and result caching."""
+
+    def setup_method(self):
+        self.runner = AgentRunner("test-key")
+        self.runner.registry = ToolRegistry()
+        tool_result_cache.clear()
+
+    def _register(self, name, result):
+        async def handler(args):
+            return result
+
+        self.runner.registry.register(name=name, description="", input_schema={"type": "object"}, handler=handler)
+
+    @pytest.mark.asyncio
+    async def test_dict_result_compact_json(self):
+        """Test that dict results serialize as compact, non-ASCII-escaped JSON."""
+        result = {"navn": "Bryggen i Bergen", "år": 1070, "tags": ["unesco"]}
+        self._register("test-dict", result)
+        text = await self.runner._execute_tool("test-dict", {})
+        assert text == json.dumps(result, ensure_ascii=False, separators=(",", ":"))
+
+    @pytest.mark.asyncio
+    async def test_identical_calls_in_flight_share_one_run(self):
+        """Test that concurrent identical calls from different chats run the tool once."""
+        calls = []
+
+        async def handler(args):
+            calls.append(args)
+            await asyncio.sleep(0.01)
+            return [TextContent(text="Akershus festning")]
+
+        self.runner.registry.register(name="wikipedia-search", description="", input_schema={"type": "object"}, handler=handler)
+        other = AgentRunner("test-key")
+        other.registry = self.runner.registry
+
+        results = await asyncio.gather(
+            self.runner._execute_tool("wikipedia-search", {"q": "Akershus", "lang": "no"}),
+            other._execute_tool("wikipedia-search", {"lang": "no", "q": "Akershus"}),
+        )
+        assert results == ["Akershus festning", "Akershus festning"]
+        assert len(calls) == 1
+        assert not runner_module._inflight_tool_calls
+
+    @pytest.mark.asyncio
+    async def test_concurrency_bounded_per_source(self, monkeypatch):
+        """Test that parallel calls to one provider wait for that provider's limiter."""
+        monkeypatch.setattr(rate_limit_module, "_source_limiters", {})
+        monkeypatch.setattr(get_settings(), "tool_max_concurrent_per_source", 2)
+        active = {"snl": 0, "wikipedia": 0}
+        peak = {"snl": 0, "wikipedia": 0}
+        for source in active:
+            async def handler(args, source=source):
+                active[source] += 1
+                peak[source] = max(peak[source], active[source])
+                await asyncio.sleep(0.01)
+                active[source] -= 1
+                return [TextContent(text="ok")]
+
+            self.runner.registry.register(name=f"{source}-search", description="", input_schema={"type": "object"}, handler=handler)
+
+        await asyncio.gather(*[
+            self.runner._execute_tool(f"{source}-search", {"q": i})
+            for i in range(5)
+            for source in active
+        ])
+        assert peak == {"snl": 2, "wikipedia": 2}
+
+    @pytest.mark.asyncio
+    async def test_text_content_list(self):
+        """Test that text content items are joined with newlines."""
+        self._register("test-text", [TextContent(text="a"), TextContent(text="b")])
+        assert await self.runner._execute_tool("test-text", {}) == "a\nb"
+
+    @pytest.mark.asyncio
+    async def test_mixed_list(self):
+        """Test that non-text items in a list are serialized individually."""
+        location = Location(name="Bryggen", lat=60.397, lng=5.324)
+        self._register("test-mixed", [TextContent(text="a"), location, 42])
+        text = await self.runner._execute_tool("test-mixed", {})
+        assert text == "a\n" + location.model_dump_json() + "\n42"
+
+    @pytest.mark.asyncio
+    async def test_provider_results_cached(self):
+        """Test that repeat calls with equal arguments reuse the cached result."""
+        calls = []
+
+        async def handler(args):
+            calls.append(args)
+            return [TextContent(text=f"Artikkel om {args['query']}")]
+
+        self.runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=handler)
+        first = await self.runner._execute_tool("snl-search", {"query": "Bryggen", "limit": 3})
+        second = await self.runner._execute_tool("snl-search", {"limit": 3, "query": "Bryggen"})
+        await self.runner._execute_tool("snl-search", {"query": "Nidarosdomen", "limit": 3})
+        assert first == second == "Artikkel om Bryggen"
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_precomputed_canonical_arguments_share_cache(self):
+        """Test that passing the canonical argument bytes hits the same cache entry."""
+        calls = []
+
+        async def handler(args):
+            calls.append(args)
+            return [TextContent(text="Bryggen")]
+
+        self.runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=handler)
+        arguments = {"query": "Bryggen", "limit": 3}
+        await self.runner._execute_tool("snl-search", arguments)
+        canonical = b'{"limit":3,"query":"Bryggen"}'
+        assert await self.runner._execute_tool("snl-search", arguments, canonical) == "Bryggen"
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_errors_not_cached(self):
+        """Test that error results are retried on the next call."""
+        calls = []
+
+        async def handler(args):
+            calls.append(args)
+            return [TextContent(text="Error searching for 'Bryggen': timeout")]
+
+        self.runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=handler)
+        await self.runner._execute_tool("snl-search", {"query": "Bryggen"})
+        await self.runner._execute_tool("snl-search", {"query": "Bryggen"})
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_other_tools_not_cached(self):
+        """Test that tools outside the provider prefixes always run."""
+        calls = []
+
+        async def handler(args):
+            calls.append(args)
+            return [TextContent(text="pong")]
+
+        self.runner.registry.register(name="example-ping", description="", input_schema={"type": "object"}, handler=handler)
+        await self.runner._execute_tool("example-ping", {})
+        await self.runner._execute_tool("example-ping", {})
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_unknown_tool(self):
+        """Test that a missing tool returns a JSON error."""
+        text = await self.runner._execute_tool("missing", {})
+        assert "not found" in json.loads(text)["error"]
+
+
+class TestCleanResponseText:
+    """Tests for stripping extracted sections from the response text."""
+
+    def setup_method(self):
+        self.runner = AgentRunner("test-key")
+
+    def test_strips_sources_section(self):
+        """Test that the sources heading and everything after it is removed."""
+        text = "Nidarosdomen ble bygget over St. Olavs grav.\n\n## Kilder\n- [SNL](https://snl.no/Nidarosdomen)"
+        assert self.runner._clean_response_text(text) == "Nidarosdomen ble bygget over St. Olavs grav."
+
+    def test_strips_related_questions_block(self):
+        """Test that a bold related questions list is removed."""
+        text = "Svar.\n\n**Relaterte spørsmål:**\n- Hvem bygget den?\n- Når?\n"
+        assert self.runner._clean_response_text(text) == "Svar."
+
+    def test_strips_heading_after_related_list(self):
+        """Test that a related questions heading after a bold list is not left behind."""
+        text = "Svar.\n**Relaterte spørsmål:**\n- Hvem?\n## Related questions\n- Why?"
+        assert self.runner._clean_response_text(text) == "Svar."
+
+    def test_strips_trailing_rule(self):
+        """Test that a trailing horizontal rule is removed."""
+        text = "Svar.\n\n---\n\n**Related questions:**\n- Why?"
+        assert self.runner._clean_response_text(text) == "Svar."
+
+
+class TestSourceExtraction:
+    """Tests for source and related query extraction."""
+
+    def setup_method(self):
+        self.runner = AgentRunner("test-key")
+
+    def test_extracts_used_sources(self):
+        """Test that URLs from a referenced tool result become titled sources."""
+        result = "**Nidarosdomen** er en katedral i Trondheim. https://snl.no/Nidarosdomen"
+        response = "Nidarosdomen ble påbegynt rundt 1070."
+        sources = self.runner._extract_sources_from_tool_results([("snl-search", result, {})], response)
+        assert [(s.title, s.provider) for s in sources] == [("Nidarosdomen – Store norske leksikon", "snl")]
+
+    def test_skips_unused_sources(self):
+        """Test that tool results unrelated to the response are not listed."""
+        result = "**Bryggen** i Bergen https://no.wikipedia.org/wiki/Bryggen"
+        response = "Nidarosdomen ble påbegynt rundt 1070."
+        assert self.runner._extract_sources_from_tool_results([("wikipedia-search", result, {})], response) == []
+
+    def test_provider_from_url_host(self):
+        """Test that only the URL's host picks the provider, and other URLs keep the tool's."""
+        result = (
+            "**Nidarosdomen** https://lille.snl.no/Nidarosdomen "
+            "https://example.org/?ref=snl.no https://no.wikipedia.org/wiki/Nidarosdomen"
+        )
+        response = "Nidarosdomen ble påbegynt rundt 1070."
+        sources = self.runner._extract_sources_from_tool_results(
+            [("arcgis-nearby", result, {"query": "Nidarosdomen"})], response
+        )
+        assert [(s.title, s.provider) for s in sources] == [
+            ("Nidarosdomen – Store norske leksikon", "snl"),
+            ("Nidarosdomen", "riksantikvaren"),
+            ("Nidarosdomen – Wikipedia", "wikipedia"),
+        ]
+
+    def test_trailing_punctuation_not_in_url(self):
+        """Test that punctuation after a URL is left out of the source URL."""
+        result = "**Nidarosdomen** (se https://snl.no/Nidarosdomen); kilde: https://snl.no/Trondheim.:"
+        response = "Nidarosdomen ble påbegynt rundt 1070."
+        sources = self.runner._extract_sources_from_tool_results([("snl-search", result, {})], response)
+        assert [s.url for s in sources] == ["https://snl.no/Nidarosdomen", "https://snl.no/Trondheim"]
+
+    def _is_used(self, result, response):
+        response_lower = response.lower()
+        return self.runner._is_source_used_in_response(
+            result,
+            response_lower,
+            frozenset(_SIGNIFICANT_WORD_RE.findall(response_lower)),
+            frozenset(_TOKEN_RE.findall(response_lower)),
+        )
+
+    def test_years_need_whole_token_match(self):
+        """Test that a year only counts when it appears as its own token."""
+        result = "**Steinhuset** gammelt murverk fra handelsstedet, 1152 og 1248"
+        assert self._is_used(result, "Murverk ved handelsstedet fra 1152 og 1248.")
+        assert not self._is_used(result, "Murverk ved handelsstedet fra 1152, ref. 12480.")
+
+    def test_extracts_related_queries(self):
+        """Test that related questions get a trailing question mark."""
+        text = "Svar.\n\n**Relaterte spørsmål:**\n- Hvem bygget den?\n- Når ble den ferdig\n"
+        assert self.runner._extract_related_queries(text) == ["Hvem bygget den?", "Når ble den ferdig?"]
+
+
+class TestPrefixesForSources:
+    """Tests for source -> tool prefix flattening."""
+
+    def test_single_source(self):
+        """Test that a single source maps to its prefixes."""
+        assert _prefixes_for_sources(("snl",)) == ("snl-",)
+
+    def test_multiple_sources(self):
+        """Test that riksantikvaren expands to both of its prefixes."""
+        prefixes = _prefixes_for_sources(("riksantikvaren", "wikipedia"))
+        assert set(prefixes) == {"riksantikvaren-", "arcgis-", "wikipedia-"}
+
+    def test_unknown_source_ignored(self):
+        """Test that unknown sources contribute no prefixes."""
+        assert _prefixes_for_sources(("unknown",)) == ()
+
+    def test_prefix_tuple_matches_tool_names(self):
+        """Test that the tuple works with str.startswith."""
+        prefixes = _prefixes_for_sources(("riksantikvaren",))
+        assert "arcgis-nearby".startswith(prefixes)
+        assert not "wikipedia-search".startswith(prefixes)
+
+
+class TestSourceForTool:
+    """Tests for tool name -> source classification."""
+
+    def test_known_prefixes(self):
+        """Test that every mapped prefix resolves to its source."""
+        assert _source_for_tool("wikipedia-search") == "wikipedia"
+        assert _source_for_tool("snl-article") == "snl"
+        assert _source_for_tool("arcgis-nearby") == "riksantikvaren"
+        assert _source_for_tool("riksantikvaren-features") == "riksantikvaren"
+
+    def test_unknown_tool(self):
+        """Test that tools outside the source map have no source."""
+        assert _source_for_tool("example-ping") is None
+
+
+class TestEnabledTools:
+    """Tests for per-request tool list lookup."""
+
+    def test_same_list_for_equivalent_sources(self):
+        """Test that source order and duplicates hit the same cached tool list."""
+        runner = AgentRunner("test-key")
+        tools = runner._get_enabled_tools(["snl", "wikipedia"])
+        assert runner._get_enabled_tools(["wikipedia", "snl", "snl"]) is tools
+
+    def test_same_list_across_runners(self):
+        """Test that the list is built once per source set, not once per request's runner."""
+        tools = AgentRunner("test-key")._get_enabled_tools(["riksantikvaren"])
+        assert AgentRunner("test-key")._get_enabled_tools(["riksantikvaren"]) is tools
+        assert AgentRunnerV2("test-key")._get_enabled_tools(["riksantikvaren"]) is tools
+
+    def test_batch_tool_list_reused(self, monkeypatch):
+        """Test that the list with the batch tool is built once and rebuilt after a registration."""
+        monkeypatch.setattr(get_settings(), "chat_batch_tool_enabled", True)
+        runner = AgentRunner("test-key")
+        runner.registry = ToolRegistry()
+
+        async def handler(args):
+            return [TextContent(text="ok")]
+
+        runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=handler)
+        tools = runner._get_enabled_tools(["snl"])
+        assert [t["function"]["name"] for t in tools] == ["snl-search", BATCH_TOOL_NAME]
+        assert runner._get_enabled_tools(["snl"]) is tools
+
+        runner.registry.register(name="snl-article", description="", input_schema={"type": "object"}, handler=handler)
+        assert [t["function"]["name"] for t in runner._get_enabled_tools(["snl"])] == [
+            "snl-search", "snl-article", BATCH_TOOL_NAME,
+        ]
+
+    def test_v2_fallback_shares_all_sources_list(self):
+        """Test that v2's no-selection fallback reuses the list for selecting every source."""
+        everything = AgentRunner("test-key")._get_enabled_tools(["riksantikvaren", "snl", "wikipedia"])
+        assert AgentRunnerV2("test-key")._get_enabled_tools([]) is everything
+
+    def test_no_sources_no_tools(self):
+        """Test that an empty selection enables no tools."""
+        assert AgentRunner("test-key")._get_enabled_tools([]) == []
+
+
+class TestModelSelection:
+    """Tests for router/synthesis model selection."""
+
+    def test_router_model_can_be_disabled(self, monkeypatch):
+        """Test that turning off two-model routing uses the synthesis model for routing."""
+        assert AgentRunner("test-key").router_model != AgentRunner("test-key").model
+        monkeypatch.setattr(get_settings(), "chat_router_enabled", False)
+        runner = AgentRunner("test-key")
+        assert runner.router_model == runner.model
+
+
+class TestCompletionCache:
+    """Tests for caching non-streaming completions."""
+
+    @pytest.mark.asyncio
+    async def test_identical_routing_call_cached(self):
+        """Test that an identical non-streaming call is answered from the cache."""
+        runner = AgentRunner("test-key")
+        completions = _FakeCompletions()
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        kwargs = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "Hei"}], "temperature": 0.0}
+
+        first = await runner._create_completion(**kwargs)
+        assert await runner._create_completion(**kwargs) is first
+        await runner._create_completion(**{**kwargs, "model": "gpt-4o"})
+        assert len(completions.requests) == 2
+
+    def test_key_uses_tool_names(self):
+        """Test that the enabled tools are part of the key."""
+        tools = [{"type": "function", "function": {"name": n, "parameters": {}}} for n in ("snl-a", "snl-b")]
+        base = {"model": "m", "messages": [], "tools": tools}
+        assert _completion_cache_key(base) == _completion_cache_key({**base, "tools": tools[::-1]})
+        assert _completion_cache_key(base) != _completion_cache_key({**base, "tools": tools[:1]})
+
+    def test_key_normalizes_user_text(self):
+        """Test that user messages differing only in case and spacing share a key."""
+        def key(content, role="user"):
+            return _completion_cache_key({"model": "m", "messages": [{"role": role, "content": content}]})
+
+        assert key("Hva er  Bryggen?\n") == key("hva er bryggen?")
+        assert key("Hva er Bryggen?") != key("Hva er Bryggen")
+        assert key("Svar.", role="assistant") != key("svar.", role="assistant")
+
+    @pytest.mark.asyncio
+    async def test_streams_not_cached(self):
+        """Test that streaming calls always go to the API."""
+        runner = AgentRunner("test-key")
+        completions = _FakeCompletions()
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        for _ in range(2):
+            await runner._create_completion(model="gpt-4o", messages=[], stream=True)
+        assert len(completions.requests) == 2
+        assert completion_cache.get(_completion_cache_key({"model": "gpt-4o", "messages": [], "stream": True})) is None
+
+
+class TestSharedOpenAIClient:
+    """Tests for the process-wide OpenAI client."""
+
+    def test_client_shared_across_runners(self):
+        """Test that runners reuse one client (and connection pool)."""
+        assert AgentRunner("test-key").client is AgentRunner("test-key").client
+
+    def test_client_timeout_from_settings(self):
+        """Test that the shared client uses the configured timeout, not the SDK's 10 minutes."""
+        client = get_openai_client("key-timeout")
+        assert client.timeout.read == get_settings().openai_timeout_seconds
+        assert client.timeout.connect == 5.0
+
+    def test_client_per_api_key(self):
+        """Test that different API keys get different clients."""
+        assert get_openai_client("key-a") is not get_openai_client("key-b")
+
+    def test_rate_limit_error_detection(self):
+        """Test that SDK rate limit errors and wrapped 429s are recognized, other errors are not."""
+        response = httpx.Response(429, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+        assert is_rate_limit_error(openai.RateLimitError("Slow down", response=response, body=None))
+        assert is_rate_limit_error(RuntimeError("Error code: 429 - Too Many Requests"))
+        assert not is_rate_limit_error(RuntimeError("Connection reset"))
+
+    @pytest.mark.asyncio
+    async def test_completion_calls_share_limit(self, monkeypatch):
+        """Test that completion calls from different runners queue on one limiter."""
+        in_flight = 0
+        peak = 0
+
+        async def create(**kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+        runners = [AgentRunner("test-key"), AgentRunner("test-key")]
+        for runner in runners:
+            runner.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+        monkeypatch.setattr(openai_client_module, "_completion_limiter", rate_limit_module.ConcurrencyLimiter(1))
+        await asyncio.gather(*(r._create_completion(model="m", messages=[]) for r in runners * 2))
+        assert peak == 1
+
+    @pytest.mark.asyncio
+    async def test_prompt_cache_key_sent(self, monkeypatch):
+        """Test that calls carry a shared prompt_cache_key, except on Azure."""
+        runner = AgentRunner("test-key")
+        completions = _FakeCompletions()
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        monkeypatch.setattr(get_settings(), "azure_openai_endpoint", "")
+
+        await runner._create_completion(model="m", messages=[])
+        assert completions.requests[0]["extra_body"] == {"prompt_cache_key": "chat"}
+
+        monkeypatch.setattr(get_settings(), "azure_openai_endpoint", "https://example.openai.azure.com")
+        assert prompt_cache_options("chat") == {}
+
+    @pytest.mark.asyncio
+    async def test_v2_cache_key_per_system_prompt(self, monkeypatch):
+        """Test that v2 router and responder calls use separate prompt_cache_keys."""
+        monkeypatch.setattr(get_settings(), "azure_openai_endpoint", "")
+        runner = AgentRunnerV2("test-key")
+        runner.registry = ToolRegistry()
+
+        async def handler(args):
+            return [TextContent(text="Nidarosdomen er en katedral.")]
+
+        runner.registry.register(name="snl-search", description="", input_schema={"type": "object"}, handler=handler)
+        completions = _FakeCompletions([_tool_call("call-1", "snl-search")])
+        runner.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        events = runner.chat_stream(V2ChatRequest(message="Hei", sources=["snl"]))
+        async for event in events:
+            if isinstance(event, V2TokenEvent):
+                break
+        await events.aclose()
+        assert [r["extra_body"]["prompt_cache_key"] for r in completions.requests] == [
+            "chat-v2-router", "chat-v2-responder",
+        ]
+
+
+class TestTokenFrame:
+    """Tests for the pre-framed token SSE encoding."""
+
+    def test_matches_event_source_framing(self):
+        """Test that the fast path emits the same bytes as the generic dict path."""
+        for content in ["Hei", "Blåbær på Røros", 'quote " and\nnewline']:
+            event = TokenEvent(content=content)
+            expected = ServerSentEvent(event="token", data=event.model_dump_json()).encode()
+            assert encode_token_frame(content) == expected
+
+    def test_event_frame_matches_event_source_framing(self):
+        """Test that pre-framed events match the generic dict path, including multi-line text."""
+        events = [
+            StatusEvent(message="Søker i kilder..."),
+            ToolEndEvent(tool="snl-search", success=True, preview="linje 1\nlinje 2"),
+            DoneEvent(response=ChatResponse(response=ResponseContent(text="# Svar\n\nMed avsnitt."))),
+        ]
+        for event in events:
+            expected = ServerSentEvent(event=event.type, data=event.model_dump_json()).encode()
+            assert encode_event_frame(event) == expected
+
+    def test_error_frame_before_streaming(self, client, monkeypatch):
+        """Test that errors raised before the agent runs use the same event framing."""
+        monkeypatch.setattr(get_settings(), "openai_api_key", "")
+        response = client.post("/api/chat/stream", json={"message": "Hei"})
+        assert response.text == 'event: error\r\ndata: {"type":"error","message":"Chat service not configured"}\r\n\r\n'
+
+
+class TestCoalesceTokens:
+    """Tests for streamed token coalescing."""
+
+    @pytest.mark.asyncio
+    async def test_batches_by_count(self):
+        """Test that deltas are joined into batches of max_tokens."""
+        tokens = [f"t{i} " for i in range(10)]
+        batches = [b async for b in _coalesce_tokens(_fake_stream(tokens), max_tokens=4)]
+        assert "".join(batches) == "".join(tokens)
+        assert len(batches) == 3
+
+    @pytest.mark.asyncio
+    async def test_flushes_on_pause(self):
+        """Test that buffered text is flushed when the model pauses."""
+        stream = _fake_stream(["a", "b", "c"], pause_after=0, pause=0.2)
+        batches = [b async for b in _coalesce_tokens(stream, max_tokens=100, max_delay=0.01)]
+        assert batches == ["a", "bc"]
+
+    @pytest.mark.asyncio
+    async def test_flushes_on_paragraph_break(self):
+        """Test that a delta ending a paragraph flushes the batch."""
+        stream = _fake_stream(["Første", " avsnitt.\n\n", "Andre", " avsnitt."])
+        batches = [b async for b in _coalesce_tokens(stream, max_tokens=100)]
+        assert batches == ["Første avsnitt.\n\n", "Andre avsnitt."]
+
+    @pytest.mark.asyncio
+    async def test_skips_empty_deltas(self):
+        """Test that chunks without content are ignored."""
+        batches = [b async for b in _coalesce_tokens(_fake_stream([None, "x", ""]))]
+        assert batches == ["x"]
+    
+    @pytest.mark.asyncio
+    async def test_propagates_stream_errors(self):
+        """Test that an error raised by the upstream stream reaches the consumer."""
+        async def failing_stream():
+            yield _chunk("a")
+            raise RuntimeError("upstream closed")
+        
+        with pytest.raises(RuntimeError, match="upstream closed"):
+            async for _ in _coalesce_tokens(failing_stream(), max_tokens=100):
+                pass
+    
+    @pytest.mark.asyncio
+    async def test_producer_cancelled_on_early_exit(self):
+        """Test that closing the consumer early stops reading the stream."""
+        consumed = []
+        
+        async def endless_stream():
+            i = 0
+            while True:
+                consumed.append(i)
+                yield _chunk(str(i))
+                i += 1
+                await asyncio.sleep(0)
+        
+        batches = _coalesce_tokens(endless_stream(), max_tokens=2)
+        assert await anext(batches) == "01"
+        await batches.aclose()
+        await asyncio.sleep(0.01)
+        count = len(consumed)
+        await asyncio.sleep(0.01)
+        assert len(consumed) == count
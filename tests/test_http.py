@@ -0,0 +1,65 @@
+"""Tests for HTTP client utilities."""
+
+import time
+
+import httpx
+import pytest
+
+import src.utils.http as http_module
+from src.utils.http import WARMUP_INTERVAL, warm_connections
+
+
+class _FakeClient:
+    """Stand-in for the shared client; records HEAD requests."""
+
+    def __init__(self, failing=()):
+        self.heads = []
+        self.failing = failing
+
+    async def head(self, url):
+        self.heads.append(url)
+        if url in self.failing:
+            raise httpx.ConnectError("unreachable")
+        return httpx.Response(200)
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    """Route warmups to a fake shared client, with no origins warmed yet."""
+    client = _FakeClient(failing=("https://down.example",))
+
+    async def get_shared_client():
+        return client
+
+    monkeypatch.setattr(http_module, "get_shared_client", get_shared_client)
+    monkeypatch.setattr(http_module, "_warmed_at", {})
+    return client
+
+
+class TestWarmConnections:
+    """Tests for opening pooled connections ahead of use."""
+
+    @pytest.mark.asyncio
+    async def test_each_origin_once(self, fake_client):
+        """Test that duplicate origins get one HEAD each."""
+        await warm_connections(["https://snl.no", "https://api.ra.no", "https://snl.no"])
+        assert fake_client.heads == ["https://snl.no", "https://api.ra.no"]
+
+    @pytest.mark.asyncio
+    async def test_recently_warmed_origin_skipped(self, fake_client, monkeypatch):
+        """Test that an origin is warmed again only after the keepalive interval."""
+        now = 1000.0
+        monkeypatch.setattr(time, "monotonic", lambda: now)
+        await warm_connections(["https://snl.no"])
+        await warm_connections(["https://snl.no"])
+        assert fake_client.heads == ["https://snl.no"]
+
+        now += WARMUP_INTERVAL
+        await warm_connections(["https://snl.no"])
+        assert fake_client.heads == ["https://snl.no", "https://snl.no"]
+
+    @pytest.mark.asyncio
+    async def test_failures_ignored(self, fake_client):
+        """Test that an unreachable origin doesn't raise or stop the others."""
+        await warm_connections(["https://down.example", "https://snl.no"])
+        assert fake_client.heads == ["https://down.example", "https://snl.no"]
@@ -161,6 +161,22 @@ class TestMcpMethods:
         assert data["result"]["isError"] is False
         assert "Hello, World!" in data["result"]["content"][0]["text"]
     
+    def test_tools_call_response_is_compact_utf8(
+        self, client: TestClient, sample_jsonrpc_request
+    ):
+        """Test that tool results are sent as compact JSON without escaping non-ASCII text."""
+        response = client.post(
+            "/message",
+            json=sample_jsonrpc_request(
+                "tools/call",
+                {"name": "example-echo", "arguments": {"message": "Bryggen på Bergen"}},
+            ),
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        assert "Bryggen på Bergen".encode() in response.content
+        assert b'"jsonrpc":"2.0"' in response.content
+    
     def test_tools_call_unknown_tool(
         self, client: TestClient, sample_jsonrpc_request
     ):
@@ -0,0 +1,62 @@
+"""Tests for rate limiting utilities."""
+
+import asyncio
+import time
+
+import pytest
+
+from src.utils.rate_limit import CircuitBreaker, ConcurrencyLimiter
+
+
+class TestConcurrencyLimiter:
+    """Tests for Condition-based admission control."""
+    
+    @pytest.mark.asyncio
+    async def test_admits_up_to_limit(self):
+        """Test that the limiter blocks once the limit is reached."""
+        limiter = ConcurrencyLimiter(2)
+        await limiter.acquire()
+        await limiter.acquire()
+        assert limiter.active == 2
+        
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        
+        await limiter.release()
+        await asyncio.wait_for(waiter, timeout=1)
+        assert limiter.active == 2
+    
+    @pytest.mark.asyncio
+    async def test_context_manager_releases(self):
+        """Test that the slot is released when the block exits."""
+        limiter = ConcurrencyLimiter(1)
+        async with limiter:
+            assert limiter.active == 1
+        assert limiter.active == 0
+
+
+class TestCircuitBreaker:
+    """Tests for the router cooldown breaker."""
+    
+    def test_trip_opens_until_cooldown(self, monkeypatch):
+        """Test that a trip opens the breaker for the cooldown, on the monotonic clock."""
+        now = 1000.0
+        monkeypatch.setattr(time, "monotonic", lambda: now)
+        breaker = CircuitBreaker(cooldown_base=30, cooldown_max=600)
+        assert not breaker.is_open()
+        
+        assert breaker.trip() == 30
+        assert breaker.is_open()
+        now += 30
+        assert not breaker.is_open()
+    
+    def test_cooldown_doubles_until_reset(self):
+        """Test that repeated trips back off exponentially and a success starts over."""
+        breaker = CircuitBreaker(cooldown_base=30, cooldown_max=100)
+        assert [breaker.trip() for _ in range(4)] == [30, 60, 100, 100]
+        
+        assert breaker.reset() is True
+        assert not breaker.is_open()
+        assert breaker.reset() is False
+        assert breaker.trip() == 30
@@ -135,6 +135,28 @@ class TestToolRegistry:
         assert result.isError is False
         assert len(result.content) > 0
     
+    @pytest.mark.asyncio
+    async def test_call_tool_sync_handler_runs_off_loop(self):
+        """Test that a synchronous handler is run in the tool thread pool."""
+        import threading
+        from src.mcp.models import TextContent
+        
+        registry = ToolRegistry()
+        
+        def blocking_handler(args):
+            return [TextContent(text=threading.current_thread().name)]
+        
+        registry.register(
+            name="test-sync",
+            description="A blocking tool",
+            input_schema={"type": "object"},
+            handler=blocking_handler,
+        )
+        
+        result = await registry.call_tool("test-sync", {})
+        assert result.isError is False
+        assert result.content[0].text.startswith("mcp-tool")
+    
     @pytest.mark.asyncio
     async def test_call_tool_not_found(self):
         """Test calling a nonexistent tool."""
@@ -144,6 +166,56 @@ class TestToolRegistry:
         assert result.isError is True
         assert "not found" in result.content[0].text.lower()
     
+    def test_openai_tools_cached_until_register(self):
+        """Test that OpenAI tool definitions are cached and invalidated on register."""
+        registry = ToolRegistry()
+        register_tools(registry)
+        
+        tools = registry.openai_tools(("example-",))
+        assert {t["function"]["name"] for t in tools} == {"example-ping", "example-echo"}
+        assert registry.openai_tools(("example-",)) is tools
+        assert registry.openai_tools(("other-",)) == []
+        
+        async def dummy_handler(args):
+            return []
+        
+        registry.register(
+            name="example-new",
+            description="A new tool",
+            input_schema={"type": "object"},
+            handler=dummy_handler,
+        )
+        assert len(registry.openai_tools(("example-",))) == 3
+    
+    def test_list_tools_cached_until_register(self):
+        """Test that the MCP tool list is built once and rebuilt after a registration."""
+        registry = ToolRegistry()
+        register_tools(registry)
+        
+        tools = registry.list_tools()
+        assert registry.list_tools() is tools
+        
+        async def dummy_handler(args):
+            return []
+        
+        registry.register(
+            name="example-new",
+            description="A new tool",
+            input_schema={"type": "object"},
+            handler=dummy_handler,
+        )
+        assert [t.name for t in registry.list_tools()] == ["example-ping", "example-echo", "example-new"]
+    
+    def test_openai_definitions_shared_between_lists(self):
+        """Test that each tool's OpenAI definition is built once and reused."""
+        registry = ToolRegistry()
+        register_tools(registry)
+        
+        ping = registry.get("example-ping")
+        assert ping.openai_definition["function"]["parameters"] is ping.input_schema
+        assert ping.openai_definition in registry.openai_tools(("example-ping",))
+        assert any(t is ping.openai_definition for t in registry.openai_tools(("example-",)))
+    
     def test_tool_count(self):
         """Test tool count property."""
         registry = ToolRegistry()